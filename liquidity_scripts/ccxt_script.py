@@ -1,60 +1,81 @@
-import ccxt
+import ccxt.async_support as ccxt
 import asyncio
+from scheduler import Scheduler
+
+# In-flight requests per exchange
+EXCHANGE_CONCURRENCY = 4
+
+
+def liquidity_snapshot(exchange_id, symbol, ticker, order_book):
+    bids = order_book.get('bids', [])
+    asks = order_book.get('asks', [])
+    current_price = ticker.get('last')
+
+    # Calculate bid and ask liquidity (within 1% price range)
+    bid_liquidity = sum(volume for item in bids if len(item) >= 2 for price, volume in [item] if price >= current_price * 0.99) if current_price else 0
+    ask_liquidity = sum(volume for item in asks if len(item) >= 2 for price, volume in [item] if price <= current_price * 1.01) if current_price else 0
+    total_liquidity = bid_liquidity + ask_liquidity
+
+    return {
+        "exchange": exchange_id,
+        "symbol": symbol,
+        "bid": ticker.get('bid'),
+        "ask": ticker.get('ask'),
+        "volume": ticker.get('baseVolume'),
+        "last_price": ticker.get('last'),
+        "bid_liquidity": bid_liquidity,
+        "ask_liquidity": ask_liquidity,
+        "total_liquidity": total_liquidity
+    }
+
+
+def market_job(exchange, symbol):
+    async def fetch():
+        ticker = await exchange.fetch_ticker(symbol)
+        order_book = await exchange.fetch_order_book(symbol)
+        # Print the fetched data including liquidity
+        print(liquidity_snapshot(exchange.id, symbol, ticker, order_book))
+    return fetch
+
+
+async def load_exchange(exchange_id):
+    exchange = getattr(ccxt, exchange_id)({'enableRateLimit': True})
+    try:
+        markets = await asyncio.wait_for(exchange.load_markets(), 60)
+    except Exception as e:
+        print(f"Error fetching data from {exchange_id}: {e}")
+        await exchange.close()
+        return None, {}
+    return exchange, markets
+
 
 async def fetch_all_exchanges_data():
     """
-    Dynamically fetches data for all available exchanges and pairs at regular intervals.
+    Fetches ticker and order book liquidity for every active market of every
+    exchange ccxt supports. Exchanges are queried side by side, each within its own
+    token bucket, instead of one market at a time.
     """
+    # Dynamically get all exchanges supported by ccxt
+    loaded = await asyncio.gather(*(load_exchange(exchange_id) for exchange_id in ccxt.exchanges))
+    exchanges = [exchange for exchange, _ in loaded if exchange is not None]
+
     try:
-        # Dynamically get all exchanges supported by ccxt
-        exchange_ids = ccxt.exchanges
-
-        # Create exchange instances and fetch live data
-        for exchange_id in exchange_ids:
-            try:
-                exchange_class = getattr(ccxt, exchange_id)
-                exchange = exchange_class({'enableRateLimit': True})
-                
-                # Load markets for the exchange
-                markets = exchange.load_markets()
-                print(f"\n=== {exchange_id.upper()} ===")
-                
-                for symbol, market in markets.items():
-                    # Skip inactive markets
-                    if not market['active']:
-                        continue
-
-                    # Fetch ticker data
-                    ticker = exchange.fetch_ticker(symbol)
-
-                    # Fetch order book to calculate liquidity
-                    order_book = exchange.fetch_order_book(symbol)
-                    bids = order_book.get('bids', [])
-                    asks = order_book.get('asks', [])
-                    current_price = ticker.get('last')
-
-                    # Calculate bid and ask liquidity (within 1% price range)
-                    bid_liquidity = sum(volume for item in bids if len(item) >= 2 for price, volume in [item] if price >= current_price * 0.99) if current_price else 0
-                    ask_liquidity = sum(volume for item in asks if len(item) >= 2 for price, volume in [item] if price <= current_price * 1.01) if current_price else 0
-                    total_liquidity = bid_liquidity + ask_liquidity
-
-                    # Print the fetched data including liquidity
-                    print({
-                        "exchange": exchange_id,
-                        "symbol": symbol,
-                        "bid": ticker.get('bid'),
-                        "ask": ticker.get('ask'),
-                        "volume": ticker.get('baseVolume'),
-                        "last_price": ticker.get('last'),
-                        "bid_liquidity": bid_liquidity,
-                        "ask_liquidity": ask_liquidity,
-                        "total_liquidity": total_liquidity
-                    })
-            except Exception as e:
-                print(f"Error fetching data from {exchange_id}: {e}")
-    
+        scheduler = Scheduler()
+        for exchange, markets in loaded:
+            if exchange is None:
+                continue
+            # Each job makes two requests (ticker and order book), so it gets half the exchange's rate
+            limiter = scheduler.limiter(exchange.id, rate=1000 / exchange.rateLimit / 2, concurrency=EXCHANGE_CONCURRENCY)
+            for symbol, market in markets.items():
+                # Skip inactive markets
+                if not market.get('active'):
+                    continue
+                scheduler.add((exchange.id, symbol), market_job(exchange, symbol), limiter)
+        await scheduler.run(until_idle=True)
     except Exception as e:
         print(f"Error in fetch_all_exchanges_data: {e}")
+    finally:
+        await asyncio.gather(*(exchange.close() for exchange in exchanges), return_exceptions=True)
 
 # Run the script
 if __name__ == "__main__":
@@ -1,6 +1,7 @@
 import requests
 import os
 from dotenv import load_dotenv
+from scheduler import codex_limiter, limited_request
 from db_interface import DatabaseInterface
 
 # Load environment variables
@@ -30,7 +31,7 @@ allowed_networks = {
 # GraphQL query execution
 def execute_query(query):
     try:
-        response = requests.post(url, headers=headers, json={"query": query})
+        response = limited_request(codex_limiter(api_key), lambda: requests.post(url, headers=headers, json={"query": query}))
         response.raise_for_status()
         return response.json().get("data", {})
     except Exception as e:
@@ -3,6 +3,7 @@ import json
 import os
 from datetime import datetime, timezone
 from dotenv import load_dotenv
+from scheduler import codex_limiter, limited_request
 from db_interface import DatabaseInterface  # Import your DatabaseInterface class
 
 
@@ -42,6 +43,12 @@ def get_current_timestamp():
     """Generate the current UTC timestamp in ISO 8601 format."""
     return datetime.now(timezone.utc).isoformat()
 
+# Order-independent key of a token pair, matching the backfill in sql_scripts/dynamic_pairs_script
+def pair_key(token_name, backing_token_name):
+    if token_name is None or backing_token_name is None:
+        return None
+    return "|".join(sorted([token_name, backing_token_name]))
+
 # Function to execute GraphQL queries
 def execute_query(query):
     """
@@ -50,7 +57,7 @@ def execute_query(query):
     :return: Parsed JSON data or None if an error occurs.
     """
     try:
-        response = requests.post(url, headers=headers, json={"query": query})
+        response = limited_request(codex_limiter(api_key), lambda: requests.post(url, headers=headers, json={"query": query}))
         response.raise_for_status()
         data = response.json()
         if "errors" in data:
@@ -127,7 +134,10 @@ def get_token_prices(inputs):
     """
     variables = {"inputs": inputs}
     try:
-        response = requests.post(url, headers=headers, json={"query": query, "variables": variables})
+        response = limited_request(
+            codex_limiter(api_key),
+            lambda: requests.post(url, headers=headers, json={"query": query, "variables": variables})
+        )
         response.raise_for_status()
         data = response.json()
         if "errors" in data:
@@ -182,6 +192,7 @@ def main():
                             "fee": pair["pair"]["fee"],
                             "backing_token_address": pair["backingToken"]["address"],
                             "backing_token_name": pair["backingToken"]["name"],
+                            "pair_key": pair_key(token["name"], pair["backingToken"]["name"]),
                             "exchange_address": pair["exchange"]["address"],
                             "exchange_name": pair["exchange"]["name"],
                             "volume": pair.get("volume", 0),
@@ -6,11 +6,17 @@ from datetime import datetime
 from typing import Dict
 from dotenv import load_dotenv
 import os
+import time
 
 from consumer import KinesisConsumer, KinesisConfig
+from ohlcv_rollup import create_rollup_tables, refresh_rollups
+from ohlcv_partition import ensure_partitions
 
 load_dotenv()
 
+# Seconds between checks that upcoming monthly partitions exist
+PARTITION_CHECK_INTERVAL = 24 * 60 * 60
+
 
 Base = declarative_base()
 
@@ -51,6 +57,10 @@ class OHLCVDataConsumer:
             connect_args={'sslmode': 'require'}
         )
         Base.metadata.create_all(self.engine)
+        create_rollup_tables(self.engine)
+        # No-op until ohlcv_data has been migrated to monthly partitions
+        ensure_partitions(self.engine)
+        self.partitions_checked_at = time.monotonic()
         self.Session = sessionmaker(bind=self.engine)
         
     async def process_record(self, data: Dict) -> None:
@@ -58,6 +68,11 @@ class OHLCVDataConsumer:
             print(f'Received data: {data}')
             if not data:
                 return
+
+            # A long-running consumer would otherwise outlive the partitions made at startup
+            if time.monotonic() - self.partitions_checked_at >= PARTITION_CHECK_INTERVAL:
+                ensure_partitions(self.engine)
+                self.partitions_checked_at = time.monotonic()
             
             ohlcv_data = {
                 'exchange': data['exchange'],
@@ -92,6 +107,8 @@ class OHLCVDataConsumer:
                 }
             )
             session.execute(stmt)
+            # Keep the 5m/1h/1d rollups in step with the raw candle
+            refresh_rollups(session, data['exchange'], data['symbol'], data['timestamp'])
             session.commit()
             print(f'Inserted data for {data["exchange"]} at {data["timestamp"].isoformat()}')
             
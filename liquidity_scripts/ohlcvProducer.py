@@ -1,77 +1,148 @@
-import ccxt
+import ccxt.async_support as ccxt
 import asyncio
-from typing import List, Dict, Literal
+from typing import List, Dict, Literal, Optional
 from datetime import datetime
 from dotenv import load_dotenv
 from producer import KinesisProducer, KinesisConfig, KinesisRecord
+from scheduler import Scheduler
+from ohlcv_backfill import BACKFILL_RATE_SHARE, CANDLE_MS, create_backfiller
 import os
 
 load_dotenv()
 
 # binance rejects requests from USA IP addresses
 exchanges: List[str] = ["coinbase", "gemini", "kraken", "okx"]
+# Ordered by importance: earlier symbols win when an exchange's request budget runs short
 symbols = ['BTC/USDT', 'ETH/USDT', 'SOL/USDT', 'DOGE/USDT', 'XRP/USDT', 'SUI/USDT', 'PEPE/USDT', 'LINK/USDT']
 timeframe = '1m'
 partition_key = "ohlcv"
 
+# In-flight fetch_ohlcv calls per exchange; ccxt's rate limiter still spaces them out
+EXCHANGE_CONCURRENCY = int(os.getenv('OHLCV_EXCHANGE_CONCURRENCY', 4))
+# Seconds one fetch may take before it is abandoned for this cycle
+FETCH_TIMEOUT = float(os.getenv('OHLCV_FETCH_TIMEOUT', 10))
+# Kinesis PutRecords accepts at most 500 records per call
+KINESIS_BATCH_SIZE = 500
+# Seconds between polls of one (exchange, symbol), and between Kinesis publishes
+POLL_INTERVAL = float(os.getenv('OHLCV_POLL_INTERVAL', 60))
+PUBLISH_INTERVAL = float(os.getenv('OHLCV_PUBLISH_INTERVAL', 5))
+
+
+async def load_symbols(exchange, wanted: List[str]) -> List[str]:
+    """
+    The symbols in wanted that the exchange lists, so unsupported pairs are not
+    requested every cycle. Falls back to all of them when markets cannot be loaded.
+    """
+    try:
+        markets = await asyncio.wait_for(exchange.load_markets(), FETCH_TIMEOUT * 3)
+    except Exception as error:
+        print(f"Error loading markets from {exchange.id}: {error}")
+        return list(wanted)
+    supported = [symbol for symbol in wanted if symbol in markets]
+    skipped = len(wanted) - len(supported)
+    if skipped:
+        print(f"{exchange.id}: skipping {skipped} unlisted symbols")
+    return supported
+
+
+def newest_closed_candle(candles: List[list], now_ms: int) -> Optional[list]:
+    # The newest candle whose minute has ended on the exchange's clock
+    closed = [candle for candle in candles or [] if candle[0] + CANDLE_MS <= now_ms]
+    return closed[-1] if closed else None
+
+
+async def fetch_candle_record(exchange, symbol: str) -> Optional[KinesisRecord]:
+    """
+    The newest closed candle of symbol on exchange as a KinesisRecord, or None
+    when the exchange returns none. The last two candles are fetched, since the
+    newest one is usually the minute still open; publishing that one would store
+    it cut off wherever in the minute this pair's poll happens to fall.
+    Raises on errors and after FETCH_TIMEOUT.
+    """
+    ticker = await asyncio.wait_for(exchange.fetch_ohlcv(symbol, timeframe, None, 2), FETCH_TIMEOUT)
+    candle = newest_closed_candle(ticker, exchange.milliseconds())
+    if candle is None:  # Skip if no data
+        return None
+
+    exchange_data = {"0": candle}
+    exchange_data.update({'exchange': exchange.id, 'symbol': symbol})
+    return KinesisRecord(data=exchange_data, partition_key=partition_key)
+
+
+async def publish_records(publisher: KinesisProducer, records: List[KinesisRecord]) -> None:
+    # Flush polled candles every PUBLISH_INTERVAL, at most KINESIS_BATCH_SIZE per call
+    while True:
+        await asyncio.sleep(PUBLISH_INTERVAL)
+        while records:
+            batch = records[:KINESIS_BATCH_SIZE]
+            try:
+                await publisher.publish_batch_to_kinesis(batch)
+                print(f"Published batch of {len(batch)} records")
+                del records[:len(batch)]
+            except Exception as publish_error:
+                print(f"Failed to publish to Kinesis: {publish_error}")
+                if len(records) > KINESIS_BATCH_SIZE * 10:
+                    del records[:-KINESIS_BATCH_SIZE * 3]
+                break
+
+
+def poll_job(exchange, symbol: str, records: List[KinesisRecord]):
+    async def poll() -> None:
+        record = await fetch_candle_record(exchange, symbol)
+        if record is not None:
+            records.append(record)
+    return poll
+
 
 async def watch_pair_data(symbols: list[str]) -> None:
     config = KinesisConfig(
         stream_name=os.getenv('KINESIS_STREAM_NAME', 'liquidityxyz-master'),
         region=os.getenv('KINESIS_REGION', 'us-east-2')
     )
-    
+
     publisher = KinesisProducer(config)
-    
+
     # Initialize exchange instances
     exchange_instances = [
         getattr(ccxt, exchange_id)({'enableRateLimit': True})
         for exchange_id in exchanges
     ]
-    
+
     records: List[KinesisRecord] = []
-    
-    while True:
-        try:
-            start_time = datetime.now().timestamp() * 1000
-            
-            for symbol in symbols:
-                for exchange in exchange_instances:
-                    try:
-                        ticker = exchange.fetch_ohlcv(symbol, timeframe, None, 1)
-
-                        if not ticker:  # Skip if no data
-                            continue
-
-                        exchange_data = {"0": ticker[0]}
-                        exchange_data.update({'exchange': exchange.id, 'symbol': symbol})
-
-                        records.append(KinesisRecord(
-                            data=exchange_data,
-                            partition_key=partition_key
-                        ))
-                    except Exception as exchange_error:
-                        print(f"Error fetching from {exchange.id}: {exchange_error}")
-                        continue
-            
-            if records:
-                try:
-                    await publisher.publish_batch_to_kinesis(records)
-                    print(f"Published batch of {len(records)} records")
-                    records = []
-                except Exception as publish_error:
-                    print(f"Failed to publish to Kinesis: {publish_error}")
-                    if len(records) > len(exchanges) * 10:
-                        records = records[-len(exchanges) * 3:]
-            
-            elapsed_time = datetime.now().timestamp() * 1000 - start_time
-            wait_time = max(0, 60000 - elapsed_time)
-            if wait_time > 0:
-                await asyncio.sleep(wait_time / 1000)
-                
-        except Exception as error:
-            print(f"Main loop error: {error}")
-            await asyncio.sleep(5)
+    # Refills candles missed while the producer or consumer was down; None without a database
+    backfiller = create_backfiller()
+
+    try:
+        listed = await asyncio.gather(*(load_symbols(exchange, symbols) for exchange in exchange_instances))
+
+        # Each (exchange, symbol) is polled once per POLL_INTERVAL within a token bucket per
+        # exchange (its ccxt rateLimit), spread across the interval; the stalest and most
+        # important pairs go first when an exchange backs off after a 429/418
+        scheduler = Scheduler()
+        backfill_limiters = {}
+        for exchange, exchange_symbols in zip(exchange_instances, listed):
+            rate = 1000 / exchange.rateLimit
+            if backfiller is not None:
+                # Backfill gets a fixed slice of the exchange's budget so it never delays live polls
+                backfill_limiters[exchange.id] = scheduler.limiter(
+                    f'{exchange.id}:backfill', rate=rate * BACKFILL_RATE_SHARE, concurrency=1
+                )
+                rate *= 1 - BACKFILL_RATE_SHARE
+            limiter = scheduler.limiter(exchange.id, rate=rate, concurrency=EXCHANGE_CONCURRENCY)
+            for symbol in exchange_symbols:
+                importance = 2 - symbols.index(symbol) / len(symbols)
+                scheduler.add((exchange.id, symbol), poll_job(exchange, symbol, records), limiter,
+                              interval=POLL_INTERVAL, importance=importance)
+
+        tasks = [scheduler.run(), publish_records(publisher, records)]
+        if backfiller is not None:
+            pairs = {exchange.id: exchange_symbols for exchange, exchange_symbols in zip(exchange_instances, listed)}
+            tasks.append(backfiller.run(exchange_instances, backfill_limiters, pairs))
+        await asyncio.gather(*tasks)
+    finally:
+        await asyncio.gather(*(exchange.close() for exchange in exchange_instances), return_exceptions=True)
+        if backfiller is not None:
+            backfiller.engine.dispose()
 
 if __name__ == "__main__":
     try:
@@ -79,4 +150,4 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         print("Shutting down...")
     except Exception as e:
-        print(f"Fatal error: {e}")
\ No newline at end of file
+        print(f"Fatal error: {e}")
@@ -0,0 +1,287 @@
+import ccxt.pro as ccxtpro
+import ccxt.async_support as ccxt
+import argparse
+import asyncio
+import json
+import time
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+from producer import KinesisProducer, KinesisConfig, KinesisRecord
+from ohlcvProducer import (
+    EXCHANGE_CONCURRENCY, FETCH_TIMEOUT, KINESIS_BATCH_SIZE, exchanges, load_symbols, newest_closed_candle, partition_key,
+    symbols, timeframe
+)
+from scheduler import TokenBucket, is_rate_limited, retry_after
+import os
+
+load_dotenv()
+
+CANDLE_MS = 60000
+# A candle with no newer update is published this many seconds after its minute ends
+CLOSE_GRACE = float(os.getenv('OHLCV_CLOSE_GRACE', 5))
+# Consecutive stream errors after which a pair falls back to REST polling
+MAX_STREAM_ERRORS = int(os.getenv('OHLCV_STREAM_MAX_ERRORS', 5))
+# How long a pair polls over REST before trying its stream again
+STREAM_RETRY_SECONDS = float(os.getenv('OHLCV_STREAM_RETRY_SECONDS', 300))
+# Every trade/candle update received is appended here as JSON lines, for ohlcv_replay.py
+RECORD_PATH = os.getenv('OHLCV_RECORD_PATH')
+# ws:// address of ohlcv_replay.py to use instead of the exchanges
+REPLAY_URL = os.getenv('OHLCV_REPLAY_URL')
+
+
+class CandleBuilder:
+    def __init__(self):
+        """
+        The open 1m candle of one (exchange, symbol), fed either by exchange candle
+        updates or by trades, returning each candle once when it closes. Updates
+        for minutes already closed are dropped.
+        """
+        self.candle: Optional[List[float]] = None
+        self.closed_until = 0
+        self.late = 0
+
+    def _advance(self, timestamp: int) -> List[list]:
+        # Close the open candle when an update for a later minute arrives
+        if self.candle is not None and timestamp > self.candle[0]:
+            closed, self.candle = self.candle, None
+            self.closed_until = closed[0] + CANDLE_MS
+            return [closed]
+        return []
+
+    def update_candle(self, candle: list) -> List[list]:
+        """
+        Apply an exchange [timestamp, open, high, low, close, volume] update.
+        """
+        timestamp = int(candle[0])
+        if timestamp < self.closed_until or (self.candle is not None and timestamp < self.candle[0]):
+            self.late += 1
+            return []
+        closed = self._advance(timestamp)
+        self.candle = [timestamp] + list(candle[1:6])
+        return closed
+
+    def add_trade(self, timestamp: int, price: float, amount: float) -> List[list]:
+        """
+        Fold one trade into the candle of its minute.
+        """
+        minute = int(timestamp) // CANDLE_MS * CANDLE_MS
+        if minute < self.closed_until or (self.candle is not None and minute < self.candle[0]):
+            self.late += 1
+            return []
+        closed = self._advance(minute)
+        if self.candle is None:
+            self.candle = [minute, price, price, price, price, amount]
+        else:
+            self.candle[2] = max(self.candle[2], price)
+            self.candle[3] = min(self.candle[3], price)
+            self.candle[4] = price
+            self.candle[5] += amount
+        return closed
+
+    def skip_until(self, timestamp: int) -> None:
+        """
+        Drop the open candle if it starts before timestamp and ignore later updates
+        for those minutes, once they have been published from another source.
+        """
+        if self.candle is not None and self.candle[0] < timestamp:
+            self.candle = None
+        self.closed_until = max(self.closed_until, timestamp)
+
+    def close_due(self, now_ms: float) -> List[list]:
+        """
+        Close the open candle once its minute has been over for CLOSE_GRACE seconds.
+        """
+        if self.candle is not None and now_ms >= self.candle[0] + CANDLE_MS + CLOSE_GRACE * 1000:
+            return self._advance(self.candle[0] + CANDLE_MS)
+        return []
+
+
+class CandlePublisher:
+    def __init__(self, publisher: Optional[KinesisProducer]):
+        """
+        Publishes closed candles as soon as they arrive, batching whatever is queued
+        at that moment. With no publisher (--dry-run) candles are printed instead.
+        """
+        self.publisher = publisher
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    def emit(self, exchange_id: str, symbol: str, candles: List[list]) -> None:
+        for candle in candles:
+            self.queue.put_nowait(KinesisRecord(
+                data={"0": candle, 'exchange': exchange_id, 'symbol': symbol},
+                partition_key=partition_key
+            ))
+
+    async def run(self) -> None:
+        while True:
+            records = [await self.queue.get()]
+            while not self.queue.empty() and len(records) < KINESIS_BATCH_SIZE:
+                records.append(self.queue.get_nowait())
+            if self.publisher is None:
+                for record in records:
+                    print(json.dumps(record.data))
+                continue
+            try:
+                await self.publisher.publish_batch_to_kinesis(records)
+                print(f"Published batch of {len(records)} records")
+            except Exception as publish_error:
+                print(f"Failed to publish to Kinesis: {publish_error}")
+                # Put them back in front of newer candles and give the stream a moment
+                pending = records + [self.queue.get_nowait() for _ in range(self.queue.qsize())]
+                for record in pending[-KINESIS_BATCH_SIZE * 10:]:
+                    self.queue.put_nowait(record)
+                await asyncio.sleep(1)
+
+
+def record_updates(exchange_id: str, channel: str, symbol: str, data: list) -> None:
+    if RECORD_PATH:
+        with open(RECORD_PATH, 'a') as f:
+            f.write(json.dumps({
+                "t": int(time.time() * 1000), "exchange": exchange_id, "channel": channel, "symbol": symbol, "data": data
+            }) + "\n")
+
+
+async def stream_candles(exchange, symbol: str, builder: CandleBuilder, output: CandlePublisher) -> None:
+    candles = await exchange.watch_ohlcv(symbol, timeframe)
+    record_updates(exchange.id, "ohlcv", symbol, candles)
+    for candle in sorted(candles, key=lambda candle: candle[0]):
+        output.emit(exchange.id, symbol, builder.update_candle(candle))
+
+
+async def stream_trades(exchange, symbol: str, builder: CandleBuilder, output: CandlePublisher) -> None:
+    trades = await exchange.watch_trades(symbol)
+    trades = [
+        {'id': trade.get('id'), 'timestamp': trade['timestamp'], 'price': trade['price'], 'amount': trade['amount']}
+        for trade in trades if trade.get('timestamp') is not None
+    ]
+    record_updates(exchange.id, "trades", symbol, trades)
+    for trade in sorted(trades, key=lambda trade: trade['timestamp']):
+        output.emit(exchange.id, symbol, builder.add_trade(trade['timestamp'], trade['price'], trade['amount']))
+
+
+async def fetch_closed_candle(exchange, limiter: TokenBucket, symbol: str) -> Optional[list]:
+    """
+    The newest candle of symbol whose minute is over, or None. The last two
+    candles are fetched, since the newest one is usually the minute just opened.
+    """
+    await limiter.acquire()
+    try:
+        candles = await asyncio.wait_for(exchange.fetch_ohlcv(symbol, timeframe, None, 2), FETCH_TIMEOUT)
+    except Exception as fetch_error:
+        if is_rate_limited(fetch_error):
+            limiter.on_rate_limit(retry_after(fetch_error))
+        print(f"Error fetching {symbol} from {exchange.id}: {fetch_error}")
+        return None
+    finally:
+        limiter.release()
+    limiter.on_success()
+    return newest_closed_candle(candles, exchange.milliseconds())
+
+
+async def poll_rest(exchange, limiter: TokenBucket, symbol: str, builder: CandleBuilder, output: CandlePublisher,
+                    until: float) -> None:
+    # Once a minute, just after it ends, publish the minute that closed
+    published = 0
+    while time.time() < until:
+        candle = await fetch_closed_candle(exchange, limiter, symbol)
+        if candle is not None and candle[0] > published:
+            published = candle[0]
+            # The REST candle is complete; whatever the stream had built for it is not
+            builder.skip_until(candle[0] + CANDLE_MS)
+            output.emit(exchange.id, symbol, [candle])
+        await wait_for_next_minute()
+
+
+async def wait_for_next_minute() -> None:
+    # Until just after the next minute starts, when the one before has closed
+    await asyncio.sleep(CANDLE_MS / 1000 - time.time() % (CANDLE_MS / 1000) + 1)
+
+
+async def run_pair(exchange, limiter: TokenBucket, symbol: str, builder: CandleBuilder,
+                   output: CandlePublisher) -> None:
+    """
+    Stream one pair's candles, or trades when the exchange has no candle feed,
+    dropping to REST polling for STREAM_RETRY_SECONDS after repeated failures.
+    """
+    if exchange.has.get('watchOHLCV'):
+        stream = stream_candles
+    elif exchange.has.get('watchTrades'):
+        stream = stream_trades
+    else:
+        print(f"{exchange.id} has no WebSocket feed, polling {symbol} over REST")
+        await poll_rest(exchange, limiter, symbol, builder, output, float('inf'))
+        return
+
+    errors = 0
+    while True:
+        try:
+            await stream(exchange, symbol, builder, output)
+            errors = 0
+        except asyncio.CancelledError:
+            raise
+        except Exception as stream_error:
+            errors += 1
+            print(f"Error streaming {symbol} from {exchange.id}: {stream_error}")
+            if errors < MAX_STREAM_ERRORS:
+                await asyncio.sleep(min(2 ** errors, 30))
+                continue
+            print(f"Falling back to REST for {symbol} on {exchange.id} for {STREAM_RETRY_SECONDS:.0f}s")
+            await poll_rest(exchange, limiter, symbol, builder, output, time.time() + STREAM_RETRY_SECONDS)
+            errors = 0
+
+
+async def close_quiet_candles(builders: Dict[tuple, CandleBuilder], output: CandlePublisher) -> None:
+    # Publish candles of pairs that went quiet instead of waiting for their next update
+    while True:
+        now_ms = time.time() * 1000
+        for (exchange_id, symbol), builder in builders.items():
+            output.emit(exchange_id, symbol, builder.close_due(now_ms))
+        await asyncio.sleep(1)
+
+
+def create_exchange(exchange_id: str):
+    if REPLAY_URL:
+        from ohlcv_replay import ReplayExchange
+        return ReplayExchange(exchange_id, REPLAY_URL)
+    # Exchanges ccxt.pro does not cover get a plain async client and are polled over REST
+    exchange_class = getattr(ccxtpro, exchange_id, None) or getattr(ccxt, exchange_id)
+    return exchange_class({'enableRateLimit': True, 'newUpdates': True})
+
+
+async def stream_pair_data(symbols: list[str], dry_run: bool = False) -> None:
+    publisher = None
+    if not dry_run:
+        publisher = KinesisProducer(KinesisConfig(
+            stream_name=os.getenv('KINESIS_STREAM_NAME', 'liquidityxyz-master'),
+            region=os.getenv('KINESIS_REGION', 'us-east-2')
+        ))
+    output = CandlePublisher(publisher)
+
+    exchange_instances = [create_exchange(exchange_id) for exchange_id in exchanges]
+    try:
+        listed = await asyncio.gather(*(load_symbols(exchange, symbols) for exchange in exchange_instances))
+        builders = {}
+        tasks = [asyncio.create_task(output.run())]
+        for exchange, exchange_symbols in zip(exchange_instances, listed):
+            # REST requests of the exchange's pairs share one bucket, as in ohlcvProducer.py
+            limiter = TokenBucket(1000 / exchange.rateLimit, concurrency=EXCHANGE_CONCURRENCY)
+            for symbol in exchange_symbols:
+                builder = builders[(exchange.id, symbol)] = CandleBuilder()
+                tasks.append(asyncio.create_task(run_pair(exchange, limiter, symbol, builder, output)))
+        # Recorded feeds carry past timestamps, so a replayed candle only closes on its next update
+        if not REPLAY_URL:
+            tasks.append(asyncio.create_task(close_quiet_candles(builders, output)))
+        await asyncio.gather(*tasks)
+    finally:
+        await asyncio.gather(*(exchange.close() for exchange in exchange_instances), return_exceptions=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Stream closed 1m candles from exchange WebSockets to Kinesis')
+    parser.add_argument('--dry-run', action='store_true', help='Print candles instead of publishing them')
+    args = parser.parse_args()
+    try:
+        asyncio.run(stream_pair_data(symbols, args.dry_run))
+    except KeyboardInterrupt:
+        print("Shutting down...")
+    except Exception as e:
+        print(f"Fatal error: {e}")
@@ -0,0 +1,279 @@
+from sqlalchemy import create_engine, text
+from psycopg2.extras import execute_values
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+import argparse
+import asyncio
+import os
+import time
+
+from ohlcv_rollup import refresh_rollup_range
+from scheduler import TokenBucket, is_rate_limited, retry_after
+
+load_dotenv()
+
+CANDLE_MS = 60000
+# Set OHLCV_BACKFILL=false to stop ohlcvProducer.py from backfilling
+BACKFILL_ENABLED = os.getenv('OHLCV_BACKFILL', 'true').lower() != 'false'
+# Seconds between gap scans, and how far back each scan looks
+BACKFILL_INTERVAL = float(os.getenv('OHLCV_BACKFILL_INTERVAL', 900))
+BACKFILL_LOOKBACK_HOURS = float(os.getenv('OHLCV_BACKFILL_LOOKBACK_HOURS', 24))
+# Share of each exchange's request rate reserved for backfill; live polling keeps the rest
+BACKFILL_RATE_SHARE = float(os.getenv('OHLCV_BACKFILL_RATE_SHARE', 0.2))
+# Candles asked for per fetch_ohlcv page; exchanges with a lower cap just return fewer
+PAGE_LIMIT = int(os.getenv('OHLCV_BACKFILL_PAGE_LIMIT', 1000))
+FETCH_TIMEOUT = float(os.getenv('OHLCV_FETCH_TIMEOUT', 10))
+# Minutes before now that are not treated as missing yet; the live poll may still deliver them
+SETTLE_MINUTES = 2
+
+# Each gap is the stretch between a candle and the next one of its pair (or until, for the
+# newest candle). Comparing neighbouring rows with LEAD reads the unique (exchange, symbol,
+# timestamp) index once, instead of anti-joining a generate_series row for every minute.
+# Every requested pair is seeded with its last candle before since (NULL if it has none), so
+# an outage that began before the window, or a pair with no candles in it, starts a gap at since.
+GAPS_QUERY = text("""
+    WITH pairs AS (
+        SELECT * FROM unnest(CAST(:exchanges AS TEXT[]), CAST(:symbols AS TEXT[])) AS p(exchange, symbol)
+    ),
+    candles AS (
+        SELECT p.exchange, p.symbol, previous.timestamp
+        FROM pairs p
+        CROSS JOIN LATERAL (
+            SELECT MAX(o.timestamp) AS timestamp
+            FROM ohlcv_data o
+            WHERE o.exchange = p.exchange AND o.symbol = p.symbol AND o.timestamp < :since
+        ) previous
+        UNION ALL
+        SELECT o.exchange, o.symbol, o.timestamp
+        FROM ohlcv_data o
+        JOIN pairs p ON p.exchange = o.exchange AND p.symbol = o.symbol
+        WHERE o.timestamp >= :since AND o.timestamp < :until
+    )
+    SELECT exchange, symbol, gap_start, gap_end
+    FROM (
+        SELECT exchange,
+               symbol,
+               GREATEST(COALESCE(timestamp + INTERVAL '1 minute', :since), :since) AS gap_start,
+               COALESCE(LEAD(timestamp) OVER (PARTITION BY exchange, symbol ORDER BY timestamp NULLS FIRST), :until) AS gap_end
+        FROM candles
+    ) gaps
+    WHERE gap_end > gap_start
+    ORDER BY gap_end DESC;
+""")
+
+# Backfill only covers the ccxt exchanges' candles. Those never carry liquidity or network_id
+# (ohlcvProducer publishes bare 6-field candles), so both stay NULL as on the live path and an
+# existing row's values are left alone.
+UPSERT_QUERY = """
+    INSERT INTO ohlcv_data (exchange, symbol, timestamp, open_price, high_price, low_price, close_price, volume)
+    VALUES %s
+    ON CONFLICT (exchange, symbol, timestamp) DO UPDATE SET
+        open_price = EXCLUDED.open_price,
+        high_price = EXCLUDED.high_price,
+        low_price = EXCLUDED.low_price,
+        close_price = EXCLUDED.close_price,
+        volume = EXCLUDED.volume;
+"""
+
+
+def to_ms(timestamp: datetime) -> int:
+    # ohlcv_data holds naive local times (datetime.fromtimestamp in the consumer)
+    return int(timestamp.timestamp() * 1000)
+
+
+async def fetch_pages(exchange, limiter: TokenBucket, symbol: str, start_ms: int, end_ms: int,
+                      timeframe: str = '1m', step_ms: int = CANDLE_MS):
+    """
+    Yield pages of timeframe candles of symbol in [start_ms, end_ms), paging
+    fetch_ohlcv forward from the last candle received as historicalData.js does.
+    Every page takes a token from limiter; rate-limit errors back it off and
+    retry the page.
+    """
+    since = start_ms
+    rate_limited = 0
+    while since < end_ms:
+        await limiter.acquire()
+        try:
+            page = await asyncio.wait_for(exchange.fetch_ohlcv(symbol, timeframe, since, PAGE_LIMIT), FETCH_TIMEOUT)
+        except Exception as error:
+            if not is_rate_limited(error) or rate_limited >= 5:
+                raise
+            rate_limited += 1
+            limiter.on_rate_limit(retry_after(error))
+            continue
+        finally:
+            limiter.release()
+        limiter.on_success()
+        rate_limited = 0
+
+        if not page:
+            return
+        candles = [candle for candle in page if since <= candle[0] < end_ms]
+        if candles:
+            yield candles
+        # Stop when the exchange makes no progress rather than on a short page
+        if page[-1][0] < since:
+            return
+        since = page[-1][0] + step_ms
+
+
+async def fetch_range(exchange, limiter: TokenBucket, symbol: str, start_ms: int, end_ms: int) -> List[list]:
+    """
+    All 1m candles of symbol in [start_ms, end_ms), see fetch_pages().
+    """
+    candles = {}
+    async for page in fetch_pages(exchange, limiter, symbol, start_ms, end_ms):
+        for candle in page:
+            candles[candle[0]] = candle
+    return [candles[timestamp] for timestamp in sorted(candles)]
+
+
+class GapBackfiller:
+    def __init__(self, engine, lookback_hours: float = BACKFILL_LOOKBACK_HOURS):
+        """
+        Finds minutes missing from ohlcv_data per (exchange, symbol) and fills
+        them from the exchange's REST history, upserting the candles and their
+        rollups. A gap that was already fetched is not requested again, since
+        illiquid pairs legitimately have minutes without a candle.
+        """
+        self.engine = engine
+        self.lookback = timedelta(hours=lookback_hours)
+        self.attempted: Dict[tuple, List[tuple]] = {}
+        self.filled = 0
+
+    def find_gaps(self, pairs: Dict[str, List[str]]) -> List[tuple]:
+        """
+        (exchange, symbol, gap_start, gap_end) for each missing run of minutes in
+        the lookback window, newest first, skipping runs already fetched.
+        :param pairs: {exchange id: symbols it lists}
+        """
+        exchange_ids = [exchange_id for exchange_id, symbols in pairs.items() for _ in symbols]
+        symbols = [symbol for exchange_symbols in pairs.values() for symbol in exchange_symbols]
+        now = datetime.fromtimestamp(time.time() // 60 * 60)
+        until = now - timedelta(minutes=SETTLE_MINUTES)
+        since = now - self.lookback
+        with self.engine.connect() as conn:
+            gaps = conn.execute(GAPS_QUERY, {
+                'since': since, 'until': until, 'exchanges': exchange_ids, 'symbols': symbols
+            }).fetchall()
+
+        for key, ranges in self.attempted.items():
+            self.attempted[key] = [(start, end) for start, end in ranges if end > since]
+        return [
+            (exchange_id, symbol, start, end) for exchange_id, symbol, start, end in gaps
+            if not any(s <= start and end <= e for s, e in self.attempted.get((exchange_id, symbol), []))
+        ]
+
+    def write(self, exchange_id: str, symbol: str, candles: List[list], start: datetime, end: datetime) -> None:
+        """
+        Bulk upsert candles and rebuild the rollup buckets they touch, in one transaction.
+        """
+        rows = [
+            (exchange_id, symbol, datetime.fromtimestamp(candle[0] / 1000), *candle[1:6])
+            for candle in candles
+        ]
+        with self.engine.begin() as conn:
+            with conn.connection.cursor() as cur:
+                execute_values(cur, UPSERT_QUERY, rows, page_size=1000)
+            refresh_rollup_range(conn, exchange_id, symbol, start, end)
+
+    async def backfill_exchange(self, exchange, limiter: TokenBucket, gaps: List[tuple]) -> None:
+        for exchange_id, symbol, start, end in gaps:
+            try:
+                candles = await fetch_range(exchange, limiter, symbol, to_ms(start), to_ms(end))
+                if candles:
+                    await asyncio.to_thread(self.write, exchange_id, symbol, candles, start, end)
+                    self.filled += len(candles)
+                self.attempted.setdefault((exchange_id, symbol), []).append((start, end))
+                print(f"Backfilled {len(candles)} candles for {symbol} on {exchange_id} "
+                      f"({start.isoformat()} - {end.isoformat()})")
+            except Exception as error:
+                print(f"Error backfilling {symbol} on {exchange_id}: {error}")
+
+    async def fill(self, exchanges: list, limiters: Dict[str, TokenBucket], pairs: Dict[str, List[str]]) -> None:
+        """
+        One scan: find the gaps and backfill them, exchanges side by side and each
+        exchange's gaps one at a time within its limiter.
+        :param pairs: {exchange id: symbols it lists}
+        """
+        by_id = {exchange.id: exchange for exchange in exchanges}
+        gaps = await asyncio.to_thread(self.find_gaps, pairs)
+        if not gaps:
+            return
+        print(f"Found {len(gaps)} gaps in ohlcv_data")
+        per_exchange: Dict[str, List[tuple]] = {}
+        for gap in gaps:
+            per_exchange.setdefault(gap[0], []).append(gap)
+        await asyncio.gather(*(
+            self.backfill_exchange(by_id[exchange_id], limiters[exchange_id], exchange_gaps)
+            for exchange_id, exchange_gaps in per_exchange.items()
+        ))
+
+    async def run(self, exchanges: list, limiters: Dict[str, TokenBucket], pairs: Dict[str, List[str]],
+                  interval: float = BACKFILL_INTERVAL) -> None:
+        """
+        fill() now and then every interval seconds.
+        """
+        while True:
+            try:
+                await self.fill(exchanges, limiters, pairs)
+            except Exception as error:
+                print(f"Error scanning ohlcv_data for gaps: {error}")
+            await asyncio.sleep(interval)
+
+
+def create_backfiller(lookback_hours: float = BACKFILL_LOOKBACK_HOURS) -> Optional[GapBackfiller]:
+    """
+    A GapBackfiller on the DB_* database, or None when backfill is disabled or no
+    database is configured.
+    """
+    if not BACKFILL_ENABLED or not os.getenv('DB_HOST'):
+        return None
+    db_user = os.getenv('DB_USER')
+    db_password = os.getenv('DB_PASSWORD')
+    db_host = os.getenv('DB_HOST')
+    db_port = 5432
+    db_name = os.getenv('DB_NAME')
+    engine = create_engine(
+        f'postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}',
+        connect_args={'sslmode': 'require'}
+    )
+    return GapBackfiller(engine, lookback_hours)
+
+
+async def backfill_once(exchange_ids: List[str], symbols: List[str], hours: float, rate_share: float) -> None:
+    import ccxt.async_support as ccxt
+
+    backfiller = create_backfiller(hours)
+    if backfiller is None:
+        print('Set DB_HOST (and OHLCV_BACKFILL is not false) to backfill')
+        return
+    exchanges = [getattr(ccxt, exchange_id)({'enableRateLimit': True}) for exchange_id in exchange_ids]
+    limiters = {
+        exchange.id: TokenBucket(1000 / exchange.rateLimit * rate_share, concurrency=1)
+        for exchange in exchanges
+    }
+    try:
+        pairs = {}
+        for exchange in exchanges:
+            markets = await exchange.load_markets()
+            pairs[exchange.id] = [symbol for symbol in symbols if symbol in markets]
+        await backfiller.fill(exchanges, limiters, pairs)
+        print(f"Backfilled {backfiller.filled} candles")
+    finally:
+        await asyncio.gather(*(exchange.close() for exchange in exchanges), return_exceptions=True)
+        backfiller.engine.dispose()
+
+
+if __name__ == "__main__":
+    from ohlcvProducer import exchanges as default_exchanges, symbols as default_symbols
+
+    parser = argparse.ArgumentParser(description='Find and backfill missing 1m candles in ohlcv_data')
+    parser.add_argument('--hours', type=float, default=BACKFILL_LOOKBACK_HOURS, help='How far back to look for gaps')
+    parser.add_argument('--exchanges', default=','.join(default_exchanges))
+    parser.add_argument('--symbols', default=','.join(default_symbols))
+    parser.add_argument('--rate-share', type=float, default=1.0,
+                        help="Share of each exchange's rate limit to use (lower it while the producer runs)")
+    args = parser.parse_args()
+    asyncio.run(backfill_once(args.exchanges.split(','), args.symbols.split(','), args.hours, args.rate_share))
@@ -0,0 +1,293 @@
+from sqlalchemy import create_engine, text
+from datetime import datetime
+from typing import List, Optional
+from dotenv import load_dotenv
+import argparse
+import asyncio
+import io
+import os
+import time
+
+import ccxt.async_support as ccxt
+
+from ohlcv_backfill import PAGE_LIMIT, fetch_pages, to_ms
+from ohlcv_partition import ensure_partitions
+from ohlcv_rollup import ROLLUP_LEVELS, create_rollup_tables, refresh_rollup_range
+from scheduler import TokenBucket
+
+load_dotenv()
+
+# timeframe -> (table its candles go to, candle length in ms)
+TIMEFRAMES = {
+    '1m': ('ohlcv_data', 60000),
+    '5m': ('ohlcv_data_5m', 300000),
+    '1h': ('ohlcv_data_1h', 3600000),
+    '1d': ('ohlcv_data_1d', 86400000),
+}
+COLUMNS = 'exchange, symbol, timestamp, open_price, high_price, low_price, close_price, volume'
+
+# next_since is the first candle (ms) not imported yet, so a rerun carries on from there
+PROGRESS_DDL = text("""
+    CREATE TABLE IF NOT EXISTS ohlcv_import_progress (
+        exchange VARCHAR(50) NOT NULL,
+        symbol VARCHAR(20) NOT NULL,
+        timeframe VARCHAR(8) NOT NULL,
+        next_since BIGINT NOT NULL,
+        imported BIGINT NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (exchange, symbol, timeframe)
+    );
+""")
+
+PROGRESS_QUERY = text("""
+    SELECT next_since FROM ohlcv_import_progress
+    WHERE exchange = :exchange AND symbol = :symbol AND timeframe = :timeframe;
+""")
+
+PROGRESS_UPSERT = text("""
+    INSERT INTO ohlcv_import_progress (exchange, symbol, timeframe, next_since, imported)
+    VALUES (:exchange, :symbol, :timeframe, :next_since, :imported)
+    ON CONFLICT (exchange, symbol, timeframe) DO UPDATE SET
+        next_since = EXCLUDED.next_since,
+        imported = ohlcv_import_progress.imported + EXCLUDED.imported,
+        updated_at = CURRENT_TIMESTAMP;
+""")
+
+# Per connection, emptied by every commit
+STAGING_DDL = text("""
+    CREATE TEMP TABLE IF NOT EXISTS ohlcv_import_staging (
+        exchange VARCHAR(50),
+        symbol VARCHAR(20),
+        timestamp TIMESTAMP,
+        open_price NUMERIC,
+        high_price NUMERIC,
+        low_price NUMERIC,
+        close_price NUMERIC,
+        volume NUMERIC
+    ) ON COMMIT DELETE ROWS;
+""")
+
+
+def merge_sql(table: str, step_ms: int):
+    """
+    Upsert everything staged into table in one statement. Rollup tables also
+    get the number of 1m candles a full bucket holds.
+    """
+    rollup = table != 'ohlcv_data'
+    count_column = ', candle_count' if rollup else ''
+    count_value = f', {step_ms // 60000}' if rollup else ''
+    # A bucket the live refresh built from a partial minute set is now complete
+    count_update = ',\n            candle_count = EXCLUDED.candle_count' if rollup else ''
+    return text(f"""
+        INSERT INTO {table} ({COLUMNS}{count_column})
+        SELECT DISTINCT ON (exchange, symbol, timestamp) {COLUMNS}{count_value}
+        FROM ohlcv_import_staging
+        ORDER BY exchange, symbol, timestamp
+        ON CONFLICT (exchange, symbol, timestamp) DO UPDATE SET
+            open_price = EXCLUDED.open_price,
+            high_price = EXCLUDED.high_price,
+            low_price = EXCLUDED.low_price,
+            close_price = EXCLUDED.close_price,
+            volume = EXCLUDED.volume{count_update};
+    """)
+
+
+def levels_above(table: str):
+    # The rollup levels built from table, directly or indirectly
+    if table == 'ohlcv_data':
+        return ROLLUP_LEVELS
+    targets = [target for target, _, _ in ROLLUP_LEVELS]
+    return ROLLUP_LEVELS[targets.index(table) + 1:]
+
+
+def copy_buffer(exchange_id: str, symbol: str, candles: List[list]) -> io.StringIO:
+    # COPY text format: tab separated, \N for NULL
+    buffer = io.StringIO()
+    for candle in candles:
+        values = [exchange_id, symbol, datetime.fromtimestamp(candle[0] / 1000).isoformat()]
+        values += ['\\N' if value is None else repr(value) for value in candle[1:6]]
+        buffer.write('\t'.join(values) + '\n')
+    buffer.seek(0)
+    return buffer
+
+
+class OHLCVImporter:
+    def __init__(self, engine, chunk_rows: int = 50000, rollups: bool = True):
+        """
+        Imports exchange history into ohlcv_data (or a rollup table, for coarser
+        timeframes). Pages are buffered into chunks of chunk_rows candles; each
+        chunk is COPYed into a temporary staging table and merged with one upsert,
+        in the same transaction that rebuilds its rollups and records progress.
+        :param rollups: Rebuild the coarser rollups per chunk; without it run ohlcv_rollup.py afterwards
+        """
+        self.engine = engine
+        self.chunk_rows = chunk_rows
+        self.rollups = rollups
+        self.imported = 0
+
+    def setup(self, timeframes: List[str], since: datetime) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(PROGRESS_DDL)
+        create_rollup_tables(self.engine)
+        if '1m' in timeframes:
+            # No-op until ohlcv_data has been migrated to monthly partitions
+            ensure_partitions(self.engine, since=since)
+
+    def progress(self, exchange_id: str, symbol: str, timeframe: str) -> Optional[int]:
+        with self.engine.connect() as conn:
+            return conn.execute(PROGRESS_QUERY, {
+                'exchange': exchange_id, 'symbol': symbol, 'timeframe': timeframe
+            }).scalar()
+
+    def write_chunk(self, exchange_id: str, symbol: str, timeframe: str, candles: List[list], next_since: int) -> None:
+        table, step_ms = TIMEFRAMES[timeframe]
+        with self.engine.begin() as conn:
+            if candles:
+                conn.execute(STAGING_DDL)
+                with conn.connection.cursor() as cur:
+                    cur.copy_expert(f"COPY ohlcv_import_staging ({COLUMNS}) FROM STDIN",
+                                    copy_buffer(exchange_id, symbol, candles))
+                conn.execute(merge_sql(table, step_ms))
+                if self.rollups:
+                    refresh_rollup_range(
+                        conn, exchange_id, symbol,
+                        datetime.fromtimestamp(candles[0][0] / 1000),
+                        datetime.fromtimestamp((candles[-1][0] + step_ms) / 1000),
+                        levels_above(table)
+                    )
+            conn.execute(PROGRESS_UPSERT, {
+                'exchange': exchange_id, 'symbol': symbol, 'timeframe': timeframe,
+                'next_since': next_since, 'imported': len(candles)
+            })
+        self.imported += len(candles)
+
+    async def import_pair(self, exchange, limiter: TokenBucket, symbol: str, timeframe: str,
+                          since_ms: int, until_ms: int, restart: bool = False) -> None:
+        """
+        Import [since_ms, until_ms) of one pair, or the part after its recorded
+        progress. Fetching carries on while the previous chunk is being written.
+        """
+        step_ms = TIMEFRAMES[timeframe][1]
+        start = since_ms
+        if not restart:
+            next_since = await asyncio.to_thread(self.progress, exchange.id, symbol, timeframe)
+            if next_since is not None:
+                start = max(start, next_since)
+        if start >= until_ms:
+            print(f"{symbol} {timeframe} on {exchange.id} is already imported")
+            return
+
+        # Progress only moves past candles actually received. When the first page starts more
+        # than a page after start, the exchange either ignored since (kraken only serves its
+        # newest 720 candles) or has no older history; what came back is kept, but start stays
+        # the recorded progress so the skipped range is never counted as imported.
+        hold_progress = False
+        chunk, pending, received = [], None, 0
+        async for page in fetch_pages(exchange, limiter, symbol, start, until_ms, timeframe, step_ms):
+            if not received and page[0][0] - start > step_ms * PAGE_LIMIT:
+                hold_progress = True
+                print(f"Warning: {exchange.id} returned {symbol} {timeframe} candles from "
+                      f"{datetime.fromtimestamp(page[0][0] / 1000).isoformat()}, not "
+                      f"{datetime.fromtimestamp(start / 1000).isoformat()}; the range before is not marked imported")
+            received += len(page)
+            chunk.extend(page)
+            if len(chunk) >= self.chunk_rows:
+                if pending is not None:
+                    await pending
+                next_since = start if hold_progress else chunk[-1][0] + step_ms
+                pending = asyncio.create_task(asyncio.to_thread(
+                    self.write_chunk, exchange.id, symbol, timeframe, chunk, next_since
+                ))
+                print(f"{symbol} {timeframe} on {exchange.id}: "
+                      f"imported up to {datetime.fromtimestamp(chunk[-1][0] / 1000).isoformat()}")
+                chunk = []
+        if pending is not None:
+            await pending
+        if chunk:
+            next_since = start if hold_progress else chunk[-1][0] + step_ms
+            await asyncio.to_thread(self.write_chunk, exchange.id, symbol, timeframe, chunk, next_since)
+        if not received:
+            print(f"{exchange.id} returned no {symbol} {timeframe} candles after "
+                  f"{datetime.fromtimestamp(start / 1000).isoformat()}")
+            return
+        print(f"Finished {symbol} {timeframe} on {exchange.id}")
+
+    async def run(self, exchanges: list, symbols: List[str], timeframes: List[str], since: datetime,
+                  until: datetime, concurrency: int = 8, rate_share: float = 1.0, restart: bool = False) -> None:
+        """
+        Import every (exchange, symbol, timeframe) the exchange lists, up to
+        concurrency pairs at once, within a token bucket per exchange.
+        """
+        await asyncio.to_thread(self.setup, timeframes, since)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run_pair(exchange, limiter, symbol, timeframe):
+            async with semaphore:
+                try:
+                    await self.import_pair(exchange, limiter, symbol, timeframe, to_ms(since), to_ms(until), restart)
+                except Exception as error:
+                    print(f"Error importing {symbol} {timeframe} from {exchange.id}: {error}")
+
+        jobs = []
+        for exchange in exchanges:
+            try:
+                markets = await exchange.load_markets()
+            except Exception as error:
+                print(f"Error loading markets from {exchange.id}: {error}")
+                continue
+            limiter = TokenBucket(1000 / exchange.rateLimit * rate_share)
+            for symbol in symbols:
+                if symbol not in markets:
+                    print(f"{exchange.id} does not list {symbol}, skipping")
+                    continue
+                for timeframe in timeframes:
+                    jobs.append(run_pair(exchange, limiter, symbol, timeframe))
+
+        started = time.monotonic()
+        await asyncio.gather(*jobs)
+        minutes = max(time.monotonic() - started, 1) / 60
+        print(f"Imported {self.imported} candles in {minutes:.1f} minutes ({self.imported / minutes:.0f} per minute)")
+
+
+async def main(args) -> None:
+    db_user = os.getenv('DB_USER')
+    db_password = os.getenv('DB_PASSWORD')
+    db_host = os.getenv('DB_HOST')
+    db_port = 5432
+    db_name = os.getenv('DB_NAME')
+    engine = create_engine(
+        f'postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}',
+        connect_args={'sslmode': 'require'},
+        pool_size=args.concurrency
+    )
+    exchanges = [getattr(ccxt, exchange_id)({'enableRateLimit': True}) for exchange_id in args.exchanges.split(',')]
+    importer = OHLCVImporter(engine, args.chunk_rows, rollups=not args.no_rollups)
+    try:
+        await importer.run(exchanges, args.symbols.split(','), args.timeframes.split(','), args.since,
+                           args.until or datetime.now(), args.concurrency, args.rate_share, args.restart)
+    finally:
+        await asyncio.gather(*(exchange.close() for exchange in exchanges), return_exceptions=True)
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    from ohlcvProducer import exchanges as default_exchanges, symbols as default_symbols
+
+    parser = argparse.ArgumentParser(description='Bulk import historical candles into ohlcv_data')
+    parser.add_argument('--since', type=datetime.fromisoformat, required=True, help='First candle to import')
+    parser.add_argument('--until', type=datetime.fromisoformat, help='Import up to here (defaults to now)')
+    parser.add_argument('--exchanges', default=','.join(default_exchanges))
+    parser.add_argument('--symbols', default=','.join(default_symbols))
+    parser.add_argument('--timeframes', default='1m', help=f"Comma separated, of {', '.join(TIMEFRAMES)}")
+    parser.add_argument('--chunk-rows', type=int, default=50000, help='Candles per COPY and upsert')
+    parser.add_argument('--concurrency', type=int, default=8, help='Pairs imported at once')
+    parser.add_argument('--rate-share', type=float, default=1.0,
+                        help="Share of each exchange's rate limit to use (lower it while the producer runs)")
+    parser.add_argument('--restart', action='store_true', help='Ignore recorded progress and start from --since')
+    parser.add_argument('--no-rollups', action='store_true',
+                        help='Skip rollup rebuilds per chunk; run ohlcv_rollup.py afterwards')
+    args = parser.parse_args()
+    unknown = set(args.timeframes.split(',')) - set(TIMEFRAMES)
+    if unknown:
+        parser.error(f"Unsupported timeframes: {', '.join(sorted(unknown))}")
+    asyncio.run(main(args))
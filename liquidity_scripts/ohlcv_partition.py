@@ -0,0 +1,236 @@
+from sqlalchemy import create_engine, text
+from datetime import datetime
+from dotenv import load_dotenv
+import argparse
+import os
+import re
+import time
+
+load_dotenv()
+
+PARTITION_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sql_scripts', 'partition_script')
+PARTITION_NAME = re.compile(r'^ohlcv_data_p(\d{4})(\d{2})$')
+COLUMNS = 'id, exchange, symbol, open_price, high_price, low_price, close_price, volume, timestamp, recorded_at, liquidity, network_id'
+
+
+def month_start(timestamp: datetime) -> datetime:
+    return datetime(timestamp.year, timestamp.month, 1)
+
+
+def add_months(timestamp: datetime, months: int) -> datetime:
+    month = timestamp.month - 1 + months
+    return datetime(timestamp.year + month // 12, month % 12 + 1, 1)
+
+
+def is_partitioned(conn, table: str) -> bool:
+    return conn.execute(text("""
+        SELECT 1
+        FROM pg_partitioned_table p
+        JOIN pg_class c ON c.oid = p.partrelid
+        WHERE c.relname = :table AND c.relnamespace = 'public'::regnamespace
+    """), {'table': table}).scalar() is not None
+
+
+def default_partition(conn, table: str):
+    return conn.execute(text("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = :table AND p.relnamespace = 'public'::regnamespace
+          AND pg_get_expr(c.relpartbound, c.oid) = 'DEFAULT'
+    """), {'table': table}).scalar()
+
+
+def create_partition(conn, table: str, name: str, month: datetime) -> None:
+    """
+    Create the partition of table for month. Rows for the month that already
+    landed in the default partition are moved into it first, since Postgres
+    refuses to add a partition whose range the default partition holds rows for.
+    """
+    end = add_months(month, 1)
+    values = f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+    default = default_partition(conn, table)
+    if default is None:
+        conn.execute(text(f'CREATE TABLE {name} PARTITION OF {table} {values}'))
+        return
+    conn.execute(text(f'CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+    moved = conn.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM {default}
+            WHERE timestamp >= :start AND timestamp < :end
+            RETURNING {COLUMNS}
+        )
+        INSERT INTO {name} ({COLUMNS}) SELECT {COLUMNS} FROM moved
+    """), {'start': month, 'end': end}).rowcount
+    conn.execute(text(f'ALTER TABLE {table} ATTACH PARTITION {name} {values}'))
+    if moved:
+        print(f'Moved {moved} rows from {default} into {name}')
+
+
+def ensure_partitions(engine, table: str = 'ohlcv_data', since: datetime = None, months_ahead: int = 3) -> None:
+    """
+    Create the monthly partitions of table from since (default: this month) up to
+    months_ahead months in the future. Does nothing if table is not partitioned,
+    so it is safe to call before and after the migration.
+    """
+    with engine.begin() as conn:
+        if not is_partitioned(conn, table):
+            return
+    month = month_start(since or datetime.utcnow())
+    last = add_months(month_start(datetime.utcnow()), months_ahead)
+    while month <= last:
+        name = f'ohlcv_data_p{month:%Y%m}'
+        try:
+            with engine.begin() as conn:
+                if conn.execute(text('SELECT to_regclass(:name)'), {'name': name}).scalar() is None:
+                    create_partition(conn, table, name, month)
+        except Exception as error:
+            print(f'Error creating partition {name}: {error}')
+        month = add_months(month, 1)
+
+
+def create(engine, months_ahead: int) -> None:
+    with open(PARTITION_SCRIPT) as f:
+        ddl = f.read()
+    with engine.begin() as conn:
+        conn.exec_driver_sql(ddl)
+        oldest = conn.execute(text('SELECT MIN(timestamp) FROM ohlcv_data')).scalar()
+    ensure_partitions(engine, 'ohlcv_data_partitioned', oldest, months_ahead)
+    print('Created ohlcv_data_partitioned')
+
+
+def copy_rows(engine, batch_size: int, pause: float) -> None:
+    """
+    Copy ohlcv_data into ohlcv_data_partitioned in id order, one short
+    transaction per batch, while the consumer keeps writing to ohlcv_data.
+    Resumes from the highest id already copied.
+    """
+    with engine.connect() as conn:
+        last_id = conn.execute(text('SELECT COALESCE(MAX(id), 0) FROM ohlcv_data_partitioned')).scalar()
+    while True:
+        with engine.begin() as conn:
+            upper = conn.execute(text("""
+                SELECT MAX(id) FROM (
+                    SELECT id FROM ohlcv_data WHERE id > :last_id ORDER BY id LIMIT :batch_size
+                ) batch
+            """), {'last_id': last_id, 'batch_size': batch_size}).scalar()
+            if upper is None:
+                break
+            result = conn.execute(text(f"""
+                INSERT INTO ohlcv_data_partitioned ({COLUMNS})
+                SELECT {COLUMNS} FROM ohlcv_data
+                WHERE id > :last_id AND id <= :upper
+                ON CONFLICT DO NOTHING
+            """), {'last_id': last_id, 'upper': upper})
+        print(f'Copied {result.rowcount} rows up to id {upper}')
+        last_id = upper
+        if pause:
+            time.sleep(pause)
+    print(f'Copy caught up at id {last_id}')
+
+
+def swap(engine, resync_minutes: int) -> None:
+    """
+    Finish the copy under a write lock and swap the partitioned table in.
+    Candles updated in place during the copy (the in-progress minute) are
+    re-synced for the last resync_minutes. The old table is kept as ohlcv_data_legacy.
+    """
+    with engine.begin() as conn:
+        conn.execute(text('LOCK TABLE ohlcv_data IN EXCLUSIVE MODE'))
+        conn.execute(text(f"""
+            INSERT INTO ohlcv_data_partitioned ({COLUMNS})
+            SELECT {COLUMNS} FROM ohlcv_data
+            WHERE id > (SELECT COALESCE(MAX(id), 0) FROM ohlcv_data_partitioned)
+            ON CONFLICT DO NOTHING
+        """))
+        conn.execute(text(f"""
+            INSERT INTO ohlcv_data_partitioned ({COLUMNS})
+            SELECT {COLUMNS} FROM ohlcv_data
+            WHERE timestamp >= (SELECT MAX(timestamp) FROM ohlcv_data) - :resync * INTERVAL '1 minute'
+            ON CONFLICT (exchange, symbol, timestamp) DO UPDATE SET
+                open_price = EXCLUDED.open_price,
+                high_price = EXCLUDED.high_price,
+                low_price = EXCLUDED.low_price,
+                close_price = EXCLUDED.close_price,
+                volume = EXCLUDED.volume,
+                liquidity = EXCLUDED.liquidity,
+                network_id = EXCLUDED.network_id
+        """), {'resync': resync_minutes})
+        conn.execute(text("""
+            ALTER TABLE ohlcv_data RENAME CONSTRAINT ohlcv_data_exchange_symbol_timestamp_key
+                TO ohlcv_data_legacy_exchange_symbol_timestamp_key
+        """))
+        conn.execute(text('ALTER TABLE ohlcv_data RENAME TO ohlcv_data_legacy'))
+        conn.execute(text('ALTER TABLE ohlcv_data_partitioned RENAME TO ohlcv_data'))
+        # OHLCVDataConsumer upserts against this constraint name
+        conn.execute(text("""
+            ALTER TABLE ohlcv_data RENAME CONSTRAINT ohlcv_data_partitioned_exchange_symbol_timestamp_key
+                TO ohlcv_data_exchange_symbol_timestamp_key
+        """))
+        conn.execute(text('ALTER SEQUENCE ohlcv_data_id_seq OWNED BY ohlcv_data.id'))
+    print('ohlcv_data is now partitioned; the previous table is ohlcv_data_legacy')
+
+
+def detach(engine, older_than_months: int) -> None:
+    """
+    Detach monthly partitions that end before the cutoff. Detached tables are
+    left in place to be archived or dropped.
+    """
+    cutoff = add_months(month_start(datetime.utcnow()), -older_than_months)
+    with engine.connect() as conn:
+        partitions = conn.execute(text("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            WHERE p.relname = 'ohlcv_data'
+        """)).scalars().all()
+    for name in sorted(partitions):
+        match = PARTITION_NAME.match(name)
+        if not match:
+            continue
+        month = datetime(int(match.group(1)), int(match.group(2)), 1)
+        if add_months(month, 1) <= cutoff:
+            with engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE ohlcv_data DETACH PARTITION {name}'))
+            print(f'Detached {name}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Migrate ohlcv_data to monthly partitions and maintain them')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    create_parser = subparsers.add_parser('create', help='Create ohlcv_data_partitioned and its partitions')
+    create_parser.add_argument('--months-ahead', type=int, default=3)
+    copy_parser = subparsers.add_parser('copy', help='Copy existing rows in batches (resumable)')
+    copy_parser.add_argument('--batch-size', type=int, default=50000)
+    copy_parser.add_argument('--pause', type=float, default=0.5, help='Seconds to sleep between batches')
+    swap_parser = subparsers.add_parser('swap', help='Finish the copy and swap the partitioned table in')
+    swap_parser.add_argument('--resync-minutes', type=int, default=10)
+    ensure_parser = subparsers.add_parser('ensure', help='Create upcoming monthly partitions')
+    ensure_parser.add_argument('--months-ahead', type=int, default=3)
+    detach_parser = subparsers.add_parser('detach', help='Detach partitions older than N months')
+    detach_parser.add_argument('--older-than-months', type=int, default=12)
+    args = parser.parse_args()
+
+    db_user = os.getenv('DB_USER')
+    db_password = os.getenv('DB_PASSWORD')
+    db_host = os.getenv('DB_HOST')
+    db_port = 5432
+    db_name = os.getenv('DB_NAME')
+    engine = create_engine(
+        f'postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}',
+        connect_args={'sslmode': 'require'}
+    )
+
+    if args.command == 'create':
+        create(engine, args.months_ahead)
+    elif args.command == 'copy':
+        copy_rows(engine, args.batch_size, args.pause)
+    elif args.command == 'swap':
+        swap(engine, args.resync_minutes)
+    elif args.command == 'ensure':
+        ensure_partitions(engine, months_ahead=args.months_ahead)
+    elif args.command == 'detach':
+        detach(engine, args.older_than_months)
+    engine.dispose()
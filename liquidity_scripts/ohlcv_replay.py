@@ -0,0 +1,196 @@
+# Replays a feed recorded by ohlcvStreamer.py (OHLCV_RECORD_PATH) over WebSockets, standing in
+# for the exchanges in tests. Each line is {"t": received at (ms), "exchange", "channel":
+# "trades" | "ohlcv", "symbol", "data": [trades] | [candles]}. An exchange only offers the
+# channels it has lines for, so a recording without candles exercises local candle building.
+import argparse
+import asyncio
+import itertools
+import json
+from collections import defaultdict
+from typing import Dict, List
+
+import websockets
+
+
+def load_recording(path: str) -> Dict[str, List[dict]]:
+    """
+    Recorded events grouped by exchange, in the order they were received.
+    """
+    events = defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                event = json.loads(line)
+                events[event["exchange"]].append(event)
+    for exchange_events in events.values():
+        exchange_events.sort(key=lambda event: event["t"])
+    return events
+
+
+class ReplayServer:
+    def __init__(self, events: Dict[str, List[dict]], speed: float = 1.0):
+        """
+        Serves each connecting client the recorded feed of the exchange it names,
+        with the recorded timing measured from when it connected.
+        :param speed: Replay rate relative to the recording; 0 sends everything at once
+        """
+        self.events = events
+        self.speed = speed
+
+    def _due(self, event, first, connected) -> float:
+        # Event loop time at which event is replayed
+        if self.speed <= 0:
+            return connected
+        return connected + (event["t"] - first) / 1000 / self.speed
+
+    async def handle(self, websocket, path=None) -> None:
+        # The first message names the exchange: {"op": "hello", "exchange": "kraken"}
+        hello = json.loads(await websocket.recv())
+        events = self.events.get(hello.get("exchange"), [])
+        loop = asyncio.get_running_loop()
+        first = events[0]["t"] if events else 0
+        connected = loop.time()
+        await websocket.send(json.dumps({
+            "op": "hello",
+            "symbols": sorted({event["symbol"] for event in events}),
+            "channels": sorted({event["channel"] for event in events}),
+            # Lets the client tell the recorded time being replayed
+            "first": first,
+            "last": events[-1]["t"] if events else 0,
+            "speed": self.speed,
+        }))
+
+        replays = []
+        try:
+            async for message in websocket:
+                request = json.loads(message)
+                if request["op"] == "subscribe":
+                    channel = [
+                        event for event in events
+                        if event["channel"] == request["channel"] and event["symbol"] == request["symbol"]
+                    ]
+                    replays.append(asyncio.create_task(self._replay(websocket, channel, first, connected)))
+                elif request["op"] == "fetch_ohlcv":
+                    # Newest candles replayed so far, one per minute, as a REST poll would see them
+                    candles = {}
+                    for event in events:
+                        if (event["channel"] == "ohlcv" and event["symbol"] == request["symbol"]
+                                and self._due(event, first, connected) <= loop.time()):
+                            for candle in event["data"]:
+                                candles[candle[0]] = candle
+                    limit = request.get("limit") or 1
+                    await websocket.send(json.dumps({
+                        "op": "fetch_ohlcv", "id": request["id"], "data": [candles[t] for t in sorted(candles)][-limit:]
+                    }))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for replay in replays:
+                replay.cancel()
+
+    async def _replay(self, websocket, events, first, connected) -> None:
+        # Events due before the subscription arrived are sent straight away
+        for event in events:
+            delay = self._due(event, first, connected) - asyncio.get_running_loop().time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await websocket.send(json.dumps({
+                "op": "update", "channel": event["channel"], "symbol": event["symbol"], "data": event["data"]
+            }))
+
+
+class ReplayExchange:
+    def __init__(self, exchange_id: str, url: str):
+        """
+        Client side of ReplayServer with the subset of the ccxt.pro exchange
+        interface ohlcvStreamer.py uses. Call load_markets() first; it connects and
+        fills in has from the channels the recording offers.
+        """
+        self.id = exchange_id
+        self.url = url
+        self.rateLimit = 50
+        self.has = {'watchOHLCV': False, 'watchTrades': False, 'fetchOHLCV': True}
+        self._websocket = None
+        self._reader = None
+        self._queues = defaultdict(asyncio.Queue)
+        self._pending = {}
+        self._request_ids = itertools.count()
+        self._clock = None
+
+    async def load_markets(self) -> Dict[str, dict]:
+        self._websocket = await websockets.connect(self.url)
+        await self._websocket.send(json.dumps({"op": "hello", "exchange": self.id}))
+        hello = json.loads(await self._websocket.recv())
+        self.has['watchOHLCV'] = "ohlcv" in hello["channels"]
+        self.has['watchTrades'] = "trades" in hello["channels"]
+        self._clock = (hello["first"], hello["last"], hello["speed"], asyncio.get_running_loop().time())
+        self._reader = asyncio.create_task(self._read())
+        return {symbol: {} for symbol in hello["symbols"]}
+
+    async def _read(self) -> None:
+        try:
+            async for message in self._websocket:
+                update = json.loads(message)
+                if update["op"] == "fetch_ohlcv":
+                    future = self._pending.pop(update["id"], None)
+                    if future is not None and not future.done():
+                        future.set_result(update["data"])
+                else:
+                    self._queues[(update["channel"], update["symbol"])].put_nowait(update["data"])
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Replay server closed the connection"))
+
+    async def _watch(self, channel: str, symbol: str) -> list:
+        key = (channel, symbol)
+        if key not in self._queues:
+            await self._websocket.send(json.dumps({"op": "subscribe", "channel": channel, "symbol": symbol}))
+        return await self._queues[key].get()
+
+    async def watch_ohlcv(self, symbol: str, timeframe: str = '1m') -> list:
+        return await self._watch("ohlcv", symbol)
+
+    async def watch_trades(self, symbol: str) -> list:
+        return await self._watch("trades", symbol)
+
+    def milliseconds(self) -> int:
+        """
+        The recorded time being replayed, in place of the wall clock.
+        """
+        first, last, speed, connected = self._clock
+        if speed <= 0:
+            return last
+        return int(first + (asyncio.get_running_loop().time() - connected) * 1000 * speed)
+
+    async def fetch_ohlcv(self, symbol: str, timeframe: str = '1m', since=None, limit=None) -> list:
+        request_id = next(self._request_ids)
+        future = self._pending[request_id] = asyncio.get_running_loop().create_future()
+        await self._websocket.send(json.dumps({"op": "fetch_ohlcv", "id": request_id, "symbol": symbol, "limit": limit}))
+        return await future
+
+    async def close(self) -> None:
+        if self._reader is not None:
+            self._reader.cancel()
+        if self._websocket is not None:
+            await self._websocket.close()
+
+
+async def serve(path: str, host: str, port: int, speed: float) -> None:
+    server = ReplayServer(load_recording(path), speed=speed)
+    async with websockets.serve(server.handle, host, port):
+        print(f"Replaying {path} on ws://{host}:{port}")
+        await asyncio.Future()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a recorded exchange feed for ohlcvStreamer.py")
+    parser.add_argument("path", help="JSON-lines recording written with OHLCV_RECORD_PATH")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay rate; 0 sends everything at once")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.path, args.host, args.port, args.speed))
+    except KeyboardInterrupt:
+        print("Shutting down...")
@@ -0,0 +1,166 @@
+from sqlalchemy import Integer, create_engine, Column, String, Numeric, DateTime, UniqueConstraint, text
+from sqlalchemy.orm import declarative_base
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+import argparse
+import os
+
+load_dotenv()
+
+
+Base = declarative_base()
+
+# (table, seconds per candle, source table) from finest to coarsest.
+# Each level is rebuilt from the level below it, so a refresh only reads a handful of rows.
+ROLLUP_LEVELS = [
+    ('ohlcv_data_5m', 300, 'ohlcv_data'),
+    ('ohlcv_data_1h', 3600, 'ohlcv_data_5m'),
+    ('ohlcv_data_1d', 86400, 'ohlcv_data_1h'),
+]
+
+
+def _rollup_model(table_name):
+    return type(f'OHLCVRollup_{table_name}', (Base,), {
+        '__tablename__': table_name,
+        'id': Column(Integer, primary_key=True),
+        'exchange': Column(String(50), nullable=False),
+        'symbol': Column(String(20), nullable=False),
+        'timestamp': Column(DateTime, nullable=False),
+        'open_price': Column(Numeric, nullable=False),
+        'high_price': Column(Numeric, nullable=False),
+        'low_price': Column(Numeric, nullable=False),
+        'close_price': Column(Numeric, nullable=False),
+        'volume': Column(Numeric, nullable=False),
+        'liquidity': Column(Numeric),
+        'network_id': Column(Integer),
+        'candle_count': Column(Integer, nullable=False),
+        '__table_args__': (UniqueConstraint('exchange', 'symbol', 'timestamp'),),
+    })
+
+
+ROLLUP_MODELS = {table: _rollup_model(table) for table, _, _ in ROLLUP_LEVELS}
+
+
+def rollup_sql(target, seconds, source, scoped=True):
+    """
+    Upsert the buckets of target that fall in [range_start, range_end) by
+    re-aggregating the source rows. The range must be aligned to bucket
+    boundaries of the target, otherwise a partial bucket would overwrite a full one.
+    :param scoped: Restrict the refresh to one exchange/symbol
+    """
+    count_expr = "COUNT(*)" if source == 'ohlcv_data' else "SUM(src.candle_count)"
+    scope = "AND src.exchange = :exchange AND src.symbol = :symbol" if scoped else ""
+    return text(f"""
+        INSERT INTO {target} (exchange, symbol, timestamp, open_price, high_price, low_price,
+                              close_price, volume, liquidity, network_id, candle_count)
+        SELECT src.exchange,
+               src.symbol,
+               TIMESTAMP 'epoch' + FLOOR(EXTRACT(EPOCH FROM src.timestamp) / {seconds}) * {seconds} * INTERVAL '1 second',
+               (ARRAY_AGG(src.open_price ORDER BY src.timestamp ASC))[1],
+               MAX(src.high_price),
+               MIN(src.low_price),
+               (ARRAY_AGG(src.close_price ORDER BY src.timestamp DESC))[1],
+               SUM(src.volume),
+               (ARRAY_AGG(src.liquidity ORDER BY src.timestamp DESC))[1],
+               MAX(src.network_id),
+               {count_expr}
+        FROM {source} src
+        WHERE src.timestamp >= :range_start AND src.timestamp < :range_end
+            {scope}
+        GROUP BY 1, 2, 3
+        ON CONFLICT (exchange, symbol, timestamp) DO UPDATE SET
+            open_price = EXCLUDED.open_price,
+            high_price = EXCLUDED.high_price,
+            low_price = EXCLUDED.low_price,
+            close_price = EXCLUDED.close_price,
+            volume = EXCLUDED.volume,
+            liquidity = EXCLUDED.liquidity,
+            network_id = EXCLUDED.network_id,
+            candle_count = EXCLUDED.candle_count;
+    """)
+
+
+def bucket_start(timestamp: datetime, seconds: int) -> datetime:
+    epoch = datetime(1970, 1, 1)
+    offset = int((timestamp - epoch).total_seconds()) // seconds * seconds
+    return epoch + timedelta(seconds=offset)
+
+
+def refresh_rollups(session, exchange: str, symbol: str, timestamp: datetime) -> None:
+    """
+    Rebuild the 5m, 1h and 1d buckets containing one freshly written candle.
+    Runs inside the caller's transaction so raw rows and rollups commit together.
+    """
+    refresh_rollup_range(session, exchange, symbol, timestamp, timestamp + timedelta(seconds=1))
+
+
+def refresh_rollup_range(session, exchange: str, symbol: str, since: datetime, until: datetime,
+                         levels=ROLLUP_LEVELS) -> None:
+    """
+    Rebuild every 5m, 1h and 1d bucket of one exchange/symbol that overlaps
+    [since, until), e.g. after a run of candles was backfilled.
+    :param levels: The ROLLUP_LEVELS to rebuild, finest first
+    """
+    for target, seconds, source in levels:
+        start = bucket_start(since, seconds)
+        end = bucket_start(until - timedelta(microseconds=1), seconds) + timedelta(seconds=seconds)
+        session.execute(rollup_sql(target, seconds, source), {
+            'exchange': exchange,
+            'symbol': symbol,
+            'range_start': start,
+            'range_end': end,
+        })
+
+
+def catch_up(engine, since: datetime, until: datetime, chunk: timedelta = timedelta(days=1)) -> None:
+    """
+    Backfill every rollup level for [since, until) one chunk at a time, finest
+    level first. Chunks are whole days so they stay aligned to every bucket size.
+    """
+    since = bucket_start(since, 86400)
+    for target, seconds, source in ROLLUP_LEVELS:
+        query = rollup_sql(target, seconds, source, scoped=False)
+        chunk_start = since
+        while chunk_start < until:
+            chunk_end = chunk_start + chunk
+            with engine.begin() as conn:
+                result = conn.execute(query, {'range_start': chunk_start, 'range_end': chunk_end})
+            print(f'{target}: rolled up {result.rowcount} buckets for {chunk_start.isoformat()} - {chunk_end.isoformat()}')
+            chunk_start = chunk_end
+
+
+def create_rollup_tables(engine) -> None:
+    Base.metadata.create_all(engine)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build ohlcv_data rollup tables from history')
+    parser.add_argument('--since', type=datetime.fromisoformat,
+                        help='First timestamp to roll up (defaults to the oldest candle)')
+    parser.add_argument('--until', type=datetime.fromisoformat,
+                        help='Last timestamp to roll up (defaults to now)')
+    parser.add_argument('--chunk-days', type=int, default=1)
+    args = parser.parse_args()
+
+    db_user = os.getenv('DB_USER')
+    db_password = os.getenv('DB_PASSWORD')
+    db_host = os.getenv('DB_HOST')
+    db_port = 5432
+    db_name = os.getenv('DB_NAME')
+    engine = create_engine(
+        f'postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}',
+        connect_args={'sslmode': 'require'}
+    )
+    create_rollup_tables(engine)
+
+    since = args.since
+    if since is None:
+        with engine.connect() as conn:
+            since = conn.execute(text('SELECT MIN(timestamp) FROM ohlcv_data')).scalar()
+        if since is None:
+            print('ohlcv_data is empty, nothing to roll up')
+            raise SystemExit(0)
+    until = args.until or datetime.utcnow() + timedelta(days=1)
+
+    catch_up(engine, since, until, timedelta(days=args.chunk_days))
+    engine.dispose()
@@ -0,0 +1,321 @@
+import asyncio
+import hashlib
+import heapq
+import itertools
+import os
+import threading
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+# HTTP statuses exchanges and the Codex API use to say "slow down" (418: Binance IP ban warning)
+RATE_LIMIT_STATUSES = (418, 429)
+# Requests per second allowed per Codex API key
+CODEX_RATE = float(os.getenv('CODEX_RATE_PER_SECOND', 5))
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """
+    True for ccxt's RateLimitExceeded/DDoSProtection and for HTTP errors with a
+    418 or 429 status, without importing ccxt or requests here.
+    """
+    if any(cls.__name__ in ('RateLimitExceeded', 'DDoSProtection') for cls in type(error).__mro__):
+        return True
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None) in RATE_LIMIT_STATUSES
+
+
+def retry_after(error_or_response) -> Optional[float]:
+    # Seconds from a Retry-After header, when the server sent one
+    response = getattr(error_or_response, 'response', error_or_response)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: Optional[float] = None, concurrency: Optional[int] = None,
+                 max_backoff: float = 300):
+        """
+        Request budget for one exchange or API key. Refills at rate tokens per
+        second up to burst. On a rate-limit response the rate is halved and requests
+        pause for an exponentially growing backoff (or Retry-After); each success
+        gives back 5% of the configured rate.
+        :param concurrency: Requests allowed in flight at once; None for no limit
+        """
+        self.configured_rate = rate
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.concurrency = concurrency
+        self.max_backoff = max_backoff
+
+        self.tokens = self.burst
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.backoff = 1.0
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.rate_limited = 0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """
+        Seconds until a request could start; 0 when one can start now.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(0.0, self.blocked_until - now, (1 - self.tokens) / self.rate)
+            if self.concurrency is not None and self.in_flight >= self.concurrency:
+                wait = max(wait, 0.01)
+            return wait
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self.blocked_until or self.tokens < 1:
+                return False
+            if self.concurrency is not None and self.in_flight >= self.concurrency:
+                return False
+            self.tokens -= 1
+            self.in_flight += 1
+            self.requests += 1
+            return True
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    def wait(self) -> None:
+        """
+        Block until a request may start and take its token; for synchronous callers.
+        Pair with release().
+        """
+        while not self.try_acquire():
+            time.sleep(self.delay())
+
+    async def acquire(self) -> None:
+        """
+        wait() for coroutines. Pair with release().
+        """
+        while not self.try_acquire():
+            await asyncio.sleep(self.delay())
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.backoff = 1.0
+            self.rate = min(self.configured_rate, self.rate + self.configured_rate * 0.05)
+
+    def on_rate_limit(self, seconds: Optional[float] = None) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self.rate_limited += 1
+            self.rate = max(self.configured_rate / 64, self.rate / 2)
+            self.tokens = 0
+            pause = seconds if seconds is not None else self.backoff
+            self.blocked_until = max(self.blocked_until, now + pause)
+            self.backoff = min(self.max_backoff, self.backoff * 2)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "rate": round(self.rate, 3),
+                "configured_rate": self.configured_rate,
+                "in_flight": self.in_flight,
+                "requests": self.requests,
+                "rate_limited": self.rate_limited,
+                "blocked_for": round(max(0.0, self.blocked_until - time.monotonic()), 1),
+            }
+
+
+class Job:
+    __slots__ = ("key", "run", "limiter", "interval", "importance", "next_due", "last_success", "running", "attempts")
+
+    def __init__(self, key, run, limiter, interval, importance, next_due):
+        self.key = key
+        self.run = run
+        self.limiter = limiter
+        self.interval = interval
+        self.importance = importance
+        self.next_due = next_due
+        self.last_success = next_due - (interval or 1)
+        self.running = False
+        self.attempts = 0
+
+    def priority(self, now: float) -> float:
+        # Staleness in intervals, weighted by importance
+        return (now - self.last_success) / (self.interval or 1) * self.importance
+
+
+class Scheduler:
+    def __init__(self):
+        """
+        Runs jobs (one request each) under per-exchange/per-key TokenBuckets. Due
+        jobs start most-stale-and-important first whenever their bucket allows. The
+        first runs of one bucket's jobs are offset evenly across their interval, so
+        requests stay spread out instead of bursting at the top of every minute.
+        Waiting jobs sit in a heap by due time and due ones in a heap per bucket,
+        so each pass only touches the jobs that start.
+        """
+        self.limiters: Dict[str, TokenBucket] = {}
+        self.jobs: Set[Job] = set()
+        self._once = 0
+        self._seq = itertools.count()
+        # (next_due, seq, job) for jobs waiting to fall due
+        self._waiting: List[tuple] = []
+        # id(limiter) -> (limiter, [(-priority when it fell due, seq, job)])
+        self._ready: Dict[int, tuple] = {}
+        # Set when a job finishes, so its next run or retry is scheduled without waiting out a sleep
+        self._wake: Optional[asyncio.Event] = None
+
+    def limiter(self, name: str, rate: float, burst: Optional[float] = None,
+                concurrency: Optional[int] = None) -> TokenBucket:
+        """
+        The bucket called name, created with these limits on first use.
+        """
+        if name not in self.limiters:
+            self.limiters[name] = TokenBucket(rate, burst, concurrency)
+        return self.limiters[name]
+
+    def add(self, key, run: Callable[[], Awaitable], limiter: TokenBucket,
+            interval: Optional[float] = None, importance: float = 1.0) -> None:
+        """
+        :param run: Coroutine function making the job's request; a rate-limit error it raises backs its bucket off
+        :param interval: Seconds between runs, or None to run once (until it succeeds or fails 3 times)
+        :param importance: Weight against other due jobs; 2 is picked as if twice as stale
+        """
+        job = Job(key, run, limiter, interval, importance, time.monotonic())
+        self.jobs.add(job)
+        self._once += interval is None
+        self._wait(job)
+
+    def _wait(self, job: Job) -> None:
+        heapq.heappush(self._waiting, (job.next_due, next(self._seq), job))
+
+    def _finish(self, job: Job) -> None:
+        self.jobs.discard(job)
+        self._once -= job.interval is None
+
+    def _spread(self) -> None:
+        # Offset the first run of each bucket's repeating jobs evenly across their interval
+        groups: Dict[tuple, List[Job]] = {}
+        for job in self.jobs:
+            if job.interval and job.attempts == 0:
+                groups.setdefault((id(job.limiter), job.interval), []).append(job)
+        now = time.monotonic()
+        for (_, interval), jobs in groups.items():
+            jobs.sort(key=lambda job: job.importance, reverse=True)
+            for i, job in enumerate(jobs):
+                job.next_due = now + interval * i / len(jobs)
+                job.last_success = job.next_due - interval
+        self._waiting = [(job.next_due, next(self._seq), job) for job in self.jobs if not job.running]
+        heapq.heapify(self._waiting)
+        self._ready = {}
+
+    async def _execute(self, job: Job) -> None:
+        try:
+            await job.run()
+            job.limiter.on_success()
+            job.last_success = time.monotonic()
+            if job.interval is None:
+                self._finish(job)
+        except Exception as error:
+            if is_rate_limited(error):
+                print(f"Rate limited on {job.key}, backing off: {error}")
+                job.limiter.on_rate_limit(retry_after(error))
+                # Rate-limited attempts do not count towards giving up
+                job.attempts -= 1
+                job.next_due = time.monotonic()
+            else:
+                print(f"Error running {job.key}: {error}")
+            if job.interval is None and job.attempts >= 3:
+                self._finish(job)
+        finally:
+            job.limiter.release()
+            job.running = False
+            if job in self.jobs:
+                self._wait(job)
+            self._wake.set()
+
+    async def run(self, until_idle: bool = False) -> None:
+        """
+        Start due jobs as their buckets allow, forever or, with until_idle, until
+        every run-once job has finished.
+        """
+        self._spread()
+        self._wake = asyncio.Event()
+        tasks = set()
+        while self.jobs or tasks:
+            if until_idle and self._once == 0:
+                break
+            now = time.monotonic()
+            while self._waiting and self._waiting[0][0] <= now:
+                _, seq, job = heapq.heappop(self._waiting)
+                _, ready = self._ready.setdefault(id(job.limiter), (job.limiter, []))
+                heapq.heappush(ready, (-job.priority(now), seq, job))
+
+            waits = [self._waiting[0][0] - now] if self._waiting else []
+            for key, (limiter, ready) in list(self._ready.items()):
+                while ready and limiter.try_acquire():
+                    _, _, job = heapq.heappop(ready)
+                    job.running = True
+                    job.attempts += 1
+                    if job.interval:
+                        job.next_due = max(job.next_due + job.interval, now)
+                    task = asyncio.create_task(self._execute(job))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                if ready:
+                    waits.append(limiter.delay())
+                else:
+                    del self._ready[key]
+            try:
+                await asyncio.wait_for(self._wake.wait(), max(0.005, min([0.5] + waits)))
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Dict]:
+        return {name: limiter.stats() for name, limiter in self.limiters.items()}
+
+
+# Codex API buckets, one per key, shared by every caller in the process
+_codex_limiters: Dict[str, TokenBucket] = {}
+_codex_lock = threading.Lock()
+
+
+def codex_limiter(api_key: str) -> TokenBucket:
+    name = hashlib.sha256((api_key or "").encode()).hexdigest()
+    with _codex_lock:
+        if name not in _codex_limiters:
+            _codex_limiters[name] = TokenBucket(CODEX_RATE, concurrency=4)
+        return _codex_limiters[name]
+
+
+def limited_request(limiter: TokenBucket, send: Callable, attempts: int = 5):
+    """
+    Call send() (a synchronous HTTP request returning a requests.Response) within
+    limiter's budget, backing off and retrying on 418/429 responses. Returns the
+    last response.
+    """
+    for _ in range(attempts):
+        limiter.wait()
+        try:
+            response = send()
+        finally:
+            limiter.release()
+        if response.status_code not in RATE_LIMIT_STATUSES:
+            limiter.on_success()
+            return response
+        print(f"Rate limited ({response.status_code}), backing off")
+        limiter.on_rate_limit(retry_after(response))
+    return response
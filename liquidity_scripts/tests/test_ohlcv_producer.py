@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("ccxt")
+
+from ohlcvProducer import fetch_candle_record
+
+MINUTE = 60000
+# 2023-11-14 22:14:00 UTC, on a minute boundary
+T0 = 1700000040000
+
+
+class FakeExchange:
+    id = "kraken"
+
+    def __init__(self, candles, now_ms):
+        self.candles = candles
+        self.now_ms = now_ms
+        self.limits = []
+
+    def milliseconds(self):
+        return self.now_ms
+
+    async def fetch_ohlcv(self, symbol, timeframe, since, limit):
+        self.limits.append(limit)
+        return self.candles[-limit:]
+
+
+def candle(timestamp, close):
+    return [timestamp, 100.0, 110.0, 90.0, close, 5.0]
+
+
+@pytest.mark.parametrize("offset", [1000, 30000, 59000])
+def test_publishes_the_minute_that_closed_wherever_the_poll_falls(offset):
+    exchange = FakeExchange([candle(T0, 101.0), candle(T0 + MINUTE, 102.0)], T0 + MINUTE + offset)
+
+    record = asyncio.run(fetch_candle_record(exchange, "BTC/USDT"))
+
+    assert exchange.limits == [2]
+    assert record.data == {"0": candle(T0, 101.0), "exchange": "kraken", "symbol": "BTC/USDT"}
+
+
+def test_publishes_the_newest_candle_once_its_minute_is_over():
+    # Exchanges that only list a minute once it has traded may return two closed candles
+    exchange = FakeExchange([candle(T0, 101.0), candle(T0 + MINUTE, 102.0)], T0 + 2 * MINUTE + 1000)
+
+    record = asyncio.run(fetch_candle_record(exchange, "BTC/USDT"))
+
+    assert record.data["0"] == candle(T0 + MINUTE, 102.0)
+
+
+def test_skips_when_only_the_open_minute_is_returned():
+    exchange = FakeExchange([candle(T0, 101.0)], T0 + 20000)
+
+    assert asyncio.run(fetch_candle_record(exchange, "BTC/USDT")) is None
+    assert asyncio.run(fetch_candle_record(FakeExchange([], T0), "BTC/USDT")) is None
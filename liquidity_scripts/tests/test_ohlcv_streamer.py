@@ -0,0 +1,156 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("ccxt")
+websockets = pytest.importorskip("websockets")
+
+import ohlcvStreamer
+from ohlcvStreamer import CandleBuilder, CandlePublisher, run_pair
+from ohlcv_replay import ReplayExchange, ReplayServer, load_recording
+from scheduler import TokenBucket
+
+MINUTE = 60000
+# 2023-11-14 22:14:00 UTC, on a minute boundary
+T0 = 1700000040000
+
+
+def trade(timestamp, price, amount):
+    return {"id": str(timestamp), "timestamp": timestamp, "price": price, "amount": amount}
+
+
+def write_recording(path, events):
+    with open(path, "w") as f:
+        for event in events:
+            f.write(json.dumps(event) + "\n")
+    return str(path)
+
+
+def trades_recording(path):
+    # Trades over three minutes; the last minute is still open when the recording ends
+    return write_recording(path, [
+        {"t": T0 + 1000, "exchange": "kraken", "channel": "trades", "symbol": "BTC/USDT",
+         "data": [trade(T0 + 1000, 100.0, 1.0), trade(T0 + 20000, 105.0, 0.5)]},
+        {"t": T0 + 40000, "exchange": "kraken", "channel": "trades", "symbol": "BTC/USDT",
+         "data": [trade(T0 + 30000, 95.0, 2.0), trade(T0 + 59000, 101.0, 1.0)]},
+        {"t": T0 + MINUTE + 5000, "exchange": "kraken", "channel": "trades", "symbol": "BTC/USDT",
+         "data": [trade(T0 + MINUTE + 5000, 102.0, 3.0)]},
+        {"t": T0 + 2 * MINUTE + 1000, "exchange": "kraken", "channel": "trades", "symbol": "BTC/USDT",
+         "data": [trade(T0 + 2 * MINUTE + 1000, 110.0, 1.0)]},
+    ])
+
+
+def candles_recording(path):
+    # Updates of the open candle, as watch_ohlcv delivers them
+    return write_recording(path, [
+        {"t": T0 + 10000, "exchange": "okx", "channel": "ohlcv", "symbol": "ETH/USDT",
+         "data": [[T0, 10.0, 11.0, 9.5, 10.5, 4.0]]},
+        {"t": T0 + 50000, "exchange": "okx", "channel": "ohlcv", "symbol": "ETH/USDT",
+         "data": [[T0, 10.0, 12.0, 9.0, 11.5, 7.0]]},
+        {"t": T0 + MINUTE + 2000, "exchange": "okx", "channel": "ohlcv", "symbol": "ETH/USDT",
+         "data": [[T0, 10.0, 12.0, 9.0, 11.0, 8.0], [T0 + MINUTE, 11.0, 11.0, 11.0, 11.0, 0.5]]},
+        {"t": T0 + MINUTE + 40000, "exchange": "okx", "channel": "ohlcv", "symbol": "ETH/USDT",
+         "data": [[T0 + MINUTE, 11.0, 13.0, 10.5, 12.5, 3.0]]},
+        {"t": T0 + 2 * MINUTE + 10000, "exchange": "okx", "channel": "ohlcv", "symbol": "ETH/USDT",
+         "data": [[T0 + 2 * MINUTE, 12.5, 12.5, 12.0, 12.0, 1.0]]},
+    ])
+
+
+async def closed_candles(recording, exchange, symbol, count, timeout=5):
+    """
+    Run run_pair for one pair against a ReplayServer serving recording until it
+    has emitted count candles, returning their records.
+    """
+    server = ReplayServer(load_recording(recording), speed=0)
+    async with websockets.serve(server.handle, "localhost", 0) as ws_server:
+        port = ws_server.sockets[0].getsockname()[1]
+        exchange = exchange(f"ws://localhost:{port}")
+        await exchange.load_markets()
+        output = CandlePublisher(None)
+        task = asyncio.create_task(run_pair(exchange, TokenBucket(100), symbol, CandleBuilder(), output))
+        try:
+            return [(await asyncio.wait_for(output.queue.get(), timeout)).data for _ in range(count)]
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await exchange.close()
+
+
+def test_builder_aggregates_trades_into_candles():
+    builder = CandleBuilder()
+    assert builder.add_trade(T0 + 1000, 100.0, 1.0) == []
+    assert builder.add_trade(T0 + 20000, 105.0, 0.5) == []
+    assert builder.add_trade(T0 + 30000, 95.0, 2.0) == []
+    assert builder.add_trade(T0 + 59000, 101.0, 1.0) == []
+    closed = builder.add_trade(T0 + MINUTE + 5000, 102.0, 3.0)
+    assert closed == [[T0, 100.0, 105.0, 95.0, 101.0, 4.5]]
+    assert builder.candle == [T0 + MINUTE, 102.0, 102.0, 102.0, 102.0, 3.0]
+
+
+def test_builder_drops_late_updates():
+    builder = CandleBuilder()
+    builder.add_trade(T0 + 1000, 100.0, 1.0)
+    builder.add_trade(T0 + MINUTE + 1000, 101.0, 1.0)
+    assert builder.add_trade(T0 + 59000, 1.0, 100.0) == []
+    assert builder.update_candle([T0, 1.0, 1.0, 1.0, 1.0, 1.0]) == []
+    assert builder.late == 2
+
+
+def test_builder_closes_quiet_candle_after_grace():
+    builder = CandleBuilder()
+    builder.update_candle([T0, 10.0, 11.0, 9.0, 10.5, 2.0])
+    assert builder.close_due(T0 + MINUTE) == []
+    assert builder.close_due(T0 + MINUTE + ohlcvStreamer.CLOSE_GRACE * 1000) == [[T0, 10.0, 11.0, 9.0, 10.5, 2.0]]
+    assert builder.candle is None
+
+
+def test_run_pair_builds_candles_from_replayed_trades(tmp_path):
+    records = asyncio.run(closed_candles(
+        trades_recording(tmp_path / "trades.jsonl"), lambda url: ReplayExchange("kraken", url), "BTC/USDT", 2
+    ))
+    assert records == [
+        {"0": [T0, 100.0, 105.0, 95.0, 101.0, 4.5], "exchange": "kraken", "symbol": "BTC/USDT"},
+        {"0": [T0 + MINUTE, 102.0, 102.0, 102.0, 102.0, 3.0], "exchange": "kraken", "symbol": "BTC/USDT"},
+    ]
+
+
+def test_run_pair_publishes_last_update_of_replayed_candles(tmp_path):
+    records = asyncio.run(closed_candles(
+        candles_recording(tmp_path / "candles.jsonl"), lambda url: ReplayExchange("okx", url), "ETH/USDT", 2
+    ))
+    assert [record["0"] for record in records] == [
+        [T0, 10.0, 12.0, 9.0, 11.0, 8.0],
+        [T0 + MINUTE, 11.0, 13.0, 10.5, 12.5, 3.0],
+    ]
+
+
+class BrokenStreamExchange(ReplayExchange):
+    # The replay's REST side works, its stream does not
+    async def watch_ohlcv(self, symbol, timeframe='1m'):
+        raise ConnectionError("stream closed")
+
+
+def test_run_pair_falls_back_to_rest_closed_candles(tmp_path, monkeypatch):
+    async def next_minute():
+        await asyncio.sleep(0.01)
+
+    monkeypatch.setattr(ohlcvStreamer, "MAX_STREAM_ERRORS", 1)
+    monkeypatch.setattr(ohlcvStreamer, "wait_for_next_minute", next_minute)
+    recording = candles_recording(tmp_path / "candles.jsonl")
+    records = asyncio.run(closed_candles(
+        recording, lambda url: BrokenStreamExchange("okx", url), "ETH/USDT", 1
+    ))
+    # The replay clock ends 10s into the third minute, so the second is the newest closed one
+    assert records == [{"0": [T0 + MINUTE, 11.0, 13.0, 10.5, 12.5, 3.0], "exchange": "okx", "symbol": "ETH/USDT"}]
+
+
+def test_rest_fallback_publishes_each_closed_candle_once(tmp_path, monkeypatch):
+    async def next_minute():
+        await asyncio.sleep(0.01)
+
+    monkeypatch.setattr(ohlcvStreamer, "MAX_STREAM_ERRORS", 1)
+    monkeypatch.setattr(ohlcvStreamer, "wait_for_next_minute", next_minute)
+    recording = candles_recording(tmp_path / "candles.jsonl")
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(closed_candles(recording, lambda url: BrokenStreamExchange("okx", url), "ETH/USDT", 2, timeout=0.5))
@@ -0,0 +1,113 @@
+import asyncio
+import time
+
+from scheduler import Scheduler, TokenBucket
+
+
+class RateLimitExceeded(Exception):
+    # Matched by class name, like ccxt's
+    pass
+
+
+def run(coroutine, timeout=10):
+    return asyncio.run(asyncio.wait_for(coroutine, timeout))
+
+
+def test_run_once_jobs_start_most_important_first():
+    scheduler = Scheduler()
+    limiter = scheduler.limiter("exchange", rate=1000, burst=1, concurrency=1)
+    started = []
+    for key in range(5):
+        async def job(key=key):
+            started.append(key)
+        scheduler.add(key, job, limiter, importance=1 + key)
+    run(scheduler.run(until_idle=True))
+    assert started == [4, 3, 2, 1, 0]
+
+
+class Response:
+    status_code = 429
+    headers = {'Retry-After': '0.2'}
+
+
+def test_rate_limited_job_backs_off_and_retries():
+    scheduler = Scheduler()
+    limiter = scheduler.limiter("exchange", rate=1000)
+    calls = []
+
+    async def job():
+        calls.append(time.monotonic())
+        if len(calls) <= 3:
+            error = RateLimitExceeded("429 Too Many Requests")
+            error.response = Response()
+            raise error
+
+    scheduler.add("pair", job, limiter)
+    run(scheduler.run(until_idle=True))
+    # Rate-limited attempts do not count towards the three allowed failures
+    assert len(calls) == 4
+    assert limiter.rate_limited == 3
+    # Halved three times, then 5% of the configured rate back for the success
+    assert limiter.rate == limiter.configured_rate / 8 + limiter.configured_rate * 0.05
+    # Each retry waits out Retry-After
+    assert all(b - a >= 0.2 for a, b in zip(calls, calls[1:]))
+
+
+def test_failing_run_once_job_gives_up_after_three_attempts():
+    scheduler = Scheduler()
+    limiter = scheduler.limiter("exchange", rate=1000)
+    calls = []
+
+    async def job():
+        calls.append(1)
+        raise ValueError("bad symbol")
+
+    scheduler.add("pair", job, limiter)
+    run(scheduler.run(until_idle=True))
+    assert len(calls) == 3
+    assert not scheduler.jobs
+
+
+def test_repeating_jobs_are_spread_across_interval():
+    scheduler = Scheduler()
+    limiter = scheduler.limiter("exchange", rate=1000)
+    started = {}
+    start = time.monotonic()
+    for key in range(4):
+        async def job(key=key):
+            started.setdefault(key, time.monotonic() - start)
+        scheduler.add(key, job, limiter, interval=0.4)
+
+    async def until_all_started():
+        task = asyncio.create_task(scheduler.run())
+        while len(started) < 4:
+            await asyncio.sleep(0.01)
+        task.cancel()
+    run(until_all_started())
+    offsets = sorted(started.values())
+    assert [round(b - a, 1) for a, b in zip(offsets, offsets[1:])] == [0.1, 0.1, 0.1]
+
+
+def test_many_run_once_jobs_finish_quickly():
+    scheduler = Scheduler()
+    limiters = [scheduler.limiter(f"exchange{i}", rate=1e6, burst=1e6) for i in range(20)]
+    done = []
+
+    async def job():
+        done.append(1)
+
+    for i in range(40000):
+        scheduler.add(i, job, limiters[i % len(limiters)])
+    started = time.monotonic()
+    run(scheduler.run(until_idle=True), timeout=30)
+    assert len(done) == 40000
+    assert time.monotonic() - started < 10
+
+
+def test_token_bucket_limits_rate():
+    limiter = TokenBucket(rate=50, burst=1)
+    started = time.monotonic()
+    for _ in range(11):
+        limiter.wait()
+        limiter.release()
+    assert time.monotonic() - started >= 0.19
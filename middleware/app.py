@@ -1,10 +1,32 @@
-from flask import Flask, jsonify, request
-from psycopg2 import connect, sql
+from flask import Flask, Response, g, jsonify, request
+from psycopg2 import sql
+from psycopg2.extensions import QueryCanceledError, register_type
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
 from flask_cors import CORS
+from contextlib import nullcontext
+import hmac
 import os
-import base64
+import threading
+import time
+
+from cost_guard import ESTIMATE_PREFIX, CostGuard, QueryRejected, QueryTimeout, scanned_rows
+from db_pool import ConnectionPool
+from hot_cache import HotWindowCache
+from live_feed import LiveFeed
+from metrics import METRICS_MIMETYPE, finish_request, phase, render, start_request
+from queries import CEX_EXCHANGE_NAMES, STATIC_TOKEN_BY_SYMBOL, window_candidates
+from response_cache import ResponseCache
+from singleflight import SingleFlight
+from slow_queries import SlowQueryLog, install as install_slow_query_log
+from token_index import TokenIndex
+from serialization import NUMERIC_AS_TEXT, available_formats, dumps, execute_rowset, json_array_chunk, mimetype_for
+from url_params import unhash_list, unhash_str
+from window_api import (
+    HISTORY_TABLES, WINDOW_MODES, LatestTimestamps, WindowBodies, batch_body, batch_specs, cache_headers, collect_stats,
+    ends_before, error_payload, etag_matches, hot_cache_result, next_page_cursor, ohlcv_dex_key, ohlcv_key,
+    page_query, parse_batch_spec, token_history_key, window_result
+)
 
 # Load environment variables from .env file
 load_dotenv()
@@ -18,143 +40,405 @@ DB_CONFIG = {
     'port': os.getenv('DB_PORT')
 }
 
-def unhash_str(hashed_string):
+# Connection pool shared by every route; sized through environment variables
+db_pool = ConnectionPool(
+    DB_CONFIG,
+    min_size=int(os.getenv('DB_POOL_MIN_SIZE', 1)),
+    max_size=int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+    max_lifetime=float(os.getenv('DB_POOL_MAX_LIFETIME', 1800)),
+    healthcheck_interval=float(os.getenv('DB_POOL_HEALTHCHECK_INTERVAL', 30)),
+    acquire_timeout=float(os.getenv('DB_POOL_TIMEOUT', 10))
+)
+
+# Page size bounds for keyset-paginated endpoints and fetch size for streamed ones
+PAGE_LIMIT_MAX = int(os.getenv('PAGE_LIMIT_MAX', 10000))
+STREAM_CHUNK_ROWS = int(os.getenv('STREAM_CHUNK_ROWS', 2000))
+
+# Cache of window responses; entries expire just after the next candle lands
+response_cache = ResponseCache(int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024)))
+RESPONSE_CACHE_GRACE_SECONDS = float(os.getenv('RESPONSE_CACHE_GRACE_SECONDS', 5))
+
+# Upper bound on the number of window queries in one /api/batch request
+BATCH_MAX_QUERIES = int(os.getenv('BATCH_MAX_QUERIES', 50))
+
+# Windows ending before the newest ingested row never change; browsers and proxies may keep them this long
+HISTORICAL_MAX_AGE = int(os.getenv('HISTORICAL_MAX_AGE', 86400))
+
+# Identical concurrent window queries share one in-flight DB query and serialized body
+inflight = SingleFlight()
+window_bodies = WindowBodies(response_cache, HISTORICAL_MAX_AGE, RESPONSE_CACHE_GRACE_SECONDS)
+
+# Serve bucketed OHLCV windows from the 5m/1h/1d rollup tables when they are coarse enough
+USE_OHLCV_ROLLUPS = os.getenv('OHLCV_USE_ROLLUPS', 'true').lower() == 'true'
+
+# Window queries estimated (from planner statistics) to read more than WINDOW_MAX_ROWS rows fall back
+# to coarser OHLCV rollups or get a 413; every window query also runs under a per-route statement timeout
+cost_guard = CostGuard(
+    max_rows=int(os.getenv('WINDOW_MAX_ROWS', 2000000)),
+    timeouts_ms={
+        'ohlcv': int(os.getenv('OHLCV_QUERY_TIMEOUT_MS', 15000)),
+        'ohlcv_dex': int(os.getenv('DEX_QUERY_TIMEOUT_MS', 10000)),
+        'dynamic_pairs': int(os.getenv('DYNAMIC_PAIRS_QUERY_TIMEOUT_MS', 10000)),
+        'token_history': int(os.getenv('TOKEN_HISTORY_QUERY_TIMEOUT_MS', 10000))
+    },
+    default_timeout_ms=int(os.getenv('QUERY_TIMEOUT_MS', 30000))
+)
+
+# New candles pushed to /api/live subscribers straight from the Kinesis stream the consumer reads
+live_feed = LiveFeed(
+    stream_name=os.getenv('KINESIS_STREAM_NAME', 'liquidityxyz-master'),
+    region=os.getenv('KINESIS_REGION', 'us-east-2'),
+    queue_size=int(os.getenv('LIVE_FEED_QUEUE_SIZE', 256))
+)
+LIVE_FEED_MAX_CLIENTS = int(os.getenv('LIVE_FEED_MAX_CLIENTS', 500))
+LIVE_FEED_HEARTBEAT = float(os.getenv('LIVE_FEED_HEARTBEAT', 15))
+
+# Newest HOT_CACHE_CANDLES candles per (exchange, symbol, network_id) kept in memory for
+# bucketed /api/ohlcv windows; 0 disables it
+HOT_CACHE_CANDLES = int(os.getenv('HOT_CACHE_CANDLES', 1440))
+HOT_CACHE_POLL_SECONDS = float(os.getenv('HOT_CACHE_POLL_SECONDS', 5))
+
+# static_tokens kept in memory for symbol lookups and /api/tokens/search, reloaded when the table changes
+token_index = TokenIndex(max_results=int(os.getenv('TOKEN_SEARCH_MAX_RESULTS', 20)))
+TOKEN_INDEX_POLL_SECONDS = float(os.getenv('TOKEN_INDEX_POLL_SECONDS', 30))
+
+# Queries slower than SLOW_QUERY_MS (0 disables) are logged; SLOW_QUERY_EXPLAIN_RATE of them get a plan
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 500))
+SLOW_QUERY_EXPLAIN_RATE = float(os.getenv('SLOW_QUERY_EXPLAIN_RATE', 0.1))
+SLOW_QUERY_EXPLAIN_TIMEOUT_MS = int(os.getenv('SLOW_QUERY_EXPLAIN_TIMEOUT_MS', 60000))
+
+# Required (as X-Admin-Token or a Bearer token) by /api/admin endpoints; unset disables them
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+hot_cache = HotWindowCache(
+    capacity=HOT_CACHE_CANDLES,
+    max_series=int(os.getenv('HOT_CACHE_MAX_SERIES', 500))
+) if HOT_CACHE_CANDLES > 0 else None
+
+# Initialize Flask application
+app = Flask(__name__)
+CORS(app, expose_headers=["X-Next-Cursor"])
+
+# Per-endpoint latency, phase, size and row-count histograms, served at /metrics
+@app.before_request
+def start_request_timer():
+    g.request_timer = start_request()
+
+@app.after_request
+def record_request_metrics(response):
+    timer = g.pop('request_timer', None)
+    if timer is not None:
+        # Streamed bodies are still being generated here, so their size is unknown
+        size = None if response.is_streamed else response.content_length
+        finish_request(timer, request.endpoint, response.status_code, size)
+    return response
+
+# Function to borrow a pooled database connection; use as a context manager
+def get_db_connection():
+    return db_pool.connection()
+
+# Reuse a connection the caller already holds (batch requests), otherwise borrow one
+def use_connection(conn=None):
+    return nullcontext(conn) if conn is not None else get_db_connection()
+
+
+
+
+
+def estimate_rows(conn, query, params):
+    with phase("estimate"), conn.cursor() as cur:
+        cur.execute(ESTIMATE_PREFIX + query, params)
+        return scanned_rows(cur.fetchone()[0])
+
+def run_window(conn, route, candidates):
     """
-    Unhash a string back into an url-safe string.
+    Run the first of candidates that cost_guard accepts, under the route's
+    statement timeout. Raises WindowTooLarge or QueryTimeout (both QueryRejected).
     """
+    query, params = cost_guard.choose(candidates, lambda query, params: estimate_rows(conn, query, params))
+    timeout_ms = cost_guard.timeout_ms(route)
     try:
-        padding = len(hashed_string) % 4
-        if padding:
-            hashed_string += '=' * (4 - padding)
-        decoded = base64.urlsafe_b64decode(hashed_string).decode()
-        return decoded
-    except Exception as e:
-        return None
+        return execute_rowset(conn, query, params, timeout_ms)
+    except QueryCanceledError:
+        # Leave the connection usable for the rest of a batch
+        conn.rollback()
+        raise QueryTimeout(route, timeout_ms)
 
-def unhash_list(hashed_string):
+def stream_json_rows(query, params=None):
     """
-    Unhash a string back into a list of exchanges.
+    Stream a query result as a JSON array using a server-side named cursor, so
+    only STREAM_CHUNK_ROWS rows are held in memory at a time. The first chunk is
+    fetched up front so query errors still surface as a 500 before streaming.
     """
+    conn = db_pool.getconn()
     try:
-        padding = len(hashed_string) % 4
-        if padding:
-            hashed_string += '=' * (4 - padding)
-        decoded = base64.urlsafe_b64decode(hashed_string).decode()
-        return decoded.split(",")
-    except Exception as e:
-        return None
+        cur = conn.cursor(name="stream_json_rows")
+        register_type(NUMERIC_AS_TEXT, cur)
+        cur.execute(query, params)
+        chunk = cur.fetchmany(STREAM_CHUNK_ROWS)
+        columns = [d.name for d in cur.description]
+        type_codes = [d.type_code for d in cur.description]
+    except Exception:
+        db_pool.putconn(conn)
+        raise
+
+    def generate(chunk):
+        yield b"["
+        first = True
+        while chunk:
+            yield json_array_chunk(columns, type_codes, chunk, first)
+            first = False
+            chunk = cur.fetchmany(STREAM_CHUNK_ROWS)
+        yield b"]"
+
+    def release():
+        try:
+            cur.close()
+        except Exception:
+            pass
+        db_pool.putconn(conn)
+
+    response = Response(generate(chunk), mimetype="application/json")
+    # Runs even if the client disconnects before the body is consumed
+    response.call_on_close(release)
+    return response
+
+def explain_query(query, params):
+    """
+    EXPLAIN (ANALYZE, BUFFERS) output for a slow query, run on its own pooled connection.
+    """
+    with get_db_connection() as conn, conn.cursor() as cur:
+        cur.execute("SET LOCAL statement_timeout = %s;", (SLOW_QUERY_EXPLAIN_TIMEOUT_MS,))
+        cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + query, params)
+        return "\n".join(row[0] for row in cur.fetchall())
+
+slow_query_log = SlowQueryLog(
+    threshold_ms=SLOW_QUERY_MS,
+    explain_sample_rate=SLOW_QUERY_EXPLAIN_RATE,
+    path=os.getenv('SLOW_QUERY_LOG', 'slow_queries.log'),
+    explain=explain_query
+)
+install_slow_query_log(slow_query_log)
+
+def is_admin():
+    token = request.headers.get('X-Admin-Token') or request.headers.get('Authorization', '').removeprefix('Bearer ')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+def run_hot_cache():
+    """
+    Warm hot_cache from ohlcv_data, then pull new rows every HOT_CACHE_POLL_SECONDS.
+    """
+    while True:
+        try:
+            with get_db_connection() as conn:
+                hot_cache.refresh(lambda query, params: execute_rowset(conn, query, params).rows)
+        except Exception as e:
+            print(f"Error refreshing hot cache: {e}")
+        time.sleep(HOT_CACHE_POLL_SECONDS)
+
+if hot_cache is not None:
+    threading.Thread(target=run_hot_cache, name="hot-cache", daemon=True).start()
+
+def run_token_index():
+    """
+    Load token_index, then check static_tokens for changes every TOKEN_INDEX_POLL_SECONDS.
+    """
+    while True:
+        try:
+            with get_db_connection() as conn:
+                token_index.refresh(lambda query, params: execute_rowset(conn, query, params))
+        except Exception as e:
+            print(f"Error refreshing token index: {e}")
+        time.sleep(TOKEN_INDEX_POLL_SECONDS)
 
-def sample_rows(rows, k):
-    # Calculate the step size for even sampling
-    step = max(len(rows) // k, 1)
-    
-    # Sample rows at calculated intervals
-    rows = rows[::step][:k]
+threading.Thread(target=run_token_index, name="token-index", daemon=True).start()
+
+def find_tokens(*symbols):
+    """
+    static_tokens records for symbols (None where unknown), from token_index
+    once it has loaded and from the table until then.
+    """
+    if token_index.ready:
+        return [token_index.by_symbol(symbol) for symbol in symbols]
+    records = []
+    with get_db_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        for symbol in symbols:
+            cur.execute(STATIC_TOKEN_BY_SYMBOL, {"symbol": symbol})
+            records.append(cur.fetchone())
+    return records
+
+# Newest timestamp per table, refreshed once per candle interval
+latest_timestamps = LatestTimestamps(RESPONSE_CACHE_GRACE_SECONDS)
+
+def latest_timestamp(table):
+    """
+    Newest timestamp ingested into table. Requests that find the memo expired
+    share a single refresh query.
+    """
+    fresh, latest = latest_timestamps.get(table)
+    if fresh:
+        return latest
 
-    return rows
+    def refresh():
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute(f"SELECT MAX(timestamp) FROM {table};")
+            latest = cur.fetchone()[0]
+        latest_timestamps.set(table, latest)
+        return latest
 
+    return inflight.do(("latest_timestamp", table), refresh)
 
-# Initialize Flask application
-app = Flask(__name__)
-CORS(app)
-# Function to get database connection
-def get_db_connection():
-    return connect(**DB_CONFIG)
+def is_historical(table, end_time):
+    """
+    True when the requested window ends before the newest row in table, so its
+    response can no longer change.
+    """
+    return ends_before(end_time, latest_timestamp(table))
 
+def conditional_response(response, historical):
+    """
+    Tag a successful response with window_api.cache_headers and answer
+    If-None-Match with 304.
+    """
+    if response.status_code != 200:
+        return response
+    headers = cache_headers(response.get_data(), historical, HISTORICAL_MAX_AGE)
+    if etag_matches(request.headers.get("If-None-Match"), headers["ETag"]):
+        return Response(status=304, headers=headers)
+    response.headers.update(headers)
+    return response
+
+def error_response(error):
+    payload, status = error_payload(error)
+    return jsonify(payload), status
+
+def cached_body(key, compute, historical=False, fmt="json"):
+    """
+    Return the encoded (body, status) for key from window_bodies, calling
+    compute() -> (payload, status) on a miss and encoding it in fmt. Concurrent
+    misses for the same key are coalesced so only one of them queries the database.
+    """
+    key = key + (fmt,)
+    cached = window_bodies.get(key)
+    return cached if cached is not None else inflight.do(key, lambda: window_bodies.store(key, compute(), historical))
 
+def cached_response(key, compute, historical=False, fmt="json"):
+    """
+    Serve a window response through cached_body, with ETag/Cache-Control headers.
+    """
+    body, status = cached_body(key, compute, historical, fmt)
+    return conditional_response(Response(body, status=status, mimetype=mimetype_for(fmt, status)), historical)
 
+def response_format():
+    """
+    Response format requested with ?format= (json, columnar or msgpack), or None if unsupported.
+    """
+    fmt = request.args.get('format', 'json')
+    return fmt if fmt in available_formats() else None
 
+def ohlcv_table_response():
+    """
+    Serve the whole ohlcv_data table. With ?limit and/or ?cursor it returns one
+    keyset page ordered by (timestamp, id) and sets X-Next-Cursor when more rows
+    remain; otherwise the table is streamed with constant memory.
+    """
+    try:
+        page = page_query(request.args.get('cursor'), request.args.get('limit', type=int), PAGE_LIMIT_MAX)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if page is None:
+        return stream_json_rows("SELECT * FROM ohlcv_data ORDER BY timestamp, id;")
+
+    query, params = page
+    with get_db_connection() as conn:
+        rows = execute_rowset(conn, query, params)
+
+    response = Response(dumps(rows), mimetype=app.json.mimetype)
+    cursor = next_page_cursor(rows, params["limit"])
+    if cursor is not None:
+        response.headers["X-Next-Cursor"] = cursor
+    return response, 200
 
 # Endpoint to fetch all trading pairs
 @app.route('/api/trading_pairs', methods=['GET'])
 def get_all_trading_pairs():
-    conn = get_db_connection()
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM ohlcv_data;")
-            rows = cur.fetchall()
-        return jsonify(rows), 200
+        return ohlcv_table_response()
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
+        return error_response(e)
 
 # Endpoint to fetch trading pairs by exchange
 @app.route('/api/trading_pairs/exchange/<string:exchange>', methods=['GET'])
 def get_trading_pairs_by_exchange(exchange):
     try:
-        conn = get_db_connection()
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        with get_db_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute("SELECT * FROM ohlcv_data WHERE exchange = %s;", (exchange,))
             rows = cur.fetchall()
         if not rows:
             return jsonify({"error": "No trading pairs found for the specified exchange"}), 404
         return jsonify(rows), 200
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
+        return error_response(e)
 
 # Endpoint to fetch a specific trading pair by exchange and symbol
 @app.route('/api/trading_pairs/<string:exchange>/<string:symbol>', methods=['GET'])
 def get_trading_pair(exchange, symbol):
     try:
-        conn = get_db_connection()
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        with get_db_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute("SELECT * FROM trading_pairs WHERE exchange_id = %s AND symbol = %s;", (exchange, symbol))
             row = cur.fetchone()
         if not row:
             return jsonify({"error": "Trading pair not found"}), 404
         return jsonify(row), 200
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
+        return error_response(e)
+
+def query_window(route, args, conn=None):
+    """
+    Run a window route's query and return (payload, status), from hot_cache when
+    it holds the whole window.
+    :param args: The route's window builder arguments, as in queries.window_candidates
+    """
+    result = hot_cache_result(hot_cache, route, args, USE_OHLCV_ROLLUPS)
+    if result is not None:
+        return result
+
+    with use_connection(conn) as conn:
+        try:
+            rows = run_window(conn, route, window_candidates(route, args, USE_OHLCV_ROLLUPS))
+        except QueryRejected as e:
+            return window_result(route, args, rejected=e)
+    return window_result(route, args, rows)
 
 @app.route('/api/ohlcv/<string:hashed_exchanges>/<string:hashed_symbol>/<string:start_time>/<string:end_time>', methods=['GET'])
 def get_trading_pairs(hashed_exchanges, hashed_symbol, start_time, end_time):
+    # ?mode=bucket (default) aggregates candles into k time buckets per exchange,
+    # ?mode=sample keeps every Nth raw row per exchange; ?format=columnar|msgpack for column arrays
     try:
         # Unhash the exchanges list
         exchanges = unhash_list(hashed_exchanges)
-        placeholders = ','.join(['%s'] * len(exchanges))
 
         symbol = unhash_str(hashed_symbol)
         sTime = unhash_str(start_time)
         eTime = unhash_str(end_time)
+        mode = request.args.get('mode', 'bucket')
 
-        print(sTime, eTime)
-
-        k = 1000 # k determines the granularity of the data points returned per exchange
         if not exchanges:
             return jsonify({"error": "Invalid exchanges parameter"}), 400
-
-        conn = get_db_connection()
-        
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Query for all matching trading pairs
-            query = f"""
-            WITH exchange_data AS (
-                    SELECT *,
-                           ROW_NUMBER() OVER (PARTITION BY exchange ORDER BY timestamp) AS row_num,
-                           COUNT(*) OVER (PARTITION BY exchange) AS total_rows
-                    FROM ohlcv_data
-                    WHERE exchange IN ({placeholders}) AND symbol = %s AND timestamp BETWEEN %s AND %s
-                )
-                SELECT *
-                FROM exchange_data
-                WHERE MOD(row_num, GREATEST(total_rows / %s, 1)) = 0 OR row_num = total_rows;
-            """
-           
-            cur.execute(query, (*exchanges, symbol, sTime, eTime, k))
-            rows = cur.fetchall()
-
-        if not rows:
-            return jsonify({"error": "No trading pairs found"}), 404
-        return jsonify(rows), 200
+        if mode not in WINDOW_MODES:
+            return jsonify({"error": "Invalid mode parameter"}), 400
+        fmt = response_format()
+        if fmt is None:
+            return jsonify({"error": "Invalid format parameter"}), 400
+
+        args = (exchanges, symbol, sTime, eTime, mode)
+        return cached_response(
+            ohlcv_key(*args),
+            lambda: query_window('ohlcv', args),
+            historical=is_historical(HISTORY_TABLES['ohlcv'], eTime),
+            fmt=fmt
+        )
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
+        return error_response(e)
 
 
 @app.route('/api/ohlcv/dex/<string:hashed_symbol>/<string:start_time>/<string:end_time>', methods=['GET'])
@@ -169,48 +453,21 @@ def get_trading_pairs_dex(hashed_symbol, start_time, end_time):
 
         network_id = request.args.get('network_id', type=int)
 
-        k = 50 # k determines the granularity of the data points returned per exchange
         if not all([symbol, sTime, eTime]):
             return jsonify({"error": "Invalid exchanges parameter"}), 400
-
-        conn = get_db_connection()
-        
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            network_id_query = f"AND network_id = {network_id}" if network_id else ""
-            # Query for all matching trading pairs
-            # query = f"""
-            # WITH exchange_data AS (
-            #         SELECT *,
-            #                ROW_NUMBER() OVER (PARTITION BY exchange ORDER BY timestamp) AS row_num,
-            #                COUNT(*) OVER (PARTITION BY exchange) AS total_rows
-            #         FROM ohlcv_data
-            #         WHERE symbol = %s AND (timestamp BETWEEN %s AND %s) AND network_id IS NOT NULL {network_id_query}
-            #     )
-            #     SELECT *
-            #     FROM exchange_data
-            #     WHERE MOD(row_num, GREATEST(total_rows / %s, 1)) = 1 OR row_num = total_rows;
-            # """
-            query = f"""
-                SELECT *
-                FROM ohlcv_data
-                WHERE symbol = %s AND (timestamp BETWEEN %s AND %s) AND network_id IS NOT NULL {network_id_query}
-                ORDER BY timestamp ASC;
-            """
-           
-            cur.execute(query, (symbol, sTime, eTime))
-            rows = cur.fetchall()
-            
-        if not rows:
-            return jsonify({"error": "No trading pairs found"}), 404
-        
-        if len(rows) > k:
-            rows = sample_rows(rows, k)
-
-        return jsonify(rows), 200
+        fmt = response_format()
+        if fmt is None:
+            return jsonify({"error": "Invalid format parameter"}), 400
+
+        args = (symbol, sTime, eTime, network_id)
+        return cached_response(
+            ohlcv_dex_key(*args),
+            lambda: query_window('ohlcv_dex', args),
+            historical=is_historical(HISTORY_TABLES['ohlcv_dex'], eTime),
+            fmt=fmt
+        )
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
+        return error_response(e)
 
 # Endpoint to fetch pair data between timerange a and b given a pair
 @app.route('/api/dynamic_pairs/<string:hashed_symbol>/<string:start_time>/<string:end_time>', methods=['GET'])
@@ -225,64 +482,23 @@ def get_dynamic_pairs_data(hashed_symbol, start_time, end_time):
         # Decode the URL-safe timestamps
         start_timestamp = unhash_str(start_time)
         end_timestamp = unhash_str(end_time)
-        print(symbol1, symbol2, start_timestamp, end_timestamp)
         
         if not all([start_timestamp, end_timestamp, symbol1, symbol2]):
             return jsonify({"error": "Invalid input format"}), 400
 
-        k = 50  # k determines the granularity of the data points returned per exchange
-        conn = get_db_connection()
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # First find token name for each symbol
-            query = f"""
-                SELECT *
-                FROM static_tokens
-                WHERE symbol = %s
-                LIMIT 1;
-            """
-            cur.execute(query, (symbol1,))
-            token1 = cur.fetchone()
-            cur.execute(query, (symbol2,))
-            token2 = cur.fetchone()
-            if not token1 or not token2:
-                return jsonify({"error": "Token not found"}), 404
-            token1, token2 = token1['name'], token2['name']
-
-            # Query pairs where either token can be in either position
-            query = f"""
-                SELECT *
-                FROM dynamic_pairs
-                WHERE (
-                        (token_name = %s AND backing_token_name = %s)
-                        OR 
-                        (token_name = %s AND backing_token_name = %s)
-                    )
-                    AND timestamp BETWEEN %s AND %s
-                ORDER BY timestamp ASC;
-            """
-            
-            cur.execute(query, (
-                token1, token2,  # First pair possibility
-                token2, token1,  # Second pair possibility (reversed)
-                start_timestamp, end_timestamp
-            ))
-            rows = cur.fetchall()
-            
-            if not rows:
-                return jsonify({
-                    "error": f"No pairs found for tokens {token1} and {token2} in the specified time range"
-                }), 404
-            
-            # If number of rows > k, evenly sample k rows
-            if len(rows) > k:
-                rows = sample_rows(rows, k)
-                
-            return jsonify(rows), 200
+        # First find token name for each symbol
+        token1, token2 = find_tokens(symbol1, symbol2)
+        if not token1 or not token2:
+            return jsonify({"error": "Token not found"}), 404
+        token1, token2 = token1['name'], token2['name']
+
+        # Query pairs where either token can be in either position, downsampled in Postgres
+        payload, status = query_window('dynamic_pairs', (token1, token2, start_timestamp, end_timestamp))
+        response = Response(dumps(payload), status=status, mimetype=app.json.mimetype)
+        return conditional_response(response, is_historical(HISTORY_TABLES['dynamic_pairs'], end_timestamp))
             
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
+        return error_response(e)
 
 
 @app.route('/api/token_history/<string:token>/<string:start_time>/<string:end_time>', methods=['GET'])
@@ -297,81 +513,165 @@ def get_token_history(token, start_time, end_time):
 
         network_id = request.args.get('network_id', type=int)
 
-        k = 50 # k determines the granularity of the data points returned per exchange
         if not all([token, sTime, eTime]):
             return jsonify({"error": "Invalid exchanges parameter"}), 400
+        fmt = response_format()
+        if fmt is None:
+            return jsonify({"error": "Invalid format parameter"}), 400
+
+        args = (token, sTime, eTime, network_id)
+        return cached_response(
+            token_history_key(*args),
+            lambda: query_window('token_history', args),
+            historical=is_historical(HISTORY_TABLES['token_history'], eTime),
+            fmt=fmt
+        )
+    except Exception as e:
+        return error_response(e)
 
-        conn = get_db_connection()
-        
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            network_id_query = f"AND network_id = {network_id}" if network_id else ""
-            # Query for all matching trading pairs
-            query = f"""
-                SELECT *
-                FROM dynamic_tokens
-                WHERE symbol = %s 
-                AND (timestamp BETWEEN %s AND %s) 
-                AND network_id IS NOT NULL 
-                {network_id_query}
-                ORDER BY timestamp ASC;
-            """
-            cur.execute(query, (token, sTime, eTime))
-            rows = cur.fetchall()
-
-        if not rows:
-            return jsonify({"error": f"No token data found for {token}"}), 404
-
-        # If number of rows > k, evenly sample k rows
-        if len(rows) > k:
-            rows = sample_rows(rows, k)
 
-        return jsonify(rows), 200
+# Endpoint to run several window queries in one round trip
+@app.route('/api/batch', methods=['POST'])
+def batch_query():
+    # body: {"queries": [{"id": "btc", "kind": "ohlcv", "exchanges": ["kraken", "okx"], "symbol": "BTC/USDT",
+    #                     "start": "2024-12-16 12:30:10", "end": "2024-12-17 17:30:10"},
+    #                    {"id": "pepe", "kind": "token_history", "symbol": "Pepe Unchained", "network_id": 1, ...}]}
+    # response: {"results": {"btc": <same body as the GET route>, ...}, "status": {"btc": 200, ...}}
+    # Parameters are plain strings here, not base64 like the GET routes.
+    try:
+        try:
+            specs, ids = batch_specs(request.get_json(silent=True), BATCH_MAX_QUERIES)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        results = []
+        # Every spec that misses the cache runs on this one connection
+        with get_db_connection() as conn:
+            for spec_id, spec in zip(ids, specs):
+                try:
+                    route, key, args = parse_batch_spec(spec)
+                    historical = is_historical(HISTORY_TABLES[route], spec["end"])
+                    body, status = cached_body(key, lambda: query_window(route, args, conn), historical)
+                except ValueError as e:
+                    body, status = dumps({"error": str(e)}), 400
+                results.append((spec_id, body, status))
+
+        return Response(batch_body(results), status=200, mimetype=app.json.mimetype)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
+        return error_response(e)
 
+# Endpoint for token autocomplete, answered from token_index
+@app.route('/api/tokens/search', methods=['GET'])
+def search_tokens():
+    # /api/tokens/search?q=pep&limit=10&network_id=1 -> static_tokens rows whose symbol, name or address
+    # starts with q, exact symbol matches first
+    try:
+        if not token_index.ready:
+            return jsonify({"error": "Token index is still loading"}), 503
+        q = request.args.get('q', '')
+        limit = request.args.get('limit', type=int)
+        network_id = request.args.get('network_id', type=int)
+        return Response(dumps(token_index.search(q, limit, network_id)), mimetype=app.json.mimetype)
+    except Exception as e:
+        return error_response(e)
 
 # Endpoint to get the address of a pair given exchange and symbol name from table
 @app.route('/api/get_pair_addresses', methods=['GET'])
 def get_pair_addresses():
-    conn = get_db_connection()
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        with get_db_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute("SELECT backing_token_name, exchange_name, pair_address FROM pairs;")
             rows = cur.fetchall()
         return jsonify(rows), 200
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
+        return error_response(e)
 
 # Endpoint to get vis data
 @app.route('/api/get_visualization', methods=['GET'])
 def get_visualization():
-    conn = get_db_connection()
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * from ohlcv_data;")
-            rows = cur.fetchall()
-        return jsonify(rows), 200
+        return ohlcv_table_response()
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
+        return error_response(e)
         
 @app.route('/api/get_all_exchange_names', methods=['GET'])
 def get_all_exchange_names():
-    conn = get_db_connection()
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT DISTINCT exchange FROM ohlcv_data WHERE network_id IS NULL AND exchange NOT ILIKE 'uni%';")
+        with get_db_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(CEX_EXCHANGE_NAMES)
             rows = cur.fetchall()
         return jsonify(rows), 200
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
+        return error_response(e)
+
+# Endpoint to push new candles for the subscribed symbols as Server-Sent Events
+@app.route('/api/live/ohlcv/<string:hashed_symbols>', methods=['GET'])
+def live_ohlcv(hashed_symbols):
+    # example: /api/live/ohlcv/QlRDL1VTRFQsRVRIL1VTRFQ?exchanges=a3Jha2VuLG9reA
+    #                         /BTC/USDT,ETH/USDT          ?exchanges=kraken,okx
+    # Each candle arrives as "event: candle" with a row shaped like the /api/ohlcv rows;
+    # a client whose queue fills up gets "event: dropped" and should reconnect and re-poll.
+    try:
+        symbols = unhash_list(hashed_symbols)
+        exchanges = unhash_list(request.args['exchanges']) if 'exchanges' in request.args else None
+
+        if not symbols:
+            return jsonify({"error": "Invalid symbols parameter"}), 400
+        if len(live_feed) >= LIVE_FEED_MAX_CLIENTS:
+            return jsonify({"error": "Too many live clients"}), 503
+
+        subscription = live_feed.subscribe(symbols, exchanges)
+
+        def generate():
+            try:
+                yield b"retry: 5000\n\n"
+                yield from subscription.events(LIVE_FEED_HEARTBEAT)
+            finally:
+                live_feed.unsubscribe(subscription)
+
+        response = Response(generate(), mimetype="text/event-stream")
+        response.headers["Cache-Control"] = "no-cache"
+        # Stop nginx from buffering the stream
+        response.headers["X-Accel-Buffering"] = "no"
+        return response
+    except Exception as e:
+        return error_response(e)
+
+# Endpoint listing the slowest statements with their latest sampled plan
+@app.route('/api/admin/slow_queries', methods=['GET'])
+def get_slow_queries():
+    # ?sort=total_ms (default), max_ms, avg_ms or count; ?limit= (default 20)
+    try:
+        if not is_admin():
+            return jsonify({"error": "Admin token required"}), 403
+        sort = request.args.get('sort', 'total_ms')
+        if sort not in ('total_ms', 'max_ms', 'avg_ms', 'count'):
+            return jsonify({"error": "Invalid sort parameter"}), 400
+        limit = request.args.get('limit', 20, type=int)
+        return Response(dumps(slow_query_log.top(limit, sort)), mimetype=app.json.mimetype)
+    except Exception as e:
+        return error_response(e)
+
+def middleware_stats():
+    return collect_stats(
+        db_pool.stats(),
+        response_cache=response_cache,
+        inflight=inflight,
+        live_feed=live_feed,
+        hot_cache=hot_cache,
+        cost_guard=cost_guard,
+        token_index=token_index
+    )
+
+# Endpoint to report middleware internals used for sizing (connection pool, caches)
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    return jsonify(middleware_stats()), 200
+
+# Endpoint for Prometheus: request histograms plus the /api/stats numbers as gauges
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(render(middleware_stats()), mimetype=METRICS_MIMETYPE)
 
 # Run the Flask application
 if __name__ == '__main__':
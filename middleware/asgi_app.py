@@ -0,0 +1,674 @@
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from dotenv import load_dotenv
+from contextlib import asynccontextmanager
+from functools import wraps
+import asyncio
+import asyncpg
+import hmac
+import os
+import time
+
+from asyncpg_support import init_connection, to_asyncpg
+from cost_guard import ESTIMATE_PREFIX, CostGuard, QueryRejected, QueryTimeout, scanned_rows
+from hot_cache import HotWindowCache
+from live_feed import LiveFeed
+from errors import PoolTimeout
+from metrics import METRICS_MIMETYPE, ASGIMetricsMiddleware, phase, record_rows, render
+from queries import CEX_EXCHANGE_NAMES, STATIC_TOKEN_BY_SYMBOL, window_candidates
+from response_cache import ResponseCache
+from singleflight import AsyncSingleFlight
+from slow_queries import SlowQueryLog, install as install_slow_query_log, observe_query
+from token_index import TokenIndex
+from serialization import JSON_MIMETYPE, RowSet, available_formats, dumps, json_array_chunk, mimetype_for
+from url_params import unhash_list, unhash_str
+from window_api import (
+    HISTORY_TABLES, WINDOW_MODES, LatestTimestamps, WindowBodies, batch_body, batch_specs, cache_headers, collect_stats,
+    ends_before, error_payload, etag_matches, hot_cache_result, next_page_cursor, ohlcv_dex_key, ohlcv_key,
+    page_query, parse_batch_spec, token_history_key, window_result
+)
+
+# Async variant of app.py for an ASGI server, e.g. from the /middleware directory:
+#   uvicorn asgi_app:app --host 0.0.0.0 --port 1024
+# Same routes and response bodies; queries run on asyncpg so a slow window query
+# waits on the event loop instead of holding a worker thread.
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Database connection configuration
+DB_CONFIG = {
+    'database': os.getenv('DB_NAME'),
+    'user': os.getenv('DB_USER'),
+    'password': os.getenv('DB_PASSWORD'),
+    'host': os.getenv('DB_HOST'),
+    'port': int(os.getenv('DB_PORT', 5432))
+}
+
+# Connection pool sizing; DB_POOL_TIMEOUT bounds the wait for a free connection
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 10))
+DB_POOL_MAX_IDLE = float(os.getenv('DB_POOL_MAX_IDLE', 300))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+
+# Seconds a single query may run before it is cancelled server-side and the request gets a 504
+QUERY_TIMEOUT = float(os.getenv('QUERY_TIMEOUT', 30))
+
+PAGE_LIMIT_MAX = int(os.getenv('PAGE_LIMIT_MAX', 10000))
+STREAM_CHUNK_ROWS = int(os.getenv('STREAM_CHUNK_ROWS', 2000))
+
+response_cache = ResponseCache(int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024)))
+RESPONSE_CACHE_GRACE_SECONDS = float(os.getenv('RESPONSE_CACHE_GRACE_SECONDS', 5))
+
+BATCH_MAX_QUERIES = int(os.getenv('BATCH_MAX_QUERIES', 50))
+HISTORICAL_MAX_AGE = int(os.getenv('HISTORICAL_MAX_AGE', 86400))
+
+inflight = AsyncSingleFlight()
+window_bodies = WindowBodies(response_cache, HISTORICAL_MAX_AGE, RESPONSE_CACHE_GRACE_SECONDS)
+
+USE_OHLCV_ROLLUPS = os.getenv('OHLCV_USE_ROLLUPS', 'true').lower() == 'true'
+
+cost_guard = CostGuard(
+    max_rows=int(os.getenv('WINDOW_MAX_ROWS', 2000000)),
+    timeouts_ms={
+        'ohlcv': int(os.getenv('OHLCV_QUERY_TIMEOUT_MS', 15000)),
+        'ohlcv_dex': int(os.getenv('DEX_QUERY_TIMEOUT_MS', 10000)),
+        'dynamic_pairs': int(os.getenv('DYNAMIC_PAIRS_QUERY_TIMEOUT_MS', 10000)),
+        'token_history': int(os.getenv('TOKEN_HISTORY_QUERY_TIMEOUT_MS', 10000))
+    },
+    default_timeout_ms=int(os.getenv('QUERY_TIMEOUT_MS', 30000))
+)
+
+live_feed = LiveFeed(
+    stream_name=os.getenv('KINESIS_STREAM_NAME', 'liquidityxyz-master'),
+    region=os.getenv('KINESIS_REGION', 'us-east-2'),
+    queue_size=int(os.getenv('LIVE_FEED_QUEUE_SIZE', 256))
+)
+LIVE_FEED_MAX_CLIENTS = int(os.getenv('LIVE_FEED_MAX_CLIENTS', 500))
+LIVE_FEED_HEARTBEAT = float(os.getenv('LIVE_FEED_HEARTBEAT', 15))
+
+HOT_CACHE_CANDLES = int(os.getenv('HOT_CACHE_CANDLES', 1440))
+HOT_CACHE_POLL_SECONDS = float(os.getenv('HOT_CACHE_POLL_SECONDS', 5))
+
+token_index = TokenIndex(max_results=int(os.getenv('TOKEN_SEARCH_MAX_RESULTS', 20)))
+TOKEN_INDEX_POLL_SECONDS = float(os.getenv('TOKEN_INDEX_POLL_SECONDS', 30))
+
+SLOW_QUERY_EXPLAIN_TIMEOUT_MS = int(os.getenv('SLOW_QUERY_EXPLAIN_TIMEOUT_MS', 60000))
+# Plans are captured on the log's own thread; lifespan() points explain at the event loop
+slow_query_log = SlowQueryLog(
+    threshold_ms=float(os.getenv('SLOW_QUERY_MS', 500)),
+    explain_sample_rate=float(os.getenv('SLOW_QUERY_EXPLAIN_RATE', 0.1)),
+    path=os.getenv('SLOW_QUERY_LOG', 'slow_queries.log')
+)
+install_slow_query_log(slow_query_log)
+
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+hot_cache = HotWindowCache(
+    capacity=HOT_CACHE_CANDLES,
+    max_series=int(os.getenv('HOT_CACHE_MAX_SERIES', 500))
+) if HOT_CACHE_CANDLES > 0 else None
+
+# Created on startup by lifespan()
+db_pool = None
+
+@asynccontextmanager
+async def lifespan(app):
+    global db_pool
+    db_pool = await asyncpg.create_pool(
+        **DB_CONFIG,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        max_inactive_connection_lifetime=DB_POOL_MAX_IDLE,
+        command_timeout=QUERY_TIMEOUT,
+        init=init_connection
+    )
+    loop = asyncio.get_running_loop()
+    slow_query_log.explain = lambda query, params: asyncio.run_coroutine_threadsafe(
+        explain_query(query, params), loop
+    ).result()
+    hot_cache_task = asyncio.create_task(run_hot_cache()) if hot_cache is not None else None
+    token_index_task = asyncio.create_task(run_token_index())
+    try:
+        yield
+    finally:
+        if hot_cache_task is not None:
+            hot_cache_task.cancel()
+        token_index_task.cancel()
+        slow_query_log.explain = None
+        await db_pool.close()
+
+async def acquire():
+    """
+    Take a connection from the pool, raising PoolTimeout (a 503, as in app.py)
+    rather than asyncio.TimeoutError so it is not reported as a query timeout.
+    """
+    with phase("acquire"):
+        try:
+            return await db_pool.acquire(timeout=DB_POOL_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise PoolTimeout(f"No database connection available after {DB_POOL_TIMEOUT}s")
+
+@asynccontextmanager
+async def get_db_connection():
+    """
+    Borrow a pooled connection; use as an async context manager.
+    """
+    conn = await acquire()
+    try:
+        yield conn
+    finally:
+        await db_pool.release(conn)
+
+@asynccontextmanager
+async def use_connection(conn=None):
+    # Reuse a connection the caller already holds (batch requests), otherwise borrow one
+    if conn is not None:
+        yield conn
+    else:
+        async with get_db_connection() as conn:
+            yield conn
+
+# (column names, type oids) per query text, so only the first run of a query needs a
+# separate prepare to describe its result; later runs use asyncpg's statement cache
+_result_columns = {}
+
+async def fetch_rowset(conn, query, params=None, timeout=None):
+    """
+    Execute a query and return its result as a RowSet, like serialization.execute_rowset.
+    :param timeout: Seconds before the query is cancelled, instead of QUERY_TIMEOUT
+    """
+    timeout = timeout or QUERY_TIMEOUT
+    original, start = query, time.perf_counter()
+    query, args = to_asyncpg(query, params)
+    columns = _result_columns.get(query)
+    # asyncpg executes and fetches in one call, so both count as "execute" here
+    with phase("execute"):
+        if columns is None:
+            statement = await conn.prepare(query, timeout=timeout)
+            attributes = statement.get_attributes()
+            columns = ([a.name for a in attributes], [a.type.oid for a in attributes])
+            rows = await statement.fetch(*args, timeout=timeout)
+            _result_columns[query] = columns
+        else:
+            rows = await conn.fetch(query, *args, timeout=timeout)
+    observe_query(original, params, len(rows), time.perf_counter() - start)
+    record_rows(len(rows))
+    return RowSet(columns[0], columns[1], rows)
+
+async def estimate_rows(conn, query, params):
+    query, args = to_asyncpg(ESTIMATE_PREFIX + query, params)
+    with phase("estimate"):
+        return scanned_rows(await conn.fetchval(query, *args))
+
+async def run_window(conn, route, candidates):
+    """
+    app.run_window: asyncpg cancels the query server-side when the timeout passes.
+    """
+    query, params = await cost_guard.achoose(candidates, lambda query, params: estimate_rows(conn, query, params))
+    timeout_ms = cost_guard.timeout_ms(route)
+    try:
+        return await fetch_rowset(conn, query, params, timeout_ms / 1000)
+    except (asyncio.TimeoutError, asyncpg.QueryCanceledError):
+        raise QueryTimeout(route, timeout_ms)
+
+async def explain_query(query, params):
+    query, args = to_asyncpg("EXPLAIN (ANALYZE, BUFFERS) " + query, params)
+    async with get_db_connection() as conn, conn.transaction(readonly=True):
+        await conn.execute(f"SET LOCAL statement_timeout = {SLOW_QUERY_EXPLAIN_TIMEOUT_MS};")
+        rows = await conn.fetch(query, *args)
+    return "\n".join(row[0] for row in rows)
+
+def is_admin(request):
+    token = request.headers.get('x-admin-token') or request.headers.get('authorization', '').removeprefix('Bearer ')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+async def run_hot_cache():
+    """
+    Same as app.run_hot_cache, as a task on the server's event loop.
+    """
+    while True:
+        try:
+            async with get_db_connection() as conn:
+                async def fetch(query, params):
+                    return (await fetch_rowset(conn, query, params)).rows
+                await hot_cache.arefresh(fetch)
+        except Exception as e:
+            print(f"Error refreshing hot cache: {e}")
+        await asyncio.sleep(HOT_CACHE_POLL_SECONDS)
+
+async def run_token_index():
+    """
+    Same as app.run_token_index, as a task on the server's event loop.
+    """
+    while True:
+        try:
+            async with get_db_connection() as conn:
+                await token_index.arefresh(lambda query, params: fetch_rowset(conn, query, params))
+        except Exception as e:
+            print(f"Error refreshing token index: {e}")
+        await asyncio.sleep(TOKEN_INDEX_POLL_SECONDS)
+
+async def find_tokens(*symbols):
+    """
+    app.find_tokens: from token_index once it has loaded, from the table until then.
+    """
+    if token_index.ready:
+        return [token_index.by_symbol(symbol) for symbol in symbols]
+    records = []
+    async with get_db_connection() as conn:
+        for symbol in symbols:
+            rows = await fetch_rowset(conn, STATIC_TOKEN_BY_SYMBOL, {"symbol": symbol})
+            records.append(rows.records()[0] if rows else None)
+    return records
+
+def json_response(payload, status=200, headers=None):
+    return Response(dumps(payload), status_code=status, headers=headers, media_type=JSON_MIMETYPE)
+
+def handle_errors(endpoint):
+    """
+    Turn exceptions into the JSON error responses app.py returns; query timeouts
+    get a 504.
+    """
+    @wraps(endpoint)
+    async def wrapper(request):
+        try:
+            return await endpoint(request)
+        except (asyncio.TimeoutError, asyncpg.QueryCanceledError) as e:
+            return json_response({"error": f"Query timed out: {e}"}, 504)
+        except Exception as e:
+            return json_response(*error_payload(e))
+    return wrapper
+
+def int_arg(request, name):
+    # Same as Flask's request.args.get(name, type=int): None when missing or invalid
+    try:
+        return int(request.query_params[name])
+    except (KeyError, ValueError):
+        return None
+
+async def stream_json_rows(query, params=None):
+    """
+    Stream a query result as a JSON array from a server-side cursor, holding
+    STREAM_CHUNK_ROWS rows at a time. The first chunk is fetched before the
+    response starts so query errors still surface as a 500.
+    """
+    query, args = to_asyncpg(query, params)
+    conn = await acquire()
+    # asyncpg cursors only live inside a transaction
+    transaction = conn.transaction(readonly=True)
+    try:
+        await transaction.start()
+        statement = await conn.prepare(query, timeout=QUERY_TIMEOUT)
+        cursor = await statement.cursor(*args)
+        chunk = await cursor.fetch(STREAM_CHUNK_ROWS, timeout=QUERY_TIMEOUT)
+        columns = [a.name for a in statement.get_attributes()]
+        type_codes = [a.type.oid for a in statement.get_attributes()]
+    except BaseException:
+        await db_pool.release(conn)
+        raise
+
+    async def generate(chunk):
+        yield b"["
+        first = True
+        while chunk:
+            yield json_array_chunk(columns, type_codes, chunk, first)
+            first = False
+            chunk = await cursor.fetch(STREAM_CHUNK_ROWS, timeout=QUERY_TIMEOUT)
+        yield b"]"
+
+    async def release():
+        try:
+            await transaction.rollback()
+        except Exception:
+            pass
+        await db_pool.release(conn)
+
+    # Background tasks run after the body is sent, and also when the client disconnects
+    return StreamingResponse(generate(chunk), media_type=JSON_MIMETYPE, background=BackgroundTask(release))
+
+# Newest timestamp per table, refreshed once per candle interval
+latest_timestamps = LatestTimestamps(RESPONSE_CACHE_GRACE_SECONDS)
+
+async def latest_timestamp(table):
+    fresh, latest = latest_timestamps.get(table)
+    if fresh:
+        return latest
+
+    async def refresh():
+        async with get_db_connection() as conn:
+            latest = await conn.fetchval(f"SELECT MAX(timestamp) FROM {table};", timeout=QUERY_TIMEOUT)
+        latest_timestamps.set(table, latest)
+        return latest
+
+    return await inflight.do(("latest_timestamp", table), refresh)
+
+async def is_historical(table, end_time):
+    """
+    True when the requested window ends before the newest row in table.
+    """
+    return ends_before(end_time, await latest_timestamp(table))
+
+def conditional_response(request, body, status, media_type, historical):
+    """
+    Same ETag and Cache-Control handling as app.conditional_response.
+    """
+    if status != 200:
+        return Response(body, status_code=status, media_type=media_type)
+    headers = cache_headers(body, historical, HISTORICAL_MAX_AGE)
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(body, status_code=status, headers=headers, media_type=media_type)
+
+async def cached_body(key, compute, historical=False, fmt="json"):
+    """
+    Same as app.cached_body, with compute() a coroutine function.
+    """
+    key = key + (fmt,)
+    cached = window_bodies.get(key)
+    if cached is not None:
+        return cached
+
+    async def load():
+        return window_bodies.store(key, await compute(), historical)
+
+    return await inflight.do(key, load)
+
+async def cached_response(request, key, compute, historical=False, fmt="json"):
+    body, status = await cached_body(key, compute, historical, fmt)
+    return conditional_response(request, body, status, mimetype_for(fmt, status), historical)
+
+def response_format(request):
+    fmt = request.query_params.get('format', 'json')
+    return fmt if fmt in available_formats() else None
+
+async def ohlcv_table_response(request):
+    """
+    Whole ohlcv_data table: streamed, or one keyset page with ?limit and/or ?cursor.
+    """
+    try:
+        page = page_query(request.query_params.get('cursor'), int_arg(request, 'limit'), PAGE_LIMIT_MAX)
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
+    if page is None:
+        return await stream_json_rows("SELECT * FROM ohlcv_data ORDER BY timestamp, id;")
+
+    query, params = page
+    async with get_db_connection() as conn:
+        rows = await fetch_rowset(conn, query, params)
+
+    cursor = next_page_cursor(rows, params["limit"])
+    return json_response(rows, 200, {"X-Next-Cursor": cursor} if cursor is not None else None)
+
+@handle_errors
+async def get_all_trading_pairs(request):
+    return await ohlcv_table_response(request)
+
+@handle_errors
+async def get_trading_pairs_by_exchange(request):
+    async with get_db_connection() as conn:
+        rows = await fetch_rowset(conn, "SELECT * FROM ohlcv_data WHERE exchange = %(exchange)s;", {
+            "exchange": request.path_params['exchange']
+        })
+    if not rows:
+        return json_response({"error": "No trading pairs found for the specified exchange"}, 404)
+    return json_response(rows, 200)
+
+@handle_errors
+async def get_trading_pair(request):
+    async with get_db_connection() as conn:
+        rows = await fetch_rowset(conn, "SELECT * FROM trading_pairs WHERE exchange_id = %(exchange)s AND symbol = %(symbol)s LIMIT 1;", {
+            "exchange": request.path_params['exchange'], "symbol": request.path_params['symbol']
+        })
+    if not rows:
+        return json_response({"error": "Trading pair not found"}, 404)
+    return json_response(rows.records()[0], 200)
+
+async def query_window(route, args, conn=None):
+    """
+    Same as app.query_window.
+    """
+    result = hot_cache_result(hot_cache, route, args, USE_OHLCV_ROLLUPS)
+    if result is not None:
+        return result
+
+    async with use_connection(conn) as conn:
+        try:
+            rows = await run_window(conn, route, window_candidates(route, args, USE_OHLCV_ROLLUPS))
+        except QueryRejected as e:
+            return window_result(route, args, rejected=e)
+    return window_result(route, args, rows)
+
+@handle_errors
+async def get_trading_pairs(request):
+    exchanges = unhash_list(request.path_params['hashed_exchanges'])
+    symbol = unhash_str(request.path_params['hashed_symbol'])
+    sTime = unhash_str(request.path_params['start_time'])
+    eTime = unhash_str(request.path_params['end_time'])
+    mode = request.query_params.get('mode', 'bucket')
+
+    if not exchanges:
+        return json_response({"error": "Invalid exchanges parameter"}, 400)
+    if mode not in WINDOW_MODES:
+        return json_response({"error": "Invalid mode parameter"}, 400)
+    fmt = response_format(request)
+    if fmt is None:
+        return json_response({"error": "Invalid format parameter"}, 400)
+
+    args = (exchanges, symbol, sTime, eTime, mode)
+    return await cached_response(
+        request,
+        ohlcv_key(*args),
+        lambda: query_window('ohlcv', args),
+        historical=await is_historical(HISTORY_TABLES['ohlcv'], eTime),
+        fmt=fmt
+    )
+
+@handle_errors
+async def get_trading_pairs_dex(request):
+    symbol = unhash_str(request.path_params['hashed_symbol'])
+    sTime = unhash_str(request.path_params['start_time'])
+    eTime = unhash_str(request.path_params['end_time'])
+    network_id = int_arg(request, 'network_id')
+
+    if not all([symbol, sTime, eTime]):
+        return json_response({"error": "Invalid exchanges parameter"}, 400)
+    fmt = response_format(request)
+    if fmt is None:
+        return json_response({"error": "Invalid format parameter"}, 400)
+
+    args = (symbol, sTime, eTime, network_id)
+    return await cached_response(
+        request,
+        ohlcv_dex_key(*args),
+        lambda: query_window('ohlcv_dex', args),
+        historical=await is_historical(HISTORY_TABLES['ohlcv_dex'], eTime),
+        fmt=fmt
+    )
+
+@handle_errors
+async def get_dynamic_pairs_data(request):
+    symbol1, symbol2 = unhash_str(request.path_params['hashed_symbol']).split("/")
+    symbol1 = symbol1.strip().replace("%20", " ")
+    symbol2 = symbol2.strip().replace("%20", " ")
+    start_timestamp = unhash_str(request.path_params['start_time'])
+    end_timestamp = unhash_str(request.path_params['end_time'])
+
+    if not all([start_timestamp, end_timestamp, symbol1, symbol2]):
+        return json_response({"error": "Invalid input format"}, 400)
+
+    # First find token name for each symbol
+    token1, token2 = await find_tokens(symbol1, symbol2)
+    if not token1 or not token2:
+        return json_response({"error": "Token not found"}, 404)
+    token1, token2 = token1['name'], token2['name']
+
+    payload, status = await query_window('dynamic_pairs', (token1, token2, start_timestamp, end_timestamp))
+    if status != 200:
+        return json_response(payload, status)
+    historical = await is_historical(HISTORY_TABLES['dynamic_pairs'], end_timestamp)
+    return conditional_response(request, dumps(payload), status, JSON_MIMETYPE, historical)
+
+@handle_errors
+async def get_token_history(request):
+    token = unhash_str(request.path_params['token']).strip().replace("%20", " ")
+    sTime = unhash_str(request.path_params['start_time'])
+    eTime = unhash_str(request.path_params['end_time'])
+    network_id = int_arg(request, 'network_id')
+
+    if not all([token, sTime, eTime]):
+        return json_response({"error": "Invalid exchanges parameter"}, 400)
+    fmt = response_format(request)
+    if fmt is None:
+        return json_response({"error": "Invalid format parameter"}, 400)
+
+    args = (token, sTime, eTime, network_id)
+    return await cached_response(
+        request,
+        token_history_key(*args),
+        lambda: query_window('token_history', args),
+        historical=await is_historical(HISTORY_TABLES['token_history'], eTime),
+        fmt=fmt
+    )
+
+@handle_errors
+async def batch_query(request):
+    # Same body and response as app.batch_query
+    try:
+        body = await request.json()
+    except ValueError:
+        body = None
+    try:
+        specs, ids = batch_specs(body, BATCH_MAX_QUERIES)
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
+
+    results = []
+    async with get_db_connection() as conn:
+        for spec_id, spec in zip(ids, specs):
+            try:
+                route, key, args = parse_batch_spec(spec)
+                historical = await is_historical(HISTORY_TABLES[route], spec["end"])
+                body, status = await cached_body(key, lambda: query_window(route, args, conn), historical)
+            except ValueError as e:
+                body, status = dumps({"error": str(e)}), 400
+            results.append((spec_id, body, status))
+
+    return Response(batch_body(results), status_code=200, media_type=JSON_MIMETYPE)
+
+@handle_errors
+async def search_tokens(request):
+    if not token_index.ready:
+        return json_response({"error": "Token index is still loading"}, 503)
+    q = request.query_params.get('q', '')
+    return json_response(token_index.search(q, int_arg(request, 'limit'), int_arg(request, 'network_id')), 200)
+
+@handle_errors
+async def get_pair_addresses(request):
+    async with get_db_connection() as conn:
+        rows = await fetch_rowset(conn, "SELECT backing_token_name, exchange_name, pair_address FROM pairs;")
+    return json_response(rows, 200)
+
+@handle_errors
+async def get_visualization(request):
+    return await ohlcv_table_response(request)
+
+@handle_errors
+async def get_all_exchange_names(request):
+    async with get_db_connection() as conn:
+        rows = await fetch_rowset(conn, CEX_EXCHANGE_NAMES)
+    return json_response(rows, 200)
+
+@handle_errors
+async def live_ohlcv(request):
+    # Same stream as app.live_ohlcv; each client is a coroutine rather than a thread
+    symbols = unhash_list(request.path_params['hashed_symbols'])
+    exchanges = unhash_list(request.query_params['exchanges']) if 'exchanges' in request.query_params else None
+
+    if not symbols:
+        return json_response({"error": "Invalid symbols parameter"}, 400)
+    if len(live_feed) >= LIVE_FEED_MAX_CLIENTS:
+        return json_response({"error": "Too many live clients"}, 503)
+
+    subscription = live_feed.subscribe(symbols, exchanges, loop=asyncio.get_running_loop())
+
+    async def generate():
+        yield b"retry: 5000\n\n"
+        async for chunk in subscription.aevents(LIVE_FEED_HEARTBEAT):
+            yield chunk
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Runs once the stream ends or the client disconnects
+        background=BackgroundTask(live_feed.unsubscribe, subscription)
+    )
+
+@handle_errors
+async def get_slow_queries(request):
+    if not is_admin(request):
+        return json_response({"error": "Admin token required"}, 403)
+    sort = request.query_params.get('sort', 'total_ms')
+    if sort not in ('total_ms', 'max_ms', 'avg_ms', 'count'):
+        return json_response({"error": "Invalid sort parameter"}, 400)
+    limit = int_arg(request, 'limit') or 20
+    return json_response(slow_query_log.top(limit, sort), 200)
+
+def middleware_stats():
+    size = db_pool.get_size()
+    idle = db_pool.get_idle_size()
+    return collect_stats(
+        {"max_size": db_pool.get_max_size(), "size": size, "in_use": size - idle, "idle": idle},
+        response_cache=response_cache,
+        inflight=inflight,
+        live_feed=live_feed,
+        hot_cache=hot_cache,
+        cost_guard=cost_guard,
+        token_index=token_index
+    )
+
+async def get_stats(request):
+    return json_response(middleware_stats(), 200)
+
+async def get_metrics(request):
+    return Response(render(middleware_stats()), media_type=METRICS_MIMETYPE)
+
+# Static segments are listed before the parameterized routes they would otherwise match
+routes = [
+    Route('/api/trading_pairs', get_all_trading_pairs, methods=['GET']),
+    Route('/api/trading_pairs/exchange/{exchange}', get_trading_pairs_by_exchange, methods=['GET']),
+    Route('/api/trading_pairs/{exchange}/{symbol}', get_trading_pair, methods=['GET']),
+    Route('/api/ohlcv/dex/{hashed_symbol}/{start_time}/{end_time}', get_trading_pairs_dex, methods=['GET']),
+    Route('/api/ohlcv/{hashed_exchanges}/{hashed_symbol}/{start_time}/{end_time}', get_trading_pairs, methods=['GET']),
+    Route('/api/dynamic_pairs/{hashed_symbol}/{start_time}/{end_time}', get_dynamic_pairs_data, methods=['GET']),
+    Route('/api/token_history/{token}/{start_time}/{end_time}', get_token_history, methods=['GET']),
+    Route('/api/batch', batch_query, methods=['POST']),
+    Route('/api/tokens/search', search_tokens, methods=['GET']),
+    Route('/api/get_pair_addresses', get_pair_addresses, methods=['GET']),
+    Route('/api/get_visualization', get_visualization, methods=['GET']),
+    Route('/api/get_all_exchange_names', get_all_exchange_names, methods=['GET']),
+    Route('/api/live/ohlcv/{hashed_symbols}', live_ohlcv, methods=['GET']),
+    Route('/api/admin/slow_queries', get_slow_queries, methods=['GET']),
+    Route('/api/stats', get_stats, methods=['GET']),
+    Route('/metrics', get_metrics, methods=['GET']),
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(
+            CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"], expose_headers=["X-Next-Cursor"]
+        ),
+        Middleware(ASGIMetricsMiddleware)
+    ],
+    lifespan=lifespan
+)
+
+# Run the ASGI application
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=int(os.getenv('FLASK_PORT', 1024)))
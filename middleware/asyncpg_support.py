@@ -0,0 +1,50 @@
+from datetime import datetime
+from functools import lru_cache
+import re
+
+_PLACEHOLDER = re.compile(r"%\((\w+)\)s")
+
+
+@lru_cache(maxsize=256)
+def _convert_placeholders(query):
+    names = {}
+
+    def number(match):
+        names.setdefault(match.group(1), len(names) + 1)
+        return f"${names[match.group(1)]}"
+
+    return _PLACEHOLDER.sub(number, query).replace("%%", "%"), tuple(names)
+
+
+def to_asyncpg(query, params=None):
+    """
+    Rewrite a query using psycopg2 %(name)s placeholders (as built by queries.py)
+    into asyncpg's $n form and return (query, args). Repeated names share one argument.
+    """
+    if not params:
+        return query, []
+    query, names = _convert_placeholders(query)
+    return query, [params[name] for name in names]
+
+
+def timestamp_to_text(value):
+    return value if isinstance(value, str) else value.isoformat(sep=" ")
+
+
+# (type name, encoder, decoder) for text-format codecs on every asyncpg connection
+TYPE_CODECS = (
+    # NUMERIC stays the text Postgres sends, like serialization.NUMERIC_AS_TEXT
+    ('numeric', str, str),
+    # Timestamp parameters may be passed as the strings decoded from the URL
+    ('timestamp', timestamp_to_text, datetime.fromisoformat),
+    ('timestamptz', timestamp_to_text, datetime.fromisoformat),
+)
+
+
+async def init_connection(conn):
+    """
+    asyncpg pool init: decode rows into the same Python values psycopg2 gives
+    the Flask app, so both serialize to the same bytes.
+    """
+    for name, encoder, decoder in TYPE_CODECS:
+        await conn.set_type_codec(name, schema='pg_catalog', encoder=encoder, decoder=decoder, format='text')
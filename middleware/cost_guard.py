@@ -0,0 +1,121 @@
+import json
+
+# Prepended to a window query to get the planner's estimate without running it
+ESTIMATE_PREFIX = "EXPLAIN (FORMAT JSON) "
+
+
+class QueryRejected(Exception):
+    status = 500
+
+    def payload(self):
+        return {"error": str(self)}
+
+
+class WindowTooLarge(QueryRejected):
+    status = 413
+
+    def __init__(self, estimate, limit):
+        super().__init__("Requested time range is too large; narrow it and try again")
+        self.estimate = estimate
+        self.limit = limit
+
+    def payload(self):
+        return {"error": str(self), "estimated_rows": self.estimate, "max_rows": self.limit}
+
+
+class QueryTimeout(QueryRejected):
+    status = 504
+
+    def __init__(self, route, timeout_ms):
+        super().__init__(f"Query timed out after {timeout_ms} ms")
+        self.route = route
+        self.timeout_ms = timeout_ms
+
+
+def _node_scanned_rows(node):
+    children = [_node_scanned_rows(child) for child in node.get("Plans", [])]
+    if "Relation Name" in node:
+        return max([int(node.get("Plan Rows", 0))] + children)
+    # A partitioned table is an Append of per-partition scans, each reading its share
+    if node.get("Node Type") in ("Append", "Merge Append"):
+        return sum(children)
+    return max(children, default=0)
+
+
+def scanned_rows(plan):
+    """
+    Planner estimate of the rows a query reads: the largest "Plan Rows" of any
+    node scanning a table in EXPLAIN (FORMAT JSON) output (a list, or its text),
+    with the scans under an Append (one per partition) added up.
+    The top node's estimate is no use here, since window queries return at most k rows.
+    """
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return max((_node_scanned_rows(entry["Plan"]) for entry in plan), default=0)
+
+
+class CostGuard:
+    def __init__(self, max_rows=2000000, timeouts_ms=None, default_timeout_ms=30000):
+        """
+        Limits on the window endpoints, so one huge range cannot hold a connection
+        and a worker for minutes while every other dashboard waits.
+        :param max_rows: Most rows a window query may be estimated to read; 0 disables the estimate
+        :param timeouts_ms: {route: statement timeout in ms} for routes that differ from the default
+        :param default_timeout_ms: Statement timeout for every other route
+        """
+        self.max_rows = max_rows
+        self.timeouts_ms = timeouts_ms or {}
+        self.default_timeout_ms = default_timeout_ms
+
+        self._rejected = 0
+        self._downgraded = 0
+
+    def timeout_ms(self, route):
+        return self.timeouts_ms.get(route, self.default_timeout_ms)
+
+    def _accepts(self, i, rows):
+        """
+        True when candidate i, estimated to read rows, is within max_rows.
+        """
+        if rows > self.max_rows:
+            return False
+        self._downgraded += i > 0
+        return True
+
+    def _reject(self, rows):
+        self._rejected += 1
+        return WindowTooLarge(rows, self.max_rows)
+
+    def choose(self, candidates, estimate):
+        """
+        The first (query, params) in candidates, finest data first, whose
+        estimated read is within max_rows. Raises WindowTooLarge when none is.
+        :param estimate: estimate(query, params) -> rows, usually scanned_rows of an EXPLAIN
+        """
+        if self.max_rows <= 0:
+            return candidates[0]
+        for i, (query, params) in enumerate(candidates):
+            rows = estimate(query, params)
+            if self._accepts(i, rows):
+                return query, params
+        raise self._reject(rows)
+
+    async def achoose(self, candidates, estimate):
+        """
+        choose() for a coroutine estimate(query, params).
+        """
+        if self.max_rows <= 0:
+            return candidates[0]
+        for i, (query, params) in enumerate(candidates):
+            rows = await estimate(query, params)
+            if self._accepts(i, rows):
+                return query, params
+        raise self._reject(rows)
+
+    def stats(self):
+        return {
+            "max_rows": self.max_rows,
+            "default_timeout_ms": self.default_timeout_ms,
+            "downgraded": self._downgraded,
+            "rejected": self._rejected,
+        }
@@ -0,0 +1,206 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from psycopg2 import connect
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+from metrics import phase
+from errors import PoolTimeout
+
+
+class _PooledConnection:
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class ConnectionPool:
+    def __init__(self, db_config, min_size=1, max_size=10, max_lifetime=1800,
+                 healthcheck_interval=30, acquire_timeout=10):
+        """
+        Bounded pool of psycopg2 connections shared by every route.
+        :param db_config: Keyword arguments for psycopg2.connect
+        :param min_size: Connections opened eagerly at startup
+        :param max_size: Upper bound on open connections
+        :param max_lifetime: Seconds before a connection is closed and replaced
+        :param healthcheck_interval: Idle seconds after which a connection is pinged before reuse
+        :param acquire_timeout: Seconds to wait for a free connection before raising PoolTimeout
+        """
+        self.db_config = db_config
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.max_lifetime = max_lifetime
+        self.healthcheck_interval = healthcheck_interval
+        self.acquire_timeout = acquire_timeout
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._checked_out = {}
+        self._size = 0
+
+        # Counters reported by stats()
+        self._acquired = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._timeouts = 0
+        self._opened = 0
+        self._recycled = 0
+        self._failed_checks = 0
+
+        self._prefill()
+
+    def _prefill(self):
+        for _ in range(min(self.min_size, self.max_size)):
+            try:
+                entry = self._open()
+            except Exception as e:
+                print(f"Error opening pooled connection: {e}")
+                return
+            with self._cond:
+                self._size += 1
+                self._idle.append(entry)
+
+    def _open(self):
+        entry = _PooledConnection(connect(**self.db_config))
+        with self._cond:
+            self._opened += 1
+        return entry
+
+    def _close(self, entry):
+        try:
+            entry.conn.close()
+        except Exception:
+            pass
+
+    def _expired(self, entry, now):
+        return self.max_lifetime and now - entry.created_at > self.max_lifetime
+
+    def _is_usable(self, entry):
+        now = time.monotonic()
+        if entry.conn.closed:
+            return False
+        if self._expired(entry, now):
+            with self._cond:
+                self._recycled += 1
+            return False
+        if now - entry.last_used > self.healthcheck_interval:
+            try:
+                with entry.conn.cursor() as cur:
+                    cur.execute("SELECT 1;")
+                entry.conn.rollback()
+            except Exception:
+                with self._cond:
+                    self._failed_checks += 1
+                return False
+        return True
+
+    def getconn(self):
+        """
+        Borrow a connection, waiting up to acquire_timeout for one to free up.
+        """
+        with phase("acquire"):
+            return self._getconn()
+
+    def _getconn(self):
+        start = time.monotonic()
+        deadline = start + self.acquire_timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    entry = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(f"No database connection available after {self.acquire_timeout}s")
+                self._cond.wait(remaining)
+
+            waited = time.monotonic() - start
+            self._acquired += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+
+        try:
+            if entry is not None and not self._is_usable(entry):
+                self._close(entry)
+                entry = None
+            if entry is None:
+                entry = self._open()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._checked_out[id(entry.conn)] = entry
+        return entry.conn
+
+    def putconn(self, conn, discard=False):
+        """
+        Return a borrowed connection. Open transactions are rolled back so the
+        next borrower starts clean; broken or expired connections are closed.
+        """
+        with self._cond:
+            entry = self._checked_out.pop(id(conn), None)
+        if entry is None:
+            conn.close()
+            return
+
+        if not conn.closed and not discard:
+            try:
+                if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+
+        now = time.monotonic()
+        if conn.closed or discard or self._expired(entry, now):
+            self._close(entry)
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            return
+
+        entry.last_used = now
+        with self._cond:
+            self._idle.append(entry)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "max_size": self.max_size,
+                "size": self._size,
+                "in_use": len(self._checked_out),
+                "idle": len(self._idle),
+                "acquired": self._acquired,
+                "total_wait_ms": round(self._total_wait * 1000, 3),
+                "avg_wait_ms": round(self._total_wait * 1000 / self._acquired, 3) if self._acquired else 0.0,
+                "max_wait_ms": round(self._max_wait * 1000, 3),
+                "timeouts": self._timeouts,
+                "opened": self._opened,
+                "recycled": self._recycled,
+                "failed_health_checks": self._failed_checks,
+            }
+
+    def closeall(self):
+        with self._cond:
+            while self._idle:
+                self._close(self._idle.pop())
+            self._size = len(self._checked_out)
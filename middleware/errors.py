@@ -0,0 +1,4 @@
+class PoolTimeout(Exception):
+    """
+    No database connection became free in time; the request gets a 503.
+    """
@@ -0,0 +1,353 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation, localcontext
+import threading
+
+from serialization import NUMERIC_OID, TIMESTAMP_OID, RowSet
+
+VARCHAR_OID = 1043
+INT4_OID = 23
+
+_EPOCH = datetime(1970, 1, 1)
+
+_HOT_COLUMNS = "id, exchange, symbol, timestamp, open_price, high_price, low_price, close_price, volume, liquidity, network_id"
+
+BOUNDS_QUERY = "SELECT MAX(id), MAX(timestamp) FROM ohlcv_data;"
+WARM_QUERY = f"SELECT {_HOT_COLUMNS} FROM ohlcv_data WHERE timestamp >= %(since)s ORDER BY timestamp, id;"
+# New rows by id; older timestamps (backfills) land wherever they belong in the buffer
+TAIL_QUERY = f"SELECT {_HOT_COLUMNS} FROM ohlcv_data WHERE id > %(last_id)s ORDER BY id LIMIT %(limit)s;"
+# Upserts keep their id, so the newest minutes are re-read to pick up candles rewritten in place
+RECENT_QUERY = f"SELECT {_HOT_COLUMNS} FROM ohlcv_data WHERE timestamp >= %(since)s;"
+
+# Same columns and types as queries.ohlcv_bucket_query
+BUCKET_COLUMNS = [
+    "exchange", "symbol", "timestamp", "open_price", "high_price", "low_price",
+    "close_price", "volume", "liquidity", "network_id",
+]
+BUCKET_TYPES = [
+    VARCHAR_OID, VARCHAR_OID, TIMESTAMP_OID, NUMERIC_OID, NUMERIC_OID, NUMERIC_OID,
+    NUMERIC_OID, NUMERIC_OID, NUMERIC_OID, INT4_OID,
+]
+
+OPEN, HIGH, LOW, CLOSE, VOLUME, LIQUIDITY = range(6)
+
+# Scale marking a NULL value
+_NULL = (0.0, -1)
+_QUANTUMS = [Decimal(1).scaleb(-scale) for scale in range(128)]
+
+
+def _to_micros(value):
+    return (value - _EPOCH) // timedelta(microseconds=1)
+
+
+def _from_micros(micros):
+    return _EPOCH + timedelta(microseconds=micros)
+
+
+def _to_decimal(value, scale):
+    return Decimal(repr(value)).quantize(_QUANTUMS[scale])
+
+
+def _numeric_text(value, scale):
+    """
+    NUMERIC text for a stored (float, scale) pair, as Postgres would print it.
+    """
+    if scale < 0:
+        return None
+    with localcontext() as ctx:
+        ctx.prec = 60
+        return format(_to_decimal(value, scale), 'f')
+
+
+def _encode_numeric(text):
+    """
+    (float, scale) for a NUMERIC text value, or None when a float cannot
+    reproduce the text exactly (too many digits, NaN).
+    """
+    if text is None:
+        return _NULL
+    scale = len(text) - text.index('.') - 1 if '.' in text else 0
+    try:
+        value = float(text)
+        if scale >= len(_QUANTUMS) or _numeric_text(value, scale) != text:
+            return None
+    except (ValueError, InvalidOperation):
+        return None
+    return value, scale
+
+
+class _Times:
+    # Sequence view of a series' timestamps in logical order, for bisect
+    def __init__(self, series):
+        self.series = series
+
+    def __len__(self):
+        return self.series.count
+
+    def __getitem__(self, i):
+        return self.series.times[self.series.slot(i)]
+
+
+class _Series:
+    def __init__(self, capacity, covered_from, network_id):
+        """
+        Fixed-size ring of candles for one (exchange, symbol, network_id), in
+        timestamp order. Every ohlcv_data row at or after covered_from (epoch
+        microseconds) is held; evicting the oldest candle moves it forward.
+        """
+        self.capacity = capacity
+        self.start = 0
+        self.count = 0
+        self.covered_from = covered_from
+        self.network_id = network_id
+        # False once a value is seen that the float/scale arrays cannot reproduce
+        self.exact = True
+        self.times = array('q', bytes(8 * capacity))
+        self.values = [array('d', bytes(8 * capacity)) for _ in range(6)]
+        self.scales = [array('b', bytes(capacity)) for _ in range(6)]
+        self.view = _Times(self)
+
+    def slot(self, i):
+        return (self.start + i) % self.capacity
+
+    def _write(self, i, micros, row):
+        slot = self.slot(i)
+        self.times[slot] = micros
+        for column, (value, scale) in enumerate(row):
+            self.values[column][slot] = value
+            self.scales[column][slot] = scale
+
+    def _read(self, i):
+        slot = self.slot(i)
+        return [(self.values[column][slot], self.scales[column][slot]) for column in range(6)]
+
+    def _evict(self):
+        self.covered_from = self.view[0] + 1
+        self.start = (self.start + 1) % self.capacity
+        self.count -= 1
+
+    def put(self, micros, row):
+        if micros < self.covered_from:
+            return
+        if self.count == 0 or micros > self.view[self.count - 1]:
+            if self.count == self.capacity:
+                self._evict()
+            self.count += 1
+            self._write(self.count - 1, micros, row)
+            return
+
+        i = bisect_left(self.view, micros)
+        if self.view[i] == micros:
+            self._write(i, micros, row)
+            return
+        # Late row between held candles: shift the newer ones up by one
+        if self.count == self.capacity:
+            if i == 0:
+                # Older than everything a full buffer holds; stop claiming to cover it
+                self.covered_from = micros + 1
+                return
+            self._evict()
+            i -= 1
+        self.count += 1
+        for j in range(self.count - 1, i, -1):
+            self._write(j, self.view[j - 1], self._read(j - 1))
+        self._write(i, micros, row)
+
+    def text(self, column, i):
+        slot = self.slot(i)
+        return _numeric_text(self.values[column][slot], self.scales[column][slot])
+
+    def buckets(self, exchange, symbol, start, end, k):
+        """
+        Rows of ohlcv_bucket_query for this series over [start, end] (epoch
+        microseconds), with the same bucket boundaries.
+        """
+        span = end - start
+        lo = bisect_left(self.view, start)
+        hi = bisect_right(self.view, end)
+        rows = []
+        i = lo
+        with localcontext() as ctx:
+            ctx.prec = 60
+            while i < hi:
+                bucket = self._bucket(self.view[i] - start, span, k)
+                first = high = low = i
+                volume = Decimal(0)
+                while i < hi and self._bucket(self.view[i] - start, span, k) == bucket:
+                    slot = self.slot(i)
+                    if self.values[HIGH][slot] > self.values[HIGH][self.slot(high)]:
+                        high = i
+                    if self.values[LOW][slot] < self.values[LOW][self.slot(low)]:
+                        low = i
+                    volume += _to_decimal(self.values[VOLUME][slot], self.scales[VOLUME][slot])
+                    i += 1
+                last = i - 1
+                rows.append((
+                    exchange, symbol, _from_micros(self.view[first]),
+                    self.text(OPEN, first), self.text(HIGH, high), self.text(LOW, low),
+                    self.text(CLOSE, last), format(volume, 'f'), self.text(LIQUIDITY, last),
+                    self.network_id,
+                ))
+        return rows
+
+    @staticmethod
+    def _bucket(delta, span, k):
+        # queries.BUCKET_EXPRESSION, in the same integer microseconds
+        return min(delta * k // max(span, k * 1000000), k - 1)
+
+
+class HotWindowCache:
+    def __init__(self, capacity=1440, max_series=500, tail_batch=10000, recent_seconds=300):
+        """
+        In-memory copy of the newest ohlcv_data candles, one ring buffer per
+        (exchange, symbol, network_id), used to answer bucketed /api/ohlcv windows
+        without a query. Filled by refresh()/arefresh(), which warm it once and
+        then tail new rows by id.
+        :param capacity: Candles kept per series (1440 = one day of 1m candles)
+        :param max_series: Upper bound on series held; windows on further pairs go to Postgres
+        :param tail_batch: Rows fetched per tail query
+        :param recent_seconds: Newest span re-read on every refresh to pick up upserted candles
+        """
+        self.capacity = capacity
+        self.max_series = max_series
+        self.tail_batch = tail_batch
+        self.recent_seconds = recent_seconds
+
+        self.ready = False
+        self.last_id = 0
+        self._covered_from = None
+        self._latest = None
+        self._series = {}
+        self._by_pair = {}
+        self._overflow = set()
+        self._lock = threading.Lock()
+
+        self._hits = 0
+        self._misses = 0
+
+    def warm(self, rows, last_id, since):
+        with self._lock:
+            self._series.clear()
+            self._by_pair.clear()
+            self._overflow.clear()
+            self._covered_from = _to_micros(since)
+            self.last_id = last_id or 0
+            self._apply(rows)
+            self.ready = True
+
+    def apply(self, rows):
+        with self._lock:
+            self._apply(rows)
+
+    def _apply(self, rows):
+        for row_id, exchange, symbol, timestamp, *numbers, network_id in rows:
+            if row_id > self.last_id:
+                self.last_id = row_id
+            micros = _to_micros(timestamp)
+            if micros < self._covered_from:
+                continue
+            if self._latest is None or micros > self._latest:
+                self._latest = micros
+
+            key = (exchange, symbol, network_id)
+            series = self._series.get(key)
+            if series is None:
+                if len(self._series) >= self.max_series:
+                    self._overflow.add((exchange, symbol))
+                    continue
+                series = self._series[key] = _Series(self.capacity, self._covered_from, network_id)
+                self._by_pair.setdefault((exchange, symbol), []).append(series)
+
+            encoded = [_encode_numeric(value) for value in numbers]
+            if None in encoded:
+                series.exact = False
+                continue
+            series.put(micros, encoded)
+
+    def refresh(self, fetch):
+        """
+        Warm the cache, or pull rows added since the last refresh.
+        :param fetch: fetch(query, params) -> list of row tuples, NUMERIC as text
+        """
+        if not self.ready:
+            last_id, latest = fetch(BOUNDS_QUERY, None)[0]
+            if latest is not None:
+                since = latest - timedelta(minutes=self.capacity)
+                self.warm(fetch(WARM_QUERY, {"since": since}), last_id, since)
+            return
+        while True:
+            rows = fetch(TAIL_QUERY, {"last_id": self.last_id, "limit": self.tail_batch})
+            self.apply(rows)
+            if len(rows) < self.tail_batch:
+                break
+        self.apply(fetch(RECENT_QUERY, {"since": self._recent_since()}))
+
+    async def arefresh(self, fetch):
+        """
+        refresh() for a coroutine fetch(query, params).
+        """
+        if not self.ready:
+            last_id, latest = (await fetch(BOUNDS_QUERY, None))[0]
+            if latest is not None:
+                since = latest - timedelta(minutes=self.capacity)
+                self.warm(await fetch(WARM_QUERY, {"since": since}), last_id, since)
+            return
+        while True:
+            rows = await fetch(TAIL_QUERY, {"last_id": self.last_id, "limit": self.tail_batch})
+            self.apply(rows)
+            if len(rows) < self.tail_batch:
+                break
+        self.apply(await fetch(RECENT_QUERY, {"since": self._recent_since()}))
+
+    def _recent_since(self):
+        with self._lock:
+            latest = self._latest if self._latest is not None else self._covered_from
+        return _from_micros(latest) - timedelta(seconds=self.recent_seconds)
+
+    def window(self, exchanges, symbol, start_time, end_time, k):
+        """
+        The ohlcv_bucket_query("ohlcv_data") result for this window as a RowSet,
+        or None when part of the window is not held in memory.
+        """
+        try:
+            start = datetime.fromisoformat(start_time)
+            end = datetime.fromisoformat(end_time)
+        except (TypeError, ValueError):
+            return None
+        if start.tzinfo is not None or end.tzinfo is not None:
+            return None
+        start, end = _to_micros(start), _to_micros(end)
+
+        rows = []
+        with self._lock:
+            if not self.ready or start < self._covered_from:
+                self._misses += 1
+                return None
+            for exchange in sorted(set(exchanges)):
+                series = self._by_pair.get((exchange, symbol), [])
+                if (exchange, symbol) in self._overflow or len(series) > 1:
+                    self._misses += 1
+                    return None
+                if not series:
+                    continue
+                if not series[0].exact or start < series[0].covered_from:
+                    self._misses += 1
+                    return None
+                rows.extend(series[0].buckets(exchange, symbol, start, end, k))
+            self._hits += 1
+        return RowSet(BUCKET_COLUMNS, BUCKET_TYPES, rows)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "series": len(self._series),
+                "candles": sum(series.count for series in self._series.values()),
+                "capacity": self.capacity,
+                "overflow_pairs": len(self._overflow),
+                "inexact_series": sum(not series.exact for series in self._series.values()),
+                "last_id": self.last_id,
+                "hits": self._hits,
+                "misses": self._misses,
+            }
@@ -0,0 +1,283 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+import asyncio
+import json
+import queue
+import threading
+import time
+
+try:
+    import boto3
+except ImportError:
+    boto3 = None
+
+from serialization import dumps, http_date
+
+
+def numeric_text(value):
+    """
+    The text Postgres returns for a number the consumer stored in a NUMERIC
+    column: psycopg2 sends a float as its repr, which NUMERIC keeps digit for
+    digit, so 1e-05 reads back as "0.00001".
+    """
+    if value is None:
+        return None
+    return format(Decimal(repr(value) if isinstance(value, float) else str(value)), 'f')
+
+
+def candle_from_record(data):
+    """
+    Turn an ohlcvProducer Kinesis record into a row shaped like the /api/ohlcv
+    rows (keys in sorted order, NUMERIC columns as text, HTTP-date timestamp),
+    or None if it is not a candle.
+    """
+    candle = data.get('0') if isinstance(data, dict) else None
+    if not candle or 'exchange' not in data or 'symbol' not in data:
+        return None
+    return {
+        "close_price": numeric_text(candle[4]),
+        "exchange": data['exchange'],
+        "high_price": numeric_text(candle[2]),
+        "liquidity": numeric_text(candle[6]) if len(candle) > 6 else None,
+        "low_price": numeric_text(candle[3]),
+        "network_id": data.get('network_id'),
+        "open_price": numeric_text(candle[1]),
+        "symbol": data['symbol'],
+        "timestamp": http_date(datetime.fromtimestamp(candle[0] / 1000, timezone.utc)),
+        "volume": numeric_text(candle[5]),
+    }
+
+
+def sse_event(event, payload):
+    """
+    Frame a payload as one Server-Sent Events message.
+    """
+    return b"event: " + event.encode() + b"\ndata: " + dumps(payload).rstrip(b"\n") + b"\n\n"
+
+
+SSE_HEARTBEAT = b": keep-alive\n\n"
+
+# Seconds between stream describes that pick up shards from a reshard
+SHARD_REFRESH_SECONDS = 60
+
+
+class Subscription:
+    def __init__(self, feed, symbols, exchanges, maxsize, loop=None):
+        """
+        One client's view of the feed: the candles matching its symbols (and
+        exchanges, if given) in a bounded queue. When the queue is full the
+        client is dropped rather than holding up the feed.
+        :param loop: Event loop of an async client; thread-based clients leave it None
+        """
+        self.feed = feed
+        self.symbols = frozenset(symbols)
+        self.exchanges = frozenset(exchanges) if exchanges else None
+        self.dropped = False
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize) if loop is not None else queue.Queue(maxsize)
+
+    def matches(self, candle):
+        return candle["symbol"] in self.symbols and (self.exchanges is None or candle["exchange"] in self.exchanges)
+
+    def offer(self, candle):
+        """
+        Called from the feed thread; never blocks.
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._put, candle)
+        else:
+            self._put(candle)
+
+    def _put(self, candle):
+        if self.dropped:
+            return
+        try:
+            self._queue.put_nowait(candle)
+        except (queue.Full, asyncio.QueueFull):
+            self.dropped = True
+            self.feed.unsubscribe(self, dropped=True)
+
+    def events(self, heartbeat):
+        """
+        SSE chunks for a thread-based (WSGI) client; a keep-alive comment is sent
+        every heartbeat seconds so proxies keep the connection and disconnects are noticed.
+        """
+        while not self.dropped:
+            try:
+                candle = self._queue.get(timeout=heartbeat)
+            except queue.Empty:
+                yield SSE_HEARTBEAT
+                continue
+            yield sse_event("candle", candle)
+        yield sse_event("dropped", {"error": "Client fell behind the live feed"})
+
+    async def aevents(self, heartbeat):
+        """
+        Same as events() for a client on the subscription's event loop.
+        """
+        while not self.dropped:
+            try:
+                candle = await asyncio.wait_for(self._queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield SSE_HEARTBEAT
+                continue
+            yield sse_event("candle", candle)
+        yield sse_event("dropped", {"error": "Client fell behind the live feed"})
+
+
+class LiveFeed:
+    def __init__(self, stream_name, region, partition_key='ohlcv', queue_size=256, poll_interval=1.0):
+        """
+        Tails the Kinesis stream OHLCVDataConsumer reads and fans new candles out
+        to subscribed clients. The tailing thread starts with the first subscriber.
+        :param partition_key: Only records with this partition key are forwarded
+        :param queue_size: Candles buffered per client before it is dropped
+        :param poll_interval: Seconds between GetRecords calls per shard
+        """
+        self.stream_name = stream_name
+        self.region = region
+        self.partition_key = partition_key
+        self.queue_size = queue_size
+        self.poll_interval = poll_interval
+
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self._records = 0
+        self._delivered = 0
+        self._dropped = 0
+        self._errors = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def subscribe(self, symbols, exchanges=None, loop=None):
+        self.start()
+        subscription = Subscription(self, symbols, exchanges, self.queue_size, loop)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription, dropped=False):
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.discard(subscription)
+                if dropped:
+                    self._dropped += 1
+
+    def publish(self, candle):
+        """
+        Hand a candle to every matching subscriber without blocking on any of them.
+        """
+        with self._lock:
+            targets = [s for s in self._subscribers if s.matches(candle)]
+            self._delivered += len(targets)
+        for subscription in targets:
+            subscription.offer(candle)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            if boto3 is None:
+                raise RuntimeError("boto3 is required for the live feed")
+            self._thread = threading.Thread(target=self._run, name="live-feed", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        client = boto3.client('kinesis', region_name=self.region)
+        iterators = {}
+        seen = set()
+        refresh_at = 0
+        while True:
+            try:
+                if time.monotonic() >= refresh_at:
+                    self._refresh_shards(client, iterators, seen)
+                    refresh_at = time.monotonic() + SHARD_REFRESH_SECONDS
+                if self._read_shards(client, iterators):
+                    # A shard closed after a reshard: its children can be read now
+                    refresh_at = 0
+                time.sleep(self.poll_interval)
+            except Exception as error:
+                print(f'Error tailing {self.stream_name}: {error}')
+                self._errors += 1
+                # Expired iterators are re-fetched from LATEST
+                iterators = {}
+                seen = set()
+                refresh_at = 0
+                time.sleep(5)
+
+    def _list_shards(self, client):
+        shards = []
+        kwargs = {}
+        while True:
+            description = client.describe_stream(StreamName=self.stream_name, **kwargs)['StreamDescription']
+            shards.extend(description['Shards'])
+            if not description.get('HasMoreShards') or not description['Shards']:
+                return shards
+            kwargs = {'ExclusiveStartShardId': description['Shards'][-1]['ShardId']}
+
+    def _refresh_shards(self, client, iterators, seen):
+        """
+        Open an iterator for every shard not read yet. On the first describe the
+        open shards start at LATEST: clients load history from the REST endpoints.
+        Shards that appear later come from a reshard and start at TRIM_HORIZON once
+        their parents are drained, so no candle written to them is skipped and each
+        key is still read in order.
+        """
+        first = not seen
+        for shard in self._list_shards(client):
+            shard_id = shard['ShardId']
+            if shard_id in seen:
+                continue
+            if first:
+                seen.add(shard_id)
+                if 'EndingSequenceNumber' in shard['SequenceNumberRange']:
+                    continue
+                iterator_type = 'LATEST'
+            else:
+                parents = {shard.get('ParentShardId'), shard.get('AdjacentParentShardId')}
+                if parents & iterators.keys():
+                    continue
+                seen.add(shard_id)
+                iterator_type = 'TRIM_HORIZON'
+            iterators[shard_id] = client.get_shard_iterator(
+                StreamName=self.stream_name,
+                ShardId=shard_id,
+                ShardIteratorType=iterator_type
+            )['ShardIterator']
+
+    def _read_shards(self, client, iterators):
+        """
+        One GetRecords call per shard, publishing the candles. Returns True when a
+        shard was drained and closed.
+        """
+        closed = False
+        for shard_id, iterator in list(iterators.items()):
+            response = client.get_records(ShardIterator=iterator, Limit=1000)
+            if response.get('NextShardIterator'):
+                iterators[shard_id] = response['NextShardIterator']
+            else:
+                del iterators[shard_id]
+                closed = True
+            for record in response['Records']:
+                if self.partition_key and record['PartitionKey'] != self.partition_key:
+                    continue
+                self._records += 1
+                candle = candle_from_record(json.loads(record['Data'].decode()))
+                if candle is not None:
+                    self.publish(candle)
+        return closed
+
+    def stats(self):
+        with self._lock:
+            return {
+                "clients": len(self._subscribers),
+                "running": self._thread is not None,
+                "records": self._records,
+                "delivered": self._delivered,
+                "dropped_clients": self._dropped,
+                "errors": self._errors,
+            }
@@ -0,0 +1,185 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+import threading
+import time
+
+# Prometheus text exposition format
+METRICS_MIMETYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+ROW_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    def __init__(self, name, help, label_names, buckets):
+        """
+        Cumulative Prometheus histogram, one series per label value tuple.
+        """
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        # Non-cumulative bucket counts; the last slot is +Inf
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        for labels, counts, total, count in sorted(snapshot):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = 'le="' + str(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+REQUEST_DURATION = Histogram(
+    "api_request_duration_seconds", "Time from request start to response, per endpoint and status.",
+    ("endpoint", "status"), LATENCY_BUCKETS
+)
+PHASE_DURATION = Histogram(
+    "api_phase_duration_seconds",
+    "Time per request spent in each phase (decode, acquire, estimate, execute, fetch, sample, serialize).",
+    ("endpoint", "phase"), LATENCY_BUCKETS
+)
+RESPONSE_SIZE = Histogram(
+    "api_response_size_bytes", "Response body size per endpoint.", ("endpoint",), SIZE_BUCKETS
+)
+ROWS_RETURNED = Histogram(
+    "api_rows", "Rows read from Postgres or the hot cache per request.", ("endpoint",), ROW_BUCKETS
+)
+HISTOGRAMS = (REQUEST_DURATION, PHASE_DURATION, RESPONSE_SIZE, ROWS_RETURNED)
+
+
+class RequestTimer:
+    __slots__ = ("start", "phases", "rows")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.rows = None
+
+
+# Timer of the request being handled; works per thread (Flask) and per task (ASGI)
+_current = ContextVar("request_timer", default=None)
+
+
+def start_request():
+    timer = RequestTimer()
+    _current.set(timer)
+    return timer
+
+
+def finish_request(timer, endpoint, status, size=None):
+    """
+    Record a finished request. size is None for streamed bodies of unknown length.
+    """
+    endpoint = endpoint or "unmatched"
+    REQUEST_DURATION.observe((endpoint, str(status)), time.perf_counter() - timer.start)
+    for name, seconds in timer.phases.items():
+        PHASE_DURATION.observe((endpoint, name), seconds)
+    if size is not None:
+        RESPONSE_SIZE.observe((endpoint,), size)
+    if timer.rows is not None:
+        ROWS_RETURNED.observe((endpoint,), timer.rows)
+
+
+@contextmanager
+def phase(name):
+    """
+    Add the time spent in the block to the current request's phase total; a
+    no-op outside a request (e.g. background refreshers).
+    """
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.phases[name] = timer.phases.get(name, 0.0) + time.perf_counter() - start
+
+
+def record_rows(count):
+    timer = _current.get()
+    if timer is not None:
+        timer.rows = (timer.rows or 0) + count
+
+
+def render(stats=None):
+    """
+    All histograms in Prometheus text format, plus the numeric values of
+    stats ({group: {name: value}}, as served by /api/stats) as gauges.
+    """
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    for group, values in (stats or {}).items():
+        for name, value in (values or {}).items():
+            if isinstance(value, bool):
+                value = int(value)
+            if isinstance(value, (int, float)):
+                metric = f"api_{group}_{name}"
+                lines.append(f"# TYPE {metric} gauge")
+                lines.append(f"{metric} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class ASGIMetricsMiddleware:
+    def __init__(self, app):
+        """
+        ASGI counterpart of app.py's before/after_request hooks. The endpoint
+        label is the name of the route function the router matched.
+        """
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        timer = start_request()
+        status = 500
+        size = 0
+
+        async def send_and_measure(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_measure)
+        finally:
+            endpoint = scope.get("endpoint")
+            finish_request(timer, getattr(endpoint, "__name__", None), status, size)
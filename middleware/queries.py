@@ -0,0 +1,237 @@
+from datetime import datetime
+
+# (table, seconds per candle) from finest to coarsest; the rollups are maintained
+# by liquidity_scripts/ohlcv_rollup.py
+OHLCV_RESOLUTIONS = [
+    ("ohlcv_data", 60),
+    ("ohlcv_data_5m", 300),
+    ("ohlcv_data_1h", 3600),
+    ("ohlcv_data_1d", 86400),
+]
+
+# Bucket index of t.timestamp when [start, end] is split into k equal-width buckets
+# (at least one second wide). The row at exactly end_time is folded into the last bucket.
+# Computed in whole microseconds, FLOOR(delta * k / GREATEST(span, k seconds)), so a row
+# on a bucket boundary lands in the same bucket on every Postgres version (EXTRACT
+# returns float before 14) and in middleware/hot_cache.py.
+BUCKET_EXPRESSION = """
+    LEAST(
+        (EXTRACT(EPOCH FROM (t.timestamp - %(start)s)) * 1000000)::bigint * %(k)s
+        / GREATEST(
+            (EXTRACT(EPOCH FROM (%(end)s::timestamp - %(start)s::timestamp)) * 1000000)::bigint,
+            %(k)s * 1000000::bigint
+        ),
+        %(k)s - 1
+    )
+"""
+
+
+def downsample_query(table, filters, tiebreak=None):
+    """
+    Build a query that returns at most k rows of a time series table, so only
+    the sampled rows leave Postgres instead of the whole window.
+    The requested [start, end] window is split into k equal-width buckets and the
+    latest row of each non-empty bucket is kept, which always keeps the last point.
+    Bucket boundaries depend only on start, end and k, so repeated requests agree.
+    :param table: Table with a timestamp column
+    :param filters: Extra SQL conditions (named placeholders) ANDed onto the window filter
+    :param tiebreak: Column used to order rows sharing a timestamp (e.g. "id")
+    Named parameters: start, end, k, plus whatever filters reference.
+    """
+    tiebreak_order = f", t.{tiebreak} DESC" if tiebreak else ""
+    filter_clause = f"AND {filters}" if filters else ""
+    return f"""
+        SELECT (s.t).*
+        FROM (
+            SELECT DISTINCT ON (b.bucket) t
+            FROM {table} t
+            CROSS JOIN LATERAL (SELECT {BUCKET_EXPRESSION} AS bucket) b
+            WHERE t.timestamp BETWEEN %(start)s AND %(end)s
+            {filter_clause}
+            ORDER BY b.bucket, t.timestamp DESC{tiebreak_order}
+        ) s
+        ORDER BY (s.t).timestamp ASC;
+    """
+
+
+def ohlcv_bucket_query(table="ohlcv_data"):
+    """
+    Build a query that aggregates candles into k equal-width time buckets per
+    exchange in a single grouped pass: first open, max high, min low, last close
+    and summed volume, so highs, lows and volume between points are not lost.
+    Each bucket is stamped with the timestamp of its first candle.
+    Named parameters: exchanges (list), symbol, start, end, k.
+    """
+    return f"""
+        SELECT t.exchange,
+               t.symbol,
+               MIN(t.timestamp) AS timestamp,
+               (ARRAY_AGG(t.open_price ORDER BY t.timestamp ASC))[1] AS open_price,
+               MAX(t.high_price) AS high_price,
+               MIN(t.low_price) AS low_price,
+               (ARRAY_AGG(t.close_price ORDER BY t.timestamp DESC))[1] AS close_price,
+               SUM(t.volume) AS volume,
+               (ARRAY_AGG(t.liquidity ORDER BY t.timestamp DESC))[1] AS liquidity,
+               MAX(t.network_id) AS network_id
+        FROM {table} t
+        CROSS JOIN LATERAL (SELECT {BUCKET_EXPRESSION} AS bucket) b
+        WHERE t.exchange = ANY(%(exchanges)s)
+            AND t.symbol = %(symbol)s
+            AND t.timestamp BETWEEN %(start)s AND %(end)s
+        GROUP BY t.exchange, t.symbol, b.bucket
+        ORDER BY t.exchange, MIN(t.timestamp);
+    """
+
+
+def pick_ohlcv_table(start_time, end_time, k):
+    """
+    Pick the coarsest OHLCV resolution that still yields at least k candles over
+    the requested range, so query cost stays flat as the window grows.
+    Falls back to raw 1-minute data when the range cannot be parsed.
+    """
+    try:
+        span = (datetime.fromisoformat(end_time) - datetime.fromisoformat(start_time)).total_seconds()
+    except (TypeError, ValueError):
+        return OHLCV_RESOLUTIONS[0][0]
+    for table, seconds in reversed(OHLCV_RESOLUTIONS):
+        if span / seconds >= k:
+            return table
+    return OHLCV_RESOLUTIONS[0][0]
+
+
+# Window builders shared by the Flask app and the ASGI app. Each returns
+# (query, params) with named placeholders only.
+
+OHLCV_POINTS = 1000 # k determines the granularity of the data points returned per exchange
+DEX_POINTS = 50
+DYNAMIC_PAIRS_POINTS = 50
+TOKEN_HISTORY_POINTS = 50
+
+
+def ohlcv_window(exchanges, symbol, start, end, mode, use_rollups=True):
+    """
+    /api/ohlcv: bucketed candles per exchange, or every Nth raw row with mode "sample".
+    """
+    params = {"exchanges": exchanges, "symbol": symbol, "start": start, "end": end, "k": OHLCV_POINTS}
+    if mode == 'bucket':
+        table = pick_ohlcv_table(start, end, OHLCV_POINTS) if use_rollups else OHLCV_RESOLUTIONS[0][0]
+        return ohlcv_bucket_query(table), params
+    query = """
+        WITH exchange_data AS (
+                SELECT *,
+                       ROW_NUMBER() OVER (PARTITION BY exchange ORDER BY timestamp) AS row_num,
+                       COUNT(*) OVER (PARTITION BY exchange) AS total_rows
+                FROM ohlcv_data
+                WHERE exchange = ANY(%(exchanges)s) AND symbol = %(symbol)s AND timestamp BETWEEN %(start)s AND %(end)s
+            )
+            SELECT *
+            FROM exchange_data
+            WHERE MOD(row_num, GREATEST(total_rows / %(k)s, 1)) = 0 OR row_num = total_rows;
+    """
+    return query, params
+
+
+def ohlcv_window_candidates(exchanges, symbol, start, end, mode, use_rollups=True):
+    """
+    ohlcv_window followed by the same bucket query on each coarser rollup, for
+    the cost guard to fall back on when a range is too large for the first.
+    """
+    first = ohlcv_window(exchanges, symbol, start, end, mode, use_rollups)
+    if mode != 'bucket' or not use_rollups:
+        return [first]
+    tables = [table for table, _ in OHLCV_RESOLUTIONS]
+    coarser = tables[tables.index(pick_ohlcv_table(start, end, OHLCV_POINTS)) + 1:]
+    return [first] + [(ohlcv_bucket_query(table), first[1]) for table in coarser]
+
+
+def ohlcv_dex_window(symbol, start, end, network_id):
+    """
+    /api/ohlcv/dex: DEX candles for a symbol, optionally on one network.
+    """
+    network_id_query = "AND t.network_id = %(network_id)s" if network_id else ""
+    query = downsample_query(
+        "ohlcv_data",
+        f"t.symbol = %(symbol)s AND t.network_id IS NOT NULL {network_id_query}",
+        tiebreak="id"
+    )
+    return query, {"symbol": symbol, "start": start, "end": end, "k": DEX_POINTS, "network_id": network_id}
+
+
+def pair_key(token1, token2):
+    """
+    Order-independent key of a token pair, as stored in dynamic_pairs.pair_key by
+    liquidity_scripts/insertdyn.py.
+    """
+    return "|".join(sorted([token1, token2]))
+
+
+def dynamic_pairs_window(token1, token2, start, end):
+    """
+    /api/dynamic_pairs: pairs where either token can be in either position, one
+    (pair_key, timestamp) index range scan.
+    """
+    query = downsample_query("dynamic_pairs", "t.pair_key = %(pair_key)s")
+    return query, {"pair_key": pair_key(token1, token2), "start": start, "end": end, "k": DYNAMIC_PAIRS_POINTS}
+
+
+def token_history_window(token, start, end, network_id):
+    """
+    /api/token_history: one token's history, optionally on one network.
+    """
+    network_id_query = "AND t.network_id = %(network_id)s" if network_id else ""
+    query = downsample_query(
+        "dynamic_tokens",
+        f"t.symbol = %(token)s AND t.network_id IS NOT NULL {network_id_query}"
+    )
+    return query, {"token": token, "start": start, "end": end, "k": TOKEN_HISTORY_POINTS, "network_id": network_id}
+
+
+WINDOW_BUILDERS = {
+    'ohlcv_dex': ohlcv_dex_window,
+    'dynamic_pairs': dynamic_pairs_window,
+    'token_history': token_history_window,
+}
+
+
+def window_candidates(route, args, use_rollups=True):
+    """
+    (query, params) candidates for a window route, finest data first, for
+    CostGuard.choose. args are the route's window builder arguments.
+    """
+    if route == 'ohlcv':
+        return ohlcv_window_candidates(*args, use_rollups)
+    return [WINDOW_BUILDERS[route](*args)]
+
+
+STATIC_TOKEN_BY_SYMBOL = """
+    SELECT *
+    FROM static_tokens
+    WHERE symbol = %(symbol)s
+    LIMIT 1;
+"""
+
+OHLCV_FIRST_PAGE = "SELECT * FROM ohlcv_data ORDER BY timestamp, id LIMIT %(limit)s;"
+
+OHLCV_NEXT_PAGE = """
+    SELECT * FROM ohlcv_data
+    WHERE (timestamp, id) > (%(timestamp)s, %(id)s)
+    ORDER BY timestamp, id
+    LIMIT %(limit)s;
+"""
+
+# Loose index scan: one probe of the (exchange) WHERE network_id IS NULL index per
+# distinct exchange instead of a DISTINCT over every CEX row
+CEX_EXCHANGE_NAMES = """
+    WITH RECURSIVE cex AS (
+        (SELECT exchange FROM ohlcv_data WHERE network_id IS NULL ORDER BY exchange LIMIT 1)
+        UNION ALL
+        SELECT (
+            SELECT o.exchange FROM ohlcv_data o
+            WHERE o.network_id IS NULL AND o.exchange > cex.exchange
+            ORDER BY o.exchange LIMIT 1
+        )
+        FROM cex
+        WHERE cex.exchange IS NOT NULL
+    )
+    SELECT exchange FROM cex WHERE exchange IS NOT NULL AND exchange NOT ILIKE 'uni%';
+"""
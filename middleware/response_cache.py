@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+def next_minute_boundary(now=None, grace_seconds=0):
+    """
+    Epoch seconds of the next minute boundary plus a grace period, i.e. shortly
+    after the producer's next candle is expected to land.
+    """
+    now = time.time() if now is None else now
+    return (int(now // 60) + 1) * 60 + grace_seconds
+
+
+class ResponseCache:
+    def __init__(self, max_bytes):
+        """
+        In-process LRU cache of serialized responses, bounded by total body size.
+        Each entry carries its own absolute expiry time.
+        :param max_bytes: Upper bound on cached body bytes; 0 disables the cache
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def get(self, key):
+        """
+        Return the cached (body, status) for key, or None on a miss.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                self._drop(key)
+                self._expirations += 1
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[1], entry[2]
+
+    def set(self, key, body, status, expires_at):
+        size = len(body)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (expires_at, body, status)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self._evictions += 1
+
+    def _drop(self, key):
+        _, body, _ = self._entries.pop(key)
+        self._bytes -= len(body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": round(self._hits / lookups, 4) if lookups else 0.0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+            }
@@ -0,0 +1,219 @@
+from datetime import date, datetime, timezone
+import json
+import re
+import time
+
+from psycopg2.extensions import new_type, register_type
+
+from metrics import phase, record_rows
+from slow_queries import observe_query
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+NUMERIC_OID = 1700
+DATE_OID = 1082
+TIMESTAMP_OID = 1114
+TIMESTAMPTZ_OID = 1184
+
+# NUMERIC values are kept as the text Postgres sends, which is what the JSON output
+# carries anyway, instead of building a Decimal per value
+NUMERIC_AS_TEXT = new_type((NUMERIC_OID,), 'NUMERIC_AS_TEXT', lambda value, cur: value)
+
+JSON_MIMETYPE = "application/json"
+MSGPACK_MIMETYPE = "application/msgpack"
+
+_EPOCH = datetime(1970, 1, 1)
+_WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+_MONTHS = (None, "Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+
+def http_date(value):
+    """
+    Format a date/datetime the way Flask's JSON provider does
+    (e.g. "Mon, 16 Dec 2024 12:30:10 GMT"), without going through email.utils.
+    """
+    if value is None:
+        return None
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    elif value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return (
+        f"{_WEEKDAYS[value.weekday()]}, {value.day:02d} {_MONTHS[value.month]} {value.year:04d} "
+        f"{value.hour:02d}:{value.minute:02d}:{value.second:02d} GMT"
+    )
+
+
+def epoch_ms(value):
+    """
+    Milliseconds since the Unix epoch; naive timestamps are taken as UTC.
+    """
+    if value is None:
+        return None
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    if value.tzinfo is not None:
+        return int(value.timestamp() * 1000)
+    return int((value - _EPOCH).total_seconds() * 1000)
+
+
+def to_float(value):
+    return None if value is None else float(value)
+
+
+# Per-type converters applied a column at a time when building JSON records
+_RECORD_CONVERTERS = {
+    DATE_OID: http_date,
+    TIMESTAMP_OID: http_date,
+    TIMESTAMPTZ_OID: http_date,
+}
+
+
+# Per-type converters for the columnar and binary formats, which carry plain numbers
+_NATIVE_CONVERTERS = {
+    NUMERIC_OID: to_float,
+    DATE_OID: epoch_ms,
+    TIMESTAMP_OID: epoch_ms,
+    TIMESTAMPTZ_OID: epoch_ms,
+}
+
+
+class RowSet:
+    def __init__(self, columns, type_codes, rows):
+        """
+        Query result kept as plain tuples plus column metadata, so rows are only
+        turned into records (or columns) once, at serialization time.
+        """
+        self.columns = columns
+        self.type_codes = type_codes
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def records(self):
+        """
+        Rows as dicts with keys in sorted order and values converted column by
+        column, matching the shape jsonify produced for RealDictCursor rows.
+        """
+        if not self.rows:
+            return []
+        order = sorted(range(len(self.columns)), key=lambda i: self.columns[i])
+        names = [self.columns[i] for i in order]
+        columns = list(zip(*self.rows))
+        converted = []
+        for i in order:
+            converter = _RECORD_CONVERTERS.get(self.type_codes[i])
+            converted.append(list(map(converter, columns[i])) if converter else columns[i])
+        return [dict(zip(names, values)) for values in zip(*converted)]
+
+    def native_columns(self):
+        """
+        One list per column, with NUMERIC as floats and timestamps as epoch
+        milliseconds, built straight from the row tuples.
+        """
+        columns = list(zip(*self.rows)) if self.rows else [()] * len(self.columns)
+        result = {}
+        for name, type_code, values in zip(self.columns, self.type_codes, columns):
+            converter = _NATIVE_CONVERTERS.get(type_code)
+            result[name] = list(map(converter, values)) if converter else list(values)
+        return result
+
+
+def execute_rowset(conn, query, params=None, timeout_ms=None):
+    """
+    Execute a query on a plain tuple cursor and return its result as a RowSet.
+    :param timeout_ms: statement_timeout for the rest of the connection's transaction
+    """
+    with conn.cursor() as cur:
+        register_type(NUMERIC_AS_TEXT, cur)
+        if timeout_ms:
+            cur.execute("SET LOCAL statement_timeout = %s;", (timeout_ms,))
+        start = time.perf_counter()
+        with phase("execute"):
+            cur.execute(query, params)
+        with phase("fetch"):
+            rows = cur.fetchall()
+        observe_query(query, params, len(rows), time.perf_counter() - start)
+        record_rows(len(rows))
+        return RowSet([d.name for d in cur.description], [d.type_code for d in cur.description], rows)
+
+
+def _default(value):
+    if isinstance(value, RowSet):
+        return value.records()
+    if isinstance(value, (datetime, date)):
+        return http_date(value)
+    return str(value)
+
+
+_NON_ASCII = re.compile("[^\x00-\x7f]")
+
+
+def _escape_char(match):
+    code = ord(match.group())
+    if code > 0xFFFF:
+        code -= 0x10000
+        return "\\u%04x\\u%04x" % (0xD800 | (code >> 10), 0xDC00 | (code & 0x3FF))
+    return "\\u%04x" % code
+
+
+def _ensure_ascii(data):
+    # orjson writes UTF-8; jsonify escapes every non-ASCII character, which can only occur inside strings
+    if data.isascii():
+        return data
+    return _NON_ASCII.sub(_escape_char, data.decode()).encode()
+
+
+def dumps(payload):
+    """
+    Encode a response payload (RowSets may appear anywhere in it) to JSON bytes,
+    byte-compatible with jsonify's compact output: keys sorted, non-ASCII escaped.
+    Uses orjson when installed, so ETags and cached bodies do not depend on it.
+    """
+    with phase("serialize"):
+        if orjson is not None:
+            option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_SORT_KEYS
+            return _ensure_ascii(orjson.dumps(payload, default=_default, option=option)) + b"\n"
+        return (json.dumps(payload, default=_default, separators=(",", ":"), sort_keys=True) + "\n").encode()
+
+
+def json_array_chunk(columns, type_codes, rows, first):
+    """
+    One chunk of a JSON array of records streamed in pieces: the records of rows
+    without the surrounding brackets, after a comma unless it is the first chunk.
+    """
+    # Strip the "[" and "]\n" around the encoded chunk to splice the chunks into one array
+    body = dumps(RowSet(columns, type_codes, rows))[1:-2]
+    return body if first else b"," + body
+
+
+def available_formats():
+    return ("json", "columnar", "msgpack") if msgpack is not None else ("json", "columnar")
+
+
+def encode(payload, fmt="json"):
+    """
+    Encode a response payload in the requested format. "columnar" is a JSON
+    object with one array per column and "msgpack" is the same object in
+    MessagePack; both only apply to RowSets, anything else is sent as JSON.
+    """
+    if fmt == "json" or not isinstance(payload, RowSet):
+        return dumps(payload)
+    with phase("serialize"):
+        columns = payload.native_columns()
+        if fmt == "msgpack":
+            return msgpack.packb(columns)
+    return dumps(columns)
+
+
+def mimetype_for(fmt, status):
+    return MSGPACK_MIMETYPE if fmt == "msgpack" and status == 200 else JSON_MIMETYPE
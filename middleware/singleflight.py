@@ -0,0 +1,109 @@
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        """
+        Coalesces concurrent calls that share a key: the first caller runs the
+        function and every caller that arrives while it is in flight waits for
+        and shares its result (or exception).
+        """
+        self._calls = {}
+        self._lock = threading.Lock()
+
+        self._leaders = 0
+        self._coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.followers += 1
+                self._coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self._leaders += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "executed": self._leaders,
+                "coalesced": self._coalesced,
+            }
+
+
+class AsyncSingleFlight:
+    def __init__(self):
+        """
+        SingleFlight for coroutines on one event loop: followers await the
+        leader's future instead of blocking a thread.
+        """
+        self._calls = {}
+
+        self._leaders = 0
+        self._coalesced = 0
+
+    async def do(self, key, fn):
+        future = self._calls.get(key)
+        if future is not None:
+            self._coalesced += 1
+            # shield() so a cancelled follower does not cancel the shared call
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self._leaders += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            # The leader timed out or its client went away; followers still get an answer
+            future.set_exception(RuntimeError("Coalesced query was cancelled"))
+            future.exception()
+            raise
+        except BaseException as error:
+            future.set_exception(error)
+            # Mark the exception retrieved when nobody was waiting for it
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            del self._calls[key]
+        return result
+
+    def stats(self):
+        return {
+            "in_flight": len(self._calls),
+            "executed": self._leaders,
+            "coalesced": self._coalesced,
+        }
@@ -0,0 +1,129 @@
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+import json
+import logging
+import queue
+import random
+import re
+import threading
+
+_WHITESPACE = re.compile(r"\s+")
+# Quoted strings and bare numbers; %(name)s placeholders are left alone
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def normalize_sql(query):
+    """
+    Collapse whitespace and replace inline literals with ? so every run of the
+    same statement shape is grouped together.
+    """
+    return _LITERAL.sub("?", _WHITESPACE.sub(" ", query).strip())
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms=500, explain_sample_rate=0.1, path="slow_queries.log",
+                 max_bytes=10 * 1024 * 1024, backup_count=5, max_tracked=200, explain=None):
+        """
+        Records queries slower than threshold_ms: one JSON line each in a rotating
+        log file, plus per-statement totals for the admin endpoint. A sampled
+        fraction is re-run under EXPLAIN (ANALYZE, BUFFERS) on a background thread.
+        :param max_tracked: Distinct statements kept in memory; the least costly is forgotten first
+        :param explain: explain(query, params) -> plan text; None disables plan capture
+        """
+        self.threshold_ms = threshold_ms
+        self.explain_sample_rate = explain_sample_rate
+        self.max_tracked = max_tracked
+        self.explain = explain
+
+        self._logger = logging.getLogger("slow_queries")
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+        if path and not self._logger.handlers:
+            handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count)
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            self._logger.addHandler(handler)
+
+        self._entries = {}
+        self._lock = threading.Lock()
+        # Bounded so a burst of slow queries cannot pile up EXPLAIN work
+        self._pending = queue.Queue(maxsize=16)
+        self._worker = None
+
+    def observe(self, query, params, rows, seconds):
+        duration_ms = seconds * 1000
+        if self.threshold_ms <= 0 or duration_ms < self.threshold_ms:
+            return
+        normalized = normalize_sql(query)
+        now = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            entry = self._entries.get(normalized)
+            if entry is None:
+                if len(self._entries) >= self.max_tracked:
+                    cheapest = min(self._entries, key=lambda key: self._entries[key]["total_ms"])
+                    del self._entries[cheapest]
+                entry = self._entries[normalized] = {
+                    "sql": normalized, "count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                    "max_rows": 0, "last_params": None, "last_seen": None, "plan": None,
+                }
+            entry["count"] += 1
+            entry["total_ms"] += duration_ms
+            entry["max_ms"] = max(entry["max_ms"], duration_ms)
+            entry["max_rows"] = max(entry["max_rows"], rows)
+            entry["last_params"] = params
+            entry["last_seen"] = now
+
+        self._logger.info(json.dumps({
+            "sql": normalized, "params": params, "rows": rows, "duration_ms": round(duration_ms, 1)
+        }, default=str))
+
+        if self.explain is not None and random.random() < self.explain_sample_rate:
+            self._start_worker()
+            try:
+                self._pending.put_nowait((normalized, query, params))
+            except queue.Full:
+                pass
+
+    def _start_worker(self):
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._explain_pending, name="slow-query-explain", daemon=True)
+                self._worker.start()
+
+    def _explain_pending(self):
+        while True:
+            normalized, query, params = self._pending.get()
+            try:
+                plan = self.explain(query, params)
+            except Exception as e:
+                plan = f"EXPLAIN failed: {e}"
+            with self._lock:
+                if normalized in self._entries:
+                    self._entries[normalized]["plan"] = plan
+            self._logger.info(json.dumps({"sql": normalized, "params": params, "plan": plan}, default=str))
+
+    def top(self, limit=20, sort="total_ms"):
+        """
+        The worst statements by total time (or max_ms, count), with their latest plan.
+        """
+        with self._lock:
+            entries = [dict(entry) for entry in self._entries.values()]
+        for entry in entries:
+            entry["avg_ms"] = round(entry["total_ms"] / entry["count"], 1)
+            entry["total_ms"] = round(entry["total_ms"], 1)
+            entry["max_ms"] = round(entry["max_ms"], 1)
+        entries.sort(key=lambda entry: entry[sort], reverse=True)
+        return entries[:limit]
+
+
+# Installed by the app on startup; execute paths report through observe_query
+_slow_query_log = None
+
+
+def install(log):
+    global _slow_query_log
+    _slow_query_log = log
+
+
+def observe_query(query, params, rows, seconds):
+    if _slow_query_log is not None:
+        _slow_query_log.observe(query, params, rows, seconds)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The middleware modules import each other as siblings, as they do when run from middleware/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,27 @@
+import asyncio
+import os
+
+import pytest
+
+DSN = os.getenv("TEST_DATABASE_URL")
+
+
+def test_window_estimates_pass_each_parameter(monkeypatch):
+    if not DSN:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    asyncpg = pytest.importorskip("asyncpg")
+    # Importing the app sets up its slow query log; keep it from creating a file
+    monkeypatch.setenv("SLOW_QUERY_LOG", "")
+    asgi_app = pytest.importorskip("asgi_app")
+
+    async def estimate():
+        conn = await asyncpg.connect(DSN)
+        try:
+            await asgi_app.init_connection(conn)
+            return await asgi_app.estimate_rows(
+                conn, "SELECT * FROM pg_class WHERE relname = %(name)s OR relname = %(other)s;", {"name": "pg_type", "other": "pg_proc"}
+            )
+        finally:
+            await conn.close()
+
+    assert asyncio.run(estimate()) > 0
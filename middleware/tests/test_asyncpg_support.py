@@ -0,0 +1,100 @@
+from datetime import datetime
+import asyncio
+import os
+
+import pytest
+
+from asyncpg_support import TYPE_CODECS, init_connection, to_asyncpg
+from serialization import NUMERIC_OID, TIMESTAMP_OID, TIMESTAMPTZ_OID, RowSet, dumps, execute_rowset
+
+# Equivalence with psycopg2 needs a scratch Postgres, e.g. postgresql://postgres@localhost/postgres
+DSN = os.getenv("TEST_DATABASE_URL")
+
+INTEGER_OID = 23
+TYPE_OIDS = {'numeric': NUMERIC_OID, 'timestamp': TIMESTAMP_OID, 'timestamptz': TIMESTAMPTZ_OID}
+
+# NUMERIC and timestamp values whose text and JSON forms are easy to get wrong
+VALUES_QUERY = """
+    SELECT *
+    FROM (VALUES
+        (1, 0.00001::numeric, 123456789.000::numeric, NULL::numeric, '2024-12-16 12:30:00'::timestamp,
+         '2024-12-16 12:30:00+00'::timestamptz),
+        (2, -1.5e-12::numeric, 'NaN'::numeric, 100.50::numeric, '2024-12-16 12:30:00.123456'::timestamp,
+         '2024-12-16 14:30:00.5+02'::timestamptz)
+    ) AS v (id, small, large, missing, at, at_tz)
+    ORDER BY id;
+"""
+
+
+def test_placeholders_become_numbered_arguments():
+    query, args = to_asyncpg(
+        "SELECT * FROM t WHERE a = %(a)s AND b BETWEEN %(start)s AND %(end)s AND c = %(a)s",
+        {"end": 3, "a": 1, "start": 2, "unused": 4},
+    )
+    assert query == "SELECT * FROM t WHERE a = $1 AND b BETWEEN $2 AND $3 AND c = $1"
+    assert args == [1, 2, 3]
+
+
+def test_literal_percent_signs_are_unescaped():
+    query, args = to_asyncpg("SELECT 'a%%' LIKE %(pattern)s;", {"pattern": "a%"})
+    assert query == "SELECT 'a%' LIKE $1;"
+    assert args == ["a%"]
+
+
+def test_queries_without_params_are_unchanged():
+    assert to_asyncpg("SELECT 1;") == ("SELECT 1;", [])
+    assert to_asyncpg("SELECT 1;", {}) == ("SELECT 1;", [])
+
+
+def test_timestamp_parameters_accept_url_strings_and_datetimes():
+    encoders = {name: encoder for name, encoder, _ in TYPE_CODECS}
+    assert encoders['timestamp']("2024-12-16 12:30:10") == "2024-12-16 12:30:10"
+    assert encoders['timestamp'](datetime(2024, 12, 16, 12, 30, 10)) == "2024-12-16 12:30:10"
+
+
+@pytest.fixture
+def conn():
+    if not DSN:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    psycopg2 = pytest.importorskip("psycopg2")
+    conn = psycopg2.connect(DSN)
+    yield conn
+    conn.close()
+
+
+def test_codecs_decode_postgres_text_like_psycopg2(conn):
+    expected = execute_rowset(conn, VALUES_QUERY)
+
+    decoders = {TYPE_OIDS[name]: decoder for name, _, decoder in TYPE_CODECS}
+    # asyncpg decodes integers itself, to the same int psycopg2 gives
+    decoders[INTEGER_OID] = int
+
+    # The text Postgres sends each value in, as asyncpg's text-format codecs receive it
+    text_columns = ", ".join(f"{column}::text" for column in expected.columns)
+    text = execute_rowset(conn, f"SELECT {text_columns} FROM ({VALUES_QUERY.rstrip().rstrip(';')}) v ORDER BY id;")
+    rows = [
+        tuple(None if value is None else decoders[type_code](value) for value, type_code in zip(row, expected.type_codes))
+        for row in text.rows
+    ]
+
+    assert rows == expected.rows
+    assert dumps(RowSet(expected.columns, expected.type_codes, rows)) == dumps(expected)
+
+
+def test_asyncpg_rows_serialize_like_psycopg2(conn):
+    asyncpg = pytest.importorskip("asyncpg")
+    expected = execute_rowset(conn, VALUES_QUERY)
+
+    async def fetch():
+        connection = await asyncpg.connect(DSN)
+        try:
+            await init_connection(connection)
+            statement = await connection.prepare(VALUES_QUERY)
+            attributes = statement.get_attributes()
+            return RowSet([a.name for a in attributes], [a.type.oid for a in attributes], await statement.fetch())
+        finally:
+            await connection.close()
+
+    rows = asyncio.run(fetch())
+    assert rows.type_codes == expected.type_codes
+    assert dumps(rows) == dumps(expected)
@@ -0,0 +1,84 @@
+import asyncio
+import json
+
+import pytest
+
+from cost_guard import CostGuard, WindowTooLarge, scanned_rows
+
+
+def scan(relation, rows):
+    return {"Node Type": "Index Scan", "Relation Name": relation, "Plan Rows": rows}
+
+
+def window_plan(source):
+    # Shape of EXPLAIN (FORMAT JSON) for a downsampled window query
+    return [{"Plan": {
+        "Node Type": "Limit", "Plan Rows": 500,
+        "Plans": [{"Node Type": "Subquery Scan", "Plan Rows": 500, "Plans": [
+            {"Node Type": "WindowAgg", "Plan Rows": 14400, "Plans": [
+                {"Node Type": "Sort", "Plan Rows": 14400, "Plans": [source]}
+            ]}
+        ]}],
+    }}]
+
+
+def partitioned_scan(partitions, rows_each, node_type="Append"):
+    return {
+        "Node Type": node_type,
+        "Plan Rows": partitions * rows_each,
+        "Plans": [scan(f"ohlcv_data_p2024{month:02d}", rows_each) for month in range(1, partitions + 1)],
+    }
+
+
+def test_single_table_scan():
+    assert scanned_rows(window_plan(scan("ohlcv_data", 14400))) == 14400
+
+
+def test_partitioned_scans_are_summed():
+    assert scanned_rows(window_plan(partitioned_scan(10, 1440))) == 14400
+
+
+def test_merge_append_is_summed():
+    assert scanned_rows(window_plan(partitioned_scan(3, 1000, "Merge Append"))) == 3000
+
+
+def test_accepts_explain_text():
+    assert scanned_rows(json.dumps(window_plan(partitioned_scan(10, 1440)))) == 14400
+
+
+def test_largest_of_joined_scans():
+    join = {"Node Type": "Nested Loop", "Plan Rows": 10, "Plans": [
+        scan("static_tokens", 20), partitioned_scan(2, 300),
+    ]}
+    assert scanned_rows(window_plan(join)) == 600
+
+
+def test_guard_downgrades_multi_month_window():
+    guard = CostGuard(max_rows=10000)
+    plans = {"raw": window_plan(partitioned_scan(10, 1440)), "rollup": window_plan(scan("ohlcv_data_5m", 2880))}
+    query, _ = guard.choose([("raw", {}), ("rollup", {})], lambda query, params: scanned_rows(plans[query]))
+    assert query == "rollup"
+    assert guard.stats()["downgraded"] == 1
+
+
+def test_guard_rejects_multi_month_window():
+    guard = CostGuard(max_rows=10000)
+    plan = window_plan(partitioned_scan(10, 1440))
+    with pytest.raises(WindowTooLarge) as rejected:
+        guard.choose([("raw", {})], lambda query, params: scanned_rows(plan))
+    assert rejected.value.estimate == 14400
+
+
+def test_achoose_makes_the_same_choice():
+    guard = CostGuard(max_rows=10000)
+    rows = {"raw": 14400, "5m": 12000, "1h": 200}
+
+    async def estimate(query, params):
+        return rows[query]
+
+    candidates = [("raw", {}), ("5m", {}), ("1h", {})]
+    assert asyncio.run(guard.achoose(candidates, estimate)) == guard.choose(candidates, lambda query, params: rows[query])
+    assert guard.stats()["downgraded"] == 2
+    with pytest.raises(WindowTooLarge):
+        asyncio.run(guard.achoose(candidates[:2], estimate))
+    assert guard.stats()["rejected"] == 1
@@ -0,0 +1,183 @@
+from datetime import datetime, timedelta
+import os
+
+import pytest
+
+from hot_cache import HotWindowCache
+from queries import ohlcv_bucket_query
+from serialization import execute_rowset
+
+# Equivalence with the SQL needs a scratch Postgres, e.g. postgresql://postgres@localhost/postgres;
+# the tests only create a temporary ohlcv_data table in their own session
+DSN = os.getenv("TEST_DATABASE_URL")
+
+T0 = datetime(2024, 12, 16, 12, 0)
+MINUTE = timedelta(minutes=1)
+
+OHLCV_DDL = """
+    CREATE TEMP TABLE ohlcv_data (
+        id SERIAL PRIMARY KEY,
+        exchange VARCHAR(50) NOT NULL,
+        symbol VARCHAR(20) NOT NULL,
+        open_price NUMERIC NOT NULL,
+        high_price NUMERIC NOT NULL,
+        low_price NUMERIC NOT NULL,
+        close_price NUMERIC NOT NULL,
+        volume NUMERIC NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        liquidity NUMERIC,
+        network_id INTEGER,
+        UNIQUE (exchange, symbol, timestamp)
+    );
+"""
+
+UPSERT = """
+    INSERT INTO ohlcv_data (exchange, symbol, timestamp, open_price, high_price, low_price, close_price, volume, liquidity)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (exchange, symbol, timestamp) DO UPDATE SET
+        open_price = EXCLUDED.open_price,
+        high_price = EXCLUDED.high_price,
+        low_price = EXCLUDED.low_price,
+        close_price = EXCLUDED.close_price,
+        volume = EXCLUDED.volume,
+        liquidity = EXCLUDED.liquidity;
+"""
+
+
+def prices(i):
+    # Distinct highs and lows at varying NUMERIC scales, so MAX/MIN/SUM are all exercised
+    return (f"{100 + i % 7}.{i % 10}", f"{110 + (i * 3) % 11}.25", f"{90 - i % 5}.125",
+            f"{100 + (i * 5) % 9}.5", f"{i % 4}.{i:03d}", f"{1000 + i}")
+
+
+class Harness:
+    def __init__(self, conn, capacity):
+        self.conn = conn
+        self.cache = HotWindowCache(capacity=capacity, recent_seconds=600)
+
+    def write(self, timestamp, values, exchange="kraken"):
+        with self.conn.cursor() as cur:
+            cur.execute(UPSERT, (exchange, "BTC/USDT", timestamp, *values))
+
+    def refresh(self):
+        self.cache.refresh(lambda query, params: execute_rowset(self.conn, query, params).rows)
+
+    def sql(self, exchanges, start, end, k):
+        params = {"exchanges": exchanges, "symbol": "BTC/USDT", "start": str(start), "end": str(end), "k": k}
+        return execute_rowset(self.conn, ohlcv_bucket_query(), params).rows
+
+    def assert_same(self, start, end, k, exchanges=("kraken",)):
+        rows = self.cache.window(list(exchanges), "BTC/USDT", str(start), str(end), k)
+        assert rows is not None
+        expected = self.sql(list(exchanges), start, end, k)
+        assert rows.rows == [tuple(row) for row in expected]
+        return rows.rows
+
+
+@pytest.fixture
+def harness():
+    if not DSN:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    psycopg2 = pytest.importorskip("psycopg2")
+    conn = psycopg2.connect(DSN)
+    with conn.cursor() as cur:
+        cur.execute(OHLCV_DDL)
+
+    def make(capacity=1440, minutes=30, exchanges=("kraken",)):
+        h = Harness(conn, capacity)
+        for exchange in exchanges:
+            for i in range(minutes):
+                h.write(T0 + i * MINUTE, prices(i), exchange)
+        h.refresh()
+        h.refresh()
+        return h
+
+    yield make
+    conn.rollback()
+    conn.close()
+
+
+def test_span_shorter_than_k_seconds_uses_one_second_buckets(harness):
+    h = harness(minutes=12, exchanges=("kraken", "okx"))
+    # 630 s split 1000 ways would be narrower than a second
+    rows = h.assert_same(T0 - timedelta(seconds=30), T0 + 10 * MINUTE, 1000, exchanges=("okx", "kraken"))
+    assert len(rows) == 22
+
+
+def test_row_at_end_time_is_folded_into_the_last_bucket(harness):
+    h = harness(minutes=6)
+    rows = h.assert_same(T0, T0 + 4 * MINUTE, 4)
+    # Buckets 0-3; the candle at end_time would be bucket 4 and is capped to 3
+    assert len(rows) == 4
+
+
+@pytest.mark.parametrize("start, end, k", [
+    # Every candle starts exactly on a bucket boundary of the production k
+    (T0, T0 + 1000 * MINUTE, 1000),
+    (T0 + 3 * MINUTE, T0 + 53 * MINUTE, 50),
+    # Boundaries at 400 s / 6: T0 + 5 min is delta 200 s, exactly the start of bucket 3
+    (T0 + timedelta(seconds=100), T0 + timedelta(seconds=500), 6),
+    # 120 s / 58: the candle at delta 60 s is exactly bucket 29, which float division puts in 28
+    (T0 + 10 * MINUTE, T0 + 12 * MINUTE, 58),
+    (T0 + timedelta(seconds=30), T0 + timedelta(seconds=30) + 7 * MINUTE, 3),
+])
+def test_rows_on_bucket_boundaries_agree_with_sql(harness, start, end, k):
+    h = harness(minutes=1005)
+    h.assert_same(start, end, k)
+
+
+def test_windows_across_the_ring_buffer_wrap(harness):
+    h = harness(capacity=8, minutes=20)
+    for i in range(20, 25):
+        h.write(T0 + i * MINUTE, prices(i))
+    h.refresh()
+
+    # The ring holds minutes 17-24 and its start has wrapped past the end of the arrays
+    series = h.cache._by_pair[("kraken", "BTC/USDT")][0]
+    assert series.count == 8 and series.start > 0
+    for k in (3, 5, 1000):
+        h.assert_same(T0 + 17 * MINUTE, T0 + 24 * MINUTE, k)
+        h.assert_same(T0 + timedelta(minutes=18, seconds=30), T0 + 23 * MINUTE, k)
+    assert h.cache.window(["kraken"], "BTC/USDT", str(T0 + 16 * MINUTE), str(T0 + 24 * MINUTE), 5) is None
+
+
+def test_out_of_order_and_upserted_candles(harness):
+    h = harness(minutes=30)
+    with h.conn.cursor() as cur:
+        cur.execute("DELETE FROM ohlcv_data WHERE timestamp IN (%s, %s)", (T0 + 10 * MINUTE, T0 + 11 * MINUTE))
+    h.cache = HotWindowCache(capacity=1440, recent_seconds=600)
+    h.refresh()
+
+    # Backfilled minutes arrive after newer ones, with higher ids
+    h.write(T0 + 11 * MINUTE, ("1.5", "999.75", "0.5", "2.5", "7.0", None))
+    h.write(T0 + 10 * MINUTE, ("1.25", "5", "0.25", "2", "3.50", "12"))
+    # Candles rewritten in place keep their id and are only seen through the recent re-read
+    h.write(T0 + 28 * MINUTE, ("42", "43.5", "41", "42.75", "100.125", "7"))
+    h.write(T0 + 29 * MINUTE, ("1", "1", "1", "1", "0", None))
+    h.refresh()
+
+    for k in (1, 4, 7, 1000):
+        h.assert_same(T0, T0 + 29 * MINUTE, k)
+    rows = h.assert_same(T0 + 10 * MINUTE, T0 + 11 * MINUTE, 1000)
+    assert [row[4] for row in rows] == ["5", "999.75"]
+
+
+def test_values_a_float_cannot_hold_go_to_postgres(harness):
+    h = harness(minutes=10)
+    h.write(T0 + 10 * MINUTE, ("100.12345678901234567890", "110", "90", "100", "1", None))
+    h.refresh()
+
+    assert h.cache.window(["kraken"], "BTC/USDT", str(T0), str(T0 + 10 * MINUTE), 1000) is None
+    assert h.cache.stats()["inexact_series"] == 1
+    assert h.sql(["kraken"], T0, T0 + 10 * MINUTE, 1000)[-1][3] == "100.12345678901234567890"
+
+
+def test_inexact_series_are_never_served():
+    # Same check without a database: the warm rows carry NUMERIC as text
+    cache = HotWindowCache(capacity=10)
+    rows = [(i + 1, "kraken", "BTC/USDT", T0 + i * MINUTE, "1.5", "2", "1", "1.5", "3", None, None) for i in range(3)]
+    cache.warm(rows, 3, T0)
+    assert cache.window(["kraken"], "BTC/USDT", str(T0), str(T0 + 2 * MINUTE), 2) is not None
+
+    cache.apply([(4, "kraken", "BTC/USDT", T0 + 3 * MINUTE, "0.1000000000000000055511151231257827", "2", "1", "1", "1", None, None)])
+    assert cache.window(["kraken"], "BTC/USDT", str(T0), str(T0 + 2 * MINUTE), 2) is None
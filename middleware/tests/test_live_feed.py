@@ -0,0 +1,119 @@
+import json
+
+from live_feed import LiveFeed, candle_from_record
+
+
+def shard(shard_id, parent=None, closed=False):
+    description = {'ShardId': shard_id, 'SequenceNumberRange': {'StartingSequenceNumber': '1'}}
+    if parent:
+        description['ParentShardId'] = parent
+    if closed:
+        description['SequenceNumberRange']['EndingSequenceNumber'] = '2'
+    return description
+
+
+def record(timestamp):
+    data = {'exchange': 'binance', 'symbol': 'BTC/USDT', '0': [timestamp, 1, 2, 0.5, 1.5, 10]}
+    return {'PartitionKey': 'ohlcv', 'Data': json.dumps(data).encode()}
+
+
+class FakeKinesis:
+    """
+    Serves a fixed shard list and, per shard, a script of GetRecords pages;
+    a shard is closed after its last page.
+    """
+
+    def __init__(self, shards, pages):
+        self.shards = shards
+        self.pages = pages
+        self.opened = {}
+
+    def describe_stream(self, StreamName, **kwargs):
+        return {'StreamDescription': {'Shards': self.shards, 'HasMoreShards': False}}
+
+    def get_shard_iterator(self, StreamName, ShardId, ShardIteratorType):
+        self.opened[ShardId] = ShardIteratorType
+        return {'ShardIterator': (ShardId, 0)}
+
+    def get_records(self, ShardIterator, Limit):
+        shard_id, page = ShardIterator
+        pages = self.pages.get(shard_id, [[]])
+        response = {'Records': pages[page] if page < len(pages) else []}
+        if page + 1 < len(pages) or shard_id not in self.closing:
+            response['NextShardIterator'] = (shard_id, page + 1)
+        return response
+
+    @property
+    def closing(self):
+        return {s['ShardId'] for s in self.shards if 'EndingSequenceNumber' in s['SequenceNumberRange']}
+
+
+def feed_with_log():
+    feed = LiveFeed('stream', 'us-east-1')
+    published = []
+    feed.publish = published.append
+    return feed, published
+
+
+def test_first_describe_starts_open_shards_at_latest():
+    client = FakeKinesis([shard('old', closed=True), shard('a', parent='old')], {})
+    feed, _ = feed_with_log()
+    iterators, seen = {}, set()
+
+    feed._refresh_shards(client, iterators, seen)
+
+    assert client.opened == {'a': 'LATEST'}
+    assert seen == {'old', 'a'}
+
+
+def test_children_start_at_trim_horizon_once_parent_is_drained():
+    client = FakeKinesis([shard('parent')], {'parent': [[record(60_000)]]})
+    feed, published = feed_with_log()
+    iterators, seen = {}, set()
+    feed._refresh_shards(client, iterators, seen)
+
+    # Split: the parent closes with one more page to read and two children appear
+    client.shards = [shard('parent', closed=True), shard('left', parent='parent'), shard('right', parent='parent')]
+    client.pages = {'parent': [[record(60_000)], [record(120_000)]], 'left': [[record(180_000)]], 'right': [[]]}
+    feed._refresh_shards(client, iterators, seen)
+    assert set(client.opened) == {'parent'}
+
+    assert not feed._read_shards(client, iterators)
+    assert feed._read_shards(client, iterators)
+    assert 'parent' not in iterators
+
+    feed._refresh_shards(client, iterators, seen)
+    assert client.opened == {'parent': 'LATEST', 'left': 'TRIM_HORIZON', 'right': 'TRIM_HORIZON'}
+
+    feed._read_shards(client, iterators)
+    assert [candle['timestamp'] for candle in published] == [
+        'Thu, 01 Jan 1970 00:01:00 GMT',
+        'Thu, 01 Jan 1970 00:02:00 GMT',
+        'Thu, 01 Jan 1970 00:03:00 GMT',
+    ]
+
+
+def test_candles_carry_numeric_columns_as_text_like_the_rest_rows():
+    data = {'exchange': 'kraken', 'symbol': 'PEPE/USDT', 'network_id': None,
+            '0': [1734352200000, 1e-05, 1.25e-05, 9.5e-06, 0.00001, 123456789.0, 42]}
+
+    candle = candle_from_record(data)
+
+    # The text Postgres returns for these values once the consumer has stored them
+    assert candle == {
+        "close_price": "0.00001",
+        "exchange": "kraken",
+        "high_price": "0.0000125",
+        "liquidity": "42",
+        "low_price": "0.0000095",
+        "network_id": None,
+        "open_price": "0.00001",
+        "symbol": "PEPE/USDT",
+        "timestamp": "Mon, 16 Dec 2024 12:30:00 GMT",
+        "volume": "123456789.0",
+    }
+    assert list(candle) == sorted(candle)
+    for column in ("open_price", "high_price", "low_price", "close_price", "volume", "liquidity"):
+        assert isinstance(candle[column], str)
+
+    assert candle_from_record(dict(data, **{'0': data['0'][:6]}))["liquidity"] is None
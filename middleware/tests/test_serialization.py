@@ -0,0 +1,55 @@
+from datetime import datetime
+import json
+
+import pytest
+
+import serialization
+from serialization import NUMERIC_OID, TIMESTAMP_OID, RowSet, dumps
+
+TEXT_OID = 25
+
+
+def reference(payload):
+    # jsonify's compact output: sorted keys, ASCII only
+    return (json.dumps(payload, default=serialization._default, separators=(",", ":"), sort_keys=True) + "\n").encode()
+
+
+@pytest.fixture(params=["orjson", "json"])
+def encoder(request, monkeypatch):
+    if request.param == "orjson":
+        if serialization.orjson is None:
+            pytest.skip("orjson is not installed")
+    else:
+        monkeypatch.setattr(serialization, "orjson", None)
+    return dumps
+
+
+def rowset():
+    return RowSet(
+        ["symbol", "close_price", "exchange", "timestamp"],
+        [TEXT_OID, NUMERIC_OID, TEXT_OID, TIMESTAMP_OID],
+        [
+            ("BTC/USDT", "101.50000000", "kraken", datetime(2024, 12, 16, 12, 30)),
+            ("PEPE/USDT", "0.00001234", "bitfinex €", datetime(2024, 12, 16, 12, 31)),
+        ],
+    )
+
+
+def test_rowset_matches_sorted_compact_json(encoder):
+    rows = rowset()
+    assert encoder(rows) == reference(rows.records())
+    assert encoder(rows).startswith(b'[{"close_price":"101.50000000","exchange":"kraken","symbol":"BTC/USDT",')
+
+
+def test_nested_dict_matches_sorted_compact_json(encoder):
+    payload = {
+        "z": 1,
+        "a": "é",
+        "status": {"pepe": 404, "btc": 200},
+        "results": {"btc": rowset(), "emoji": "🚀"},
+        "error": None,
+    }
+    expected = reference(dict(payload, results={"btc": rowset().records(), "emoji": "🚀"}))
+    assert encoder(payload) == expected
+    assert encoder({"z": 1, "a": "é"}) == b'{"a":"\\u00e9","z":1}\n'
+    assert encoder("🚀") == b'"\\ud83d\\ude80"\n'
@@ -0,0 +1,203 @@
+from datetime import datetime
+import json
+import os
+
+import pytest
+
+from cost_guard import QueryTimeout, WindowTooLarge
+from db_pool import ConnectionPool
+from errors import PoolTimeout
+from queries import OHLCV_FIRST_PAGE, OHLCV_NEXT_PAGE, OHLCV_POINTS
+from response_cache import ResponseCache
+from serialization import RowSet
+from url_params import decode_page_cursor
+from window_api import (
+    LatestTimestamps, WindowBodies, batch_body, batch_specs, cache_headers, collect_stats, ends_before, error_payload,
+    etag_matches, hot_cache_eligible, hot_cache_result, ohlcv_key, page_query, next_page_cursor, parse_batch_spec,
+    window_result
+)
+
+DSN = os.getenv("TEST_DATABASE_URL")
+
+DAY = ("2024-12-16 12:00:00", "2024-12-17 12:00:00")
+MONTH = ("2024-11-16 12:00:00", "2024-12-16 12:00:00")
+
+
+def test_parse_batch_spec_matches_the_get_route_keys():
+    route, key, args = parse_batch_spec({
+        "kind": "ohlcv", "exchanges": ["okx", "kraken"], "symbol": "BTC/USDT",
+        "start": "2024-12-16 12:30:10", "end": "2024-12-17 17:30:10",
+    })
+    assert route == 'ohlcv'
+    assert key == ohlcv_key(["kraken", "okx"], "BTC/USDT", "2024-12-16 12:30:10", "2024-12-17 17:30:10", "bucket")
+    assert args == (["okx", "kraken"], "BTC/USDT", "2024-12-16 12:30:10", "2024-12-17 17:30:10", "bucket")
+
+    route, key, args = parse_batch_spec({"kind": "token_history", "symbol": "Pepe", "start": "a", "end": "b", "network_id": 1})
+    assert (route, key, args) == ('token_history', ('token_history', None, "Pepe", "a", "b", 1), ("Pepe", "a", "b", 1))
+
+
+@pytest.mark.parametrize("spec", [
+    {"kind": "ohlcv", "symbol": "BTC/USDT", "start": "a", "end": "b"},
+    {"kind": "ohlcv", "exchanges": ["okx"], "symbol": "BTC/USDT", "start": "a", "end": "b", "mode": "raw"},
+    {"kind": "dex", "symbol": "WETH/USDC", "start": "a"},
+    {"kind": "dex", "symbol": "WETH/USDC", "start": "a", "end": "b", "network_id": "1"},
+    {"kind": "pairs", "symbol": "WETH/USDC", "start": "a", "end": "b"},
+])
+def test_parse_batch_spec_rejects_invalid_specs(spec):
+    with pytest.raises(ValueError):
+        parse_batch_spec(spec)
+
+
+def test_ends_before():
+    latest = datetime(2024, 12, 17, 12, 0)
+    assert ends_before("2024-12-17 11:59:00", latest)
+    assert not ends_before("2024-12-17 12:00:00", latest)
+    assert not ends_before("not a time", latest)
+    assert not ends_before("2024-12-17 11:59:00", None)
+    # Offsets in the URL are compared in UTC against the naive UTC column
+    assert ends_before("2024-12-17 13:59:00+02:00", latest)
+
+
+def test_latest_timestamps_expire_at_the_next_minute():
+    latest_timestamps = LatestTimestamps(grace_seconds=5)
+    now = 1_699_999_990
+    assert latest_timestamps.get('ohlcv_data', now) == (False, None)
+    latest_timestamps.set('ohlcv_data', None, now)
+    assert latest_timestamps.get('ohlcv_data', now + 50) == (True, None)
+    assert latest_timestamps.get('ohlcv_data', now + 55) == (False, None)
+
+
+def test_cache_headers_and_etag_matching():
+    headers = cache_headers(b"[]\n", True, 86400)
+    assert headers["Cache-Control"] == "public, max-age=86400, immutable"
+    assert cache_headers(b"[]\n", False, 86400)["Cache-Control"] == "no-cache"
+    assert etag_matches(headers["ETag"], headers["ETag"])
+    assert etag_matches('"other", W/' + headers["ETag"], headers["ETag"])
+    assert etag_matches("*", headers["ETag"])
+    assert not etag_matches('"other"', headers["ETag"])
+    assert not etag_matches(None, headers["ETag"])
+
+
+def test_pool_timeouts_are_503():
+    assert error_payload(PoolTimeout("No database connection available after 10s"))[1] == 503
+    assert error_payload(RuntimeError("boom")) == ({"error": "boom"}, 500)
+
+
+def test_pool_timeouts_are_raised_by_an_exhausted_pool():
+    if not DSN:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    pytest.importorskip("psycopg2")
+    pool = ConnectionPool({"dsn": DSN}, min_size=0, max_size=1, acquire_timeout=0.05)
+    try:
+        with pool.connection():
+            with pytest.raises(PoolTimeout) as timeout:
+                pool.getconn()
+        assert error_payload(timeout.value)[1] == 503
+        assert pool.stats()["timeouts"] == 1
+    finally:
+        pool.closeall()
+
+
+def test_parse_batch_spec_rejects_non_objects():
+    with pytest.raises(ValueError):
+        parse_batch_spec(5)
+
+
+def test_window_results_map_to_statuses():
+    rows = RowSet(["id"], [23], [(1,)])
+    assert window_result('ohlcv', (), rows) == (rows, 200)
+    assert window_result('ohlcv', (), RowSet(["id"], [23], [])) == ({"error": "No trading pairs found"}, 404)
+    assert window_result('token_history', ("Pepe", "a", "b", None), [])[0] == {"error": "No token data found for Pepe"}
+    assert window_result('dynamic_pairs', ("Pepe", "WETH", "a", "b"), [])[0] == {
+        "error": "No pairs found for tokens Pepe and WETH in the specified time range"
+    }
+
+    too_large = window_result('ohlcv', (), rejected=WindowTooLarge(5000000, 2000000))
+    assert too_large == ({"error": str(WindowTooLarge(0, 0)), "estimated_rows": 5000000, "max_rows": 2000000}, 413)
+    assert window_result('ohlcv_dex', (), rejected=QueryTimeout('ohlcv_dex', 10000))[1] == 504
+
+
+def test_hot_cache_only_answers_raw_bucket_windows():
+    assert hot_cache_eligible('ohlcv', (["kraken"], "BTC/USDT", *DAY, 'bucket'), use_rollups=True)
+    assert not hot_cache_eligible('ohlcv', (["kraken"], "BTC/USDT", *DAY, 'sample'), use_rollups=True)
+    # A month of 1000 buckets is read from a rollup, which the cache does not hold
+    assert not hot_cache_eligible('ohlcv', (["kraken"], "BTC/USDT", *MONTH, 'bucket'), use_rollups=True)
+    assert hot_cache_eligible('ohlcv', (["kraken"], "BTC/USDT", *MONTH, 'bucket'), use_rollups=False)
+    assert not hot_cache_eligible('token_history', ("Pepe", *DAY, None), use_rollups=True)
+
+
+class RecordingCache:
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = []
+
+    def window(self, *args):
+        self.calls.append(args)
+        return self.rows
+
+
+def test_hot_cache_results():
+    args = (["kraken"], "BTC/USDT", *DAY, 'bucket')
+    assert hot_cache_result(None, 'ohlcv', args, True) is None
+    assert hot_cache_result(RecordingCache(None), 'ohlcv', args, True) is None
+    assert hot_cache_result(RecordingCache([]), 'ohlcv', args, True) == ({"error": "No trading pairs found"}, 404)
+
+    cache = RecordingCache([("row",)])
+    assert hot_cache_result(cache, 'ohlcv', args, True) == ([("row",)], 200)
+    assert cache.calls == [(["kraken"], "BTC/USDT", *DAY, OHLCV_POINTS)]
+    assert hot_cache_result(cache, 'ohlcv', args[:-1] + ('sample',), True) is None
+    assert len(cache.calls) == 1
+
+
+def test_window_bodies_keep_only_successful_results():
+    bodies = WindowBodies(ResponseCache(1 << 20), historical_max_age=86400, grace_seconds=5)
+    assert bodies.store(('ohlcv', 'a', 'json'), ({"error": "No trading pairs found"}, 404), False)[1] == 404
+    assert bodies.get(('ohlcv', 'a', 'json')) is None
+
+    body, status = bodies.store(('ohlcv', 'b', 'columnar'), (RowSet(["id"], [23], [(1,), (2,)]), 200), True)
+    assert (json.loads(body), status) == ({"id": [1, 2]}, 200)
+    assert bodies.get(('ohlcv', 'b', 'columnar')) == (body, 200)
+
+
+@pytest.mark.parametrize("body, error", [
+    (None, "queries must be a non-empty list"),
+    ([1, 2], "queries must be a non-empty list"),
+    ({"queries": []}, "queries must be a non-empty list"),
+    ({"queries": [{}] * 3}, "At most 2 queries per batch"),
+    ({"queries": [{"id": 1}, {"id": "1"}]}, "Query ids must be unique"),
+])
+def test_batch_specs_rejects_invalid_batches(body, error):
+    with pytest.raises(ValueError, match=error):
+        batch_specs(body, max_queries=2)
+
+
+def test_batch_body_splices_encoded_bodies():
+    specs, ids = batch_specs({"queries": [{"id": "btc"}, 5]}, max_queries=2)
+    assert ids == ["btc", "1"]
+    body = batch_body([("btc", b'[{"a":1}]\n', 200), ("1", b'{"error":"Each query must be an object"}\n', 400)])
+    assert json.loads(body) == {
+        "results": {"btc": [{"a": 1}], "1": {"error": "Each query must be an object"}},
+        "status": {"btc": 200, "1": 400},
+    }
+    assert body.endswith(b"}\n")
+
+
+def test_page_queries_and_cursors():
+    assert page_query(None, None, 10000) is None
+    assert page_query(None, 50000, 10000) == (OHLCV_FIRST_PAGE, {"limit": 10000})
+    assert page_query(None, 0, 10000) == (OHLCV_FIRST_PAGE, {"limit": 1000})
+    with pytest.raises(ValueError):
+        page_query("not a cursor", 10, 10000)
+
+    rows = RowSet(["id", "timestamp"], [23, 1114], [(7, datetime(2024, 12, 16, 12, 0)), (9, datetime(2024, 12, 16, 12, 1))])
+    assert next_page_cursor(rows, 3) is None
+    cursor = next_page_cursor(rows, 2)
+    assert decode_page_cursor(cursor) == ("2024-12-16T12:01:00", 9)
+    assert page_query(cursor, 2, 10000) == (OHLCV_NEXT_PAGE, {"timestamp": "2024-12-16T12:01:00", "id": 9, "limit": 2})
+
+
+def test_collect_stats():
+    stats = collect_stats({"size": 1}, response_cache=ResponseCache(10), hot_cache=None)
+    assert list(stats) == ["db_pool", "response_cache", "hot_cache"]
+    assert stats["db_pool"] == {"size": 1} and stats["hot_cache"] is None
+    assert stats["response_cache"]["entries"] == 0
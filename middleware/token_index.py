@@ -0,0 +1,133 @@
+from bisect import bisect_left
+import threading
+
+TOKENS_QUERY = "SELECT * FROM static_tokens;"
+# Changes whenever static_tokens is written to (fetch_and_insert.py), without reading the table
+VERSION_QUERY = """
+    SELECT n_tup_ins + n_tup_upd + n_tup_del
+    FROM pg_stat_user_tables
+    WHERE relname = 'static_tokens';
+"""
+
+
+def _prefixed(keys, prefix):
+    # Positions in a sorted [(key, i)] list whose key starts with prefix
+    for j in range(bisect_left(keys, (prefix,)), len(keys)):
+        key, i = keys[j]
+        if not key.startswith(prefix):
+            break
+        yield i
+
+
+class TokenIndex:
+    def __init__(self, max_results=20):
+        """
+        In-memory copy of static_tokens, so /api/dynamic_pairs resolves symbols and
+        /api/tokens/search answers without a query. Filled by refresh()/arefresh(),
+        which reload it only when the table's version has changed.
+        :param max_results: Upper bound on search() results
+        """
+        self.max_results = max_results
+
+        self.ready = False
+        self.version = None
+        self._tokens = []
+        self._by_symbol = {}
+        self._symbols = []
+        self._names = []
+        self._addresses = []
+        self._lock = threading.Lock()
+
+        self._loads = 0
+
+    def load(self, records, version):
+        """
+        Replace the index with static_tokens records (dicts). Duplicate rows of one
+        (network_id, address) are kept once; the first row of a symbol wins, as with
+        the LIMIT 1 lookup it replaces.
+        """
+        tokens, seen, by_symbol = [], set(), {}
+        for record in records:
+            identity = (record.get("network_id"), record.get("address"))
+            if identity in seen:
+                continue
+            seen.add(identity)
+            tokens.append(record)
+            if record.get("symbol") is not None:
+                by_symbol.setdefault(record["symbol"], record)
+
+        def keys(column):
+            return sorted((token[column].lower(), i) for i, token in enumerate(tokens) if token.get(column))
+
+        symbols, names, addresses = keys("symbol"), keys("name"), keys("address")
+        with self._lock:
+            self._tokens = tokens
+            self._by_symbol = by_symbol
+            self._symbols, self._names, self._addresses = symbols, names, addresses
+            self.version = version
+            self.ready = True
+            self._loads += 1
+
+    def refresh(self, fetch):
+        """
+        Reload when static_tokens has changed since the last load.
+        :param fetch: fetch(query, params) -> RowSet
+        """
+        rows = fetch(VERSION_QUERY, None).rows
+        version = rows[0][0] if rows else None
+        if not self.ready or version is None or version != self.version:
+            self.load(fetch(TOKENS_QUERY, None).records(), version)
+
+    async def arefresh(self, fetch):
+        """
+        refresh() for a coroutine fetch(query, params).
+        """
+        rows = (await fetch(VERSION_QUERY, None)).rows
+        version = rows[0][0] if rows else None
+        if not self.ready or version is None or version != self.version:
+            self.load((await fetch(TOKENS_QUERY, None)).records(), version)
+
+    def by_symbol(self, symbol):
+        """
+        The static_tokens record for symbol, or None.
+        """
+        with self._lock:
+            return self._by_symbol.get(symbol)
+
+    def search(self, text, limit=None, network_id=None):
+        """
+        Tokens whose symbol, name or address starts with text (case-insensitive):
+        exact symbol matches first, then symbol, name and address prefixes.
+        """
+        prefix = text.strip().lower()
+        limit = min(limit or self.max_results, self.max_results)
+        if not prefix:
+            return []
+        with self._lock:
+            tokens = self._tokens
+            candidates = (
+                [i for i in _prefixed(self._symbols, prefix) if tokens[i]["symbol"].lower() == prefix],
+                _prefixed(self._symbols, prefix),
+                _prefixed(self._names, prefix),
+                _prefixed(self._addresses, prefix),
+            )
+            results, seen = [], set()
+            for group in candidates:
+                for i in group:
+                    if i in seen or (network_id is not None and tokens[i].get("network_id") != network_id):
+                        continue
+                    seen.add(i)
+                    results.append(tokens[i])
+                    if len(results) >= limit:
+                        return results
+            return results
+
+    def stats(self):
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "tokens": len(self._tokens),
+                "symbols": len(self._by_symbol),
+                "version": self.version,
+                "loads": self._loads,
+            }
@@ -0,0 +1,54 @@
+import base64
+
+from metrics import phase
+
+
+def unhash_str(hashed_string):
+    """
+    Unhash a string back into an url-safe string.
+    """
+    try:
+        with phase("decode"):
+            padding = len(hashed_string) % 4
+            if padding:
+                hashed_string += '=' * (4 - padding)
+            decoded = base64.urlsafe_b64decode(hashed_string).decode()
+        return decoded
+    except Exception as e:
+        return None
+
+def hash_str(string):
+    """
+    Hash a string into an url-safe string (inverse of unhash_str).
+    """
+    return base64.urlsafe_b64encode(string.encode()).decode().rstrip('=')
+
+def encode_page_cursor(row):
+    """
+    Encode the (timestamp, id) keyset position of the last row of a page.
+    """
+    return hash_str(f"{row['timestamp'].isoformat()},{row['id']}")
+
+def decode_page_cursor(token):
+    """
+    Decode a page cursor back into (timestamp, id), or None if it is invalid.
+    """
+    try:
+        timestamp, row_id = unhash_str(token).rsplit(",", 1)
+        return timestamp, int(row_id)
+    except Exception as e:
+        return None
+
+def unhash_list(hashed_string):
+    """
+    Unhash a string back into a list of exchanges.
+    """
+    try:
+        with phase("decode"):
+            padding = len(hashed_string) % 4
+            if padding:
+                hashed_string += '=' * (4 - padding)
+            decoded = base64.urlsafe_b64decode(hashed_string).decode()
+        return decoded.split(",")
+    except Exception as e:
+        return None
@@ -0,0 +1,283 @@
+from datetime import datetime, timezone
+import hashlib
+import threading
+import time
+
+from errors import PoolTimeout
+from metrics import phase, record_rows
+from queries import OHLCV_FIRST_PAGE, OHLCV_NEXT_PAGE, OHLCV_POINTS, pick_ohlcv_table
+from response_cache import next_minute_boundary
+from serialization import dumps, encode
+from url_params import decode_page_cursor, encode_page_cursor
+
+# Table whose newest row decides whether a window of each route is historical
+HISTORY_TABLES = {
+    'ohlcv': 'ohlcv_data',
+    'ohlcv_dex': 'ohlcv_data',
+    'dynamic_pairs': 'dynamic_pairs',
+    'token_history': 'dynamic_tokens',
+}
+
+WINDOW_MODES = ('bucket', 'sample')
+
+PAGE_LIMIT_DEFAULT = 1000
+
+
+def ohlcv_key(exchanges, symbol, sTime, eTime, mode):
+    return ('ohlcv', tuple(sorted(exchanges)), symbol, sTime, eTime, None, mode)
+
+
+def ohlcv_dex_key(symbol, sTime, eTime, network_id):
+    return ('ohlcv_dex', None, symbol, sTime, eTime, network_id)
+
+
+def token_history_key(token, sTime, eTime, network_id):
+    return ('token_history', None, token, sTime, eTime, network_id)
+
+
+def parse_batch_spec(spec):
+    """
+    Validate one /api/batch query and return (route, cache key, args) for it, where
+    args are the route's window builder arguments (queries.window_candidates).
+    Raises ValueError for an invalid spec.
+    """
+    if not isinstance(spec, dict):
+        raise ValueError("Each query must be an object")
+    kind = spec.get("kind")
+    symbol = spec.get("symbol")
+    sTime = spec.get("start")
+    eTime = spec.get("end")
+    network_id = spec.get("network_id")
+    if not all([symbol, sTime, eTime]):
+        raise ValueError("symbol, start and end are required")
+    if network_id is not None and not isinstance(network_id, int):
+        raise ValueError("network_id must be an integer")
+
+    if kind == "ohlcv":
+        exchanges = spec.get("exchanges")
+        mode = spec.get("mode", "bucket")
+        if not exchanges or not isinstance(exchanges, list):
+            raise ValueError("exchanges must be a non-empty list")
+        if mode not in WINDOW_MODES:
+            raise ValueError("Invalid mode")
+        return 'ohlcv', ohlcv_key(exchanges, symbol, sTime, eTime, mode), (exchanges, symbol, sTime, eTime, mode)
+    if kind == "dex":
+        return 'ohlcv_dex', ohlcv_dex_key(symbol, sTime, eTime, network_id), (symbol, sTime, eTime, network_id)
+    if kind == "token_history":
+        return 'token_history', token_history_key(symbol, sTime, eTime, network_id), (symbol, sTime, eTime, network_id)
+    raise ValueError("kind must be one of ohlcv, dex, token_history")
+
+
+def batch_specs(body, max_queries):
+    """
+    Validate an /api/batch body and return (specs, ids), each id defaulting to the
+    spec's position. Raises ValueError when the batch as a whole is invalid.
+    """
+    specs = body.get("queries") if isinstance(body, dict) else None
+    if not isinstance(specs, list) or not specs:
+        raise ValueError("queries must be a non-empty list")
+    if len(specs) > max_queries:
+        raise ValueError(f"At most {max_queries} queries per batch")
+
+    ids = [str(spec.get("id", i)) if isinstance(spec, dict) else str(i) for i, spec in enumerate(specs)]
+    if len(set(ids)) != len(ids):
+        raise ValueError("Query ids must be unique")
+    return specs, ids
+
+
+def batch_body(results):
+    """
+    /api/batch response body from (id, encoded JSON body, status) per query. The
+    bodies, usually straight from the response cache, are spliced in as-is.
+    """
+    entries = [dumps(spec_id)[:-1] + b":" + body.rstrip(b"\n") for spec_id, body, _ in results]
+    statuses = {spec_id: status for spec_id, _, status in results}
+    return b'{"results":{' + b",".join(entries) + b'},"status":' + dumps(statuses)[:-1] + b"}\n"
+
+
+def not_found_message(route, args):
+    if route == 'dynamic_pairs':
+        return f"No pairs found for tokens {args[0]} and {args[1]} in the specified time range"
+    if route == 'token_history':
+        return f"No token data found for {args[0]}"
+    return "No trading pairs found"
+
+
+def window_result(route, args, rows=None, rejected=None):
+    """
+    (payload, status) of a window query: its rows, a 404 when there are none, or
+    the 413/504 of the cost_guard.QueryRejected that stopped it.
+    """
+    if rejected is not None:
+        return rejected.payload(), rejected.status
+    if not rows:
+        return {"error": not_found_message(route, args)}, 404
+    return rows, 200
+
+
+def hot_cache_eligible(route, args, use_rollups):
+    """
+    True for bucketed /api/ohlcv windows that would be read from ohlcv_data itself,
+    the only ones HotWindowCache can hold.
+    """
+    if route != 'ohlcv':
+        return False
+    _, _, start, end, mode = args
+    return mode == 'bucket' and (not use_rollups or pick_ohlcv_table(start, end, OHLCV_POINTS) == "ohlcv_data")
+
+
+def hot_cache_result(hot_cache, route, args, use_rollups):
+    """
+    window_result for a window answered from hot_cache, or None when the window
+    has to be queried from Postgres.
+    """
+    if hot_cache is None or not hot_cache_eligible(route, args, use_rollups):
+        return None
+    exchanges, symbol, start, end, _ = args
+    with phase("sample"):
+        rows = hot_cache.window(exchanges, symbol, start, end, OHLCV_POINTS)
+    if rows is None:
+        return None
+    record_rows(len(rows))
+    return window_result(route, args, rows)
+
+
+class WindowBodies:
+    def __init__(self, response_cache, historical_max_age, grace_seconds):
+        """
+        Encoded window responses in a ResponseCache, keyed by window key and format.
+        Only successful responses are kept, until the next minute boundary (plus
+        grace_seconds) when ohlcvProducer publishes a new candle, or for
+        historical_max_age when the window is entirely in the past.
+        """
+        self.response_cache = response_cache
+        self.historical_max_age = historical_max_age
+        self.grace_seconds = grace_seconds
+
+    def get(self, key):
+        return self.response_cache.get(key)
+
+    def store(self, key, result, historical):
+        """
+        Encode a window result (payload, status) in the format key ends with and
+        return (body, status).
+        """
+        payload, status = result
+        body = encode(payload, key[-1])
+        if status == 200:
+            if historical:
+                expires_at = time.time() + self.historical_max_age
+            else:
+                expires_at = next_minute_boundary(grace_seconds=self.grace_seconds)
+            self.response_cache.set(key, body, status, expires_at)
+        return body, status
+
+
+def page_query(cursor, limit, limit_max):
+    """
+    (query, params) for one keyset page of ohlcv_data ordered by (timestamp, id),
+    or None to stream the whole table when neither cursor nor limit is given.
+    Raises ValueError for an invalid cursor.
+    """
+    if cursor is None and limit is None:
+        return None
+    limit = min(max(limit or PAGE_LIMIT_DEFAULT, 1), limit_max)
+    if cursor is None:
+        return OHLCV_FIRST_PAGE, {"limit": limit}
+    position = decode_page_cursor(cursor)
+    if position is None:
+        raise ValueError("Invalid cursor parameter")
+    return OHLCV_NEXT_PAGE, {"timestamp": position[0], "id": position[1], "limit": limit}
+
+
+def next_page_cursor(rows, limit):
+    """
+    X-Next-Cursor for a page RowSet, or None when it was the last page.
+    """
+    if len(rows) < limit:
+        return None
+    return encode_page_cursor(dict(zip(rows.columns, rows.rows[-1])))
+
+
+class LatestTimestamps:
+    def __init__(self, grace_seconds):
+        """
+        Newest timestamp per table, memoized until the next minute boundary (plus
+        grace_seconds) when ohlcvProducer publishes a new candle. The apps fetch
+        the value on a miss and store it here.
+        """
+        self.grace_seconds = grace_seconds
+        self._memo = {}
+        self._lock = threading.Lock()
+
+    def get(self, table, now=None):
+        """
+        (True, latest) while the memo for table is fresh, else (False, None).
+        """
+        with self._lock:
+            cached = self._memo.get(table)
+        if cached is not None and cached[0] > (time.time() if now is None else now):
+            return True, cached[1]
+        return False, None
+
+    def set(self, table, latest, now=None):
+        with self._lock:
+            self._memo[table] = (next_minute_boundary(now, self.grace_seconds), latest)
+
+
+def _as_naive_utc(value):
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def ends_before(end_time, latest):
+    """
+    True when a window ending at end_time (as decoded from the URL) ends before
+    latest, the newest row of its table, so its response can no longer change.
+    """
+    try:
+        end = _as_naive_utc(datetime.fromisoformat(end_time))
+    except (TypeError, ValueError):
+        return False
+    return latest is not None and end < _as_naive_utc(latest)
+
+
+def cache_headers(body, historical, max_age):
+    """
+    ETag and Cache-Control for a successful response. Fully historical windows are
+    public and immutable for max_age seconds; live windows must revalidate.
+    """
+    return {
+        "ETag": '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"',
+        "Cache-Control": f"public, max-age={max_age}, immutable" if historical else "no-cache",
+    }
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = (tag.strip() for tag in if_none_match.split(","))
+    return any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in tags)
+
+
+def collect_stats(db_pool, **components):
+    """
+    /api/stats: db_pool, the pool's own stats dict, then stats() of each other
+    component (None for one that is disabled).
+    """
+    stats = {"db_pool": db_pool}
+    for name, component in components.items():
+        stats[name] = component.stats() if component is not None else None
+    return stats
+
+
+def error_payload(error):
+    """
+    (payload, status) for an exception a route did not handle itself.
+    """
+    if isinstance(error, PoolTimeout):
+        return {"error": str(error)}, 503
+    return {"error": str(error)}, 500